@@ -0,0 +1,399 @@
+"""Strömmande sort-merge-join av energimätningar och spotpriser.
+
+Båda strömmarna kommer sorterade på timestamp från PostgREST och läses sida
+för sida. Energin är lokal tid (fake-UTC) och priserna riktig UTC, så ett
+pris för lokal timme H har alltid UTC < H. Priser läses därför in tills
+nästa pris ligger på eller efter energiradens timme, och timmar som
+energiströmmen passerat släpps – bara ett par timmars priser hålls i minnet.
+
+Samma motor används av /api/daily (timmedelpris) och /api/monthly (15-min
+pris, timvisa priser fyller övriga kvarter) så att prissättningen inte
+glider isär mellan endpoints.
+
+daily_totals()/monthly_totals() låter i första hand databasen aggregera
+(SQL-funktionerna daily_rollup/monthly_rollup i supabase_schema.sql, via
+rpc). Saknas funktionerna eller misslyckas anropet aggregeras rådata här,
+sida för sida med NumPy (_vectorized) när det finns installerat och annars
+rad för rad i ren Python. AGGREGATE_BACKEND väljer väg: auto/sql (SQL först),
+numpy eller python (bara lokalt). Månader som flyttats till Parquet-arkivet
+(_archive) läses därifrån och aggregeras alltid lokalt.
+"""
+from datetime import datetime, timedelta
+import sys
+import os
+sys.path.insert(0, os.path.dirname(__file__))
+from _pagination import Prefetcher, iter_pages, iter_pages_parallel
+from _devices import load_devices, describe
+import _vectorized
+import _archive
+from _timebuckets import (QUARTERS_PER_DAY, QUARTERS_PER_HOUR, quarter_index, hour_index,
+                          local_quarter, day_string, month_string)
+
+AGGREGATE_BACKEND = os.environ.get("AGGREGATE_BACKEND", "auto")   # auto | sql | numpy | python
+
+# Fält per dag och enhet i daily_totals / daily_summaries
+SUMMARY_FIELDS = ("device_name", "kwh", "cost", "readings", "active_intervals",
+                  "cost_15m", "kwh_priced", "kwh_price_sum")
+_FLOAT_FIELDS = ("kwh", "cost", "cost_15m", "kwh_priced", "kwh_price_sum")
+
+_sql = {"enabled": AGGREGATE_BACKEND in ("auto", "sql")}
+
+DAILY_COLUMNS = "device_key, timestamp, current_value, delta_power"
+MONTHLY_COLUMNS = "device_key, timestamp, current_value"
+
+
+class PriceWindow:
+    """Prisuppslag för de lokala timmar energiströmmen just passerar.
+
+    Ger samma värden som uppslag i tabeller byggda av alla priser i
+    intervallet: timmedelpris per lokal timme och 15-min pris där senaste
+    priset vinner och ett timpris (:00) fyller kvarter som saknar eget pris.
+    Timmar och kvarter är heltalsindex från _timebuckets.
+    """
+    def __init__(self, price_rows):
+        self._rows = iter(price_rows)
+        self._next = next(self._rows, None)
+        self._hour = None
+        self._hour_sum = {}
+        self._hour_count = {}
+        self._quarter = {}
+
+    def advance(self, hour: int):
+        """Gå till lokalt timindex `hour` (stigande)."""
+        if hour == self._hour:
+            return
+        self._hour = hour
+        self.evict_before(hour)
+        self.load_until(hour)
+
+    def evict_before(self, hour: int):
+        """Släpp timmar som energiströmmen redan passerat."""
+        first_quarter = hour * QUARTERS_PER_HOUR
+        for table in (self._hour_sum, self._hour_count):
+            for h in [h for h in table if h < hour]:
+                del table[h]
+        for q in [q for q in self._quarter if q < first_quarter]:
+            del self._quarter[q]
+
+    def load_until(self, hour: int):
+        """Läs alla priser som kan höra till lokala timmar t.o.m. `hour`."""
+        # Priser med UTC före timmen – senare priser hamnar lokalt efter den
+        while self._next is not None and hour_index(self._next["timestamp"]) < hour:
+            self._add(self._next)
+            self._next = next(self._rows, None)
+
+    def _add(self, p):
+        ore = p["price_sek"]   # redan i öre/kWh i databasen
+        q = local_quarter(p["timestamp"])   # UTC → svensk lokal tid
+        h = q // QUARTERS_PER_HOUR
+        self._hour_sum[h] = self._hour_sum.get(h, 0) + ore
+        self._hour_count[h] = self._hour_count.get(h, 0) + 1
+
+        self._quarter[q] = ore
+        if q % QUARTERS_PER_HOUR == 0:   # timvisa priser: pre-fyll övriga kvarter
+            for qk in (q + 1, q + 2, q + 3):
+                if qk not in self._quarter:
+                    self._quarter[qk] = ore
+
+    def hour_price(self, hour: int):
+        """Medelpris (öre/kWh) för lokalt timindex, eller None."""
+        count = self._hour_count.get(hour)
+        return self._hour_sum[hour] / count if count else None
+
+    def quarter_price(self, quarter: int):
+        """15-min pris (öre/kWh) för lokalt kvartsindex, eller None."""
+        return self._quarter.get(quarter)
+
+
+def join_prices(energy_pages, price_pages):
+    """Merge-join: ger (energirad, kvartsindex, timmedelpris, 15-min pris) i
+    energiordning. Priserna är None när de saknas."""
+    window = PriceWindow(row for page in price_pages for row in page)
+    for page in energy_pages:
+        for r in page:
+            q = quarter_index(r["timestamp"])
+            h = q // QUARTERS_PER_HOUR
+            window.advance(h)
+            yield r, q, window.hour_price(h), window.quarter_price(q)
+
+
+def _open_streams(db, columns: str, from_ts: str, to_ts: str = None,
+                  to_exclusive: bool = False) -> tuple:
+    """Starta hämtningen av energi- och prissidor för [from_ts, to_ts] (fake-UTC).
+
+    Returnerar (energisidor, prissidor); båda hämtas i bakgrunden och
+    prissidorna måste stängas med close().
+    """
+    # Spotpriser i riktig UTC → börja 2h tidigt för CET/CEST. Priser med UTC
+    # efter to_ts hamnar lokalt efter sista mätningen och behövs inte.
+    price_from_ts = (datetime.fromisoformat(from_ts[:19]) - timedelta(hours=2)).isoformat()
+
+    def build_prices():
+        q = (db.table("spot_prices")
+             .select("timestamp, price_area, price_sek")
+             .gte("timestamp", price_from_ts))
+        if to_ts:
+            q = q.lt("timestamp", to_ts) if to_exclusive else q.lte("timestamp", to_ts)
+        return q
+
+    prices = Prefetcher(iter_pages(build_prices, tiebreak="price_area"))
+    return _energy_pages(db, columns, from_ts, to_ts, to_exclusive), prices
+
+
+def _archived_in(db, from_ts: str, to_ts: str = None) -> list:
+    """Pruned månader (bara i arkivet) som kan överlappa [from_ts, to_ts], sorterade."""
+    return sorted(m for m in _archive.pruned_months(db)
+                  if m >= from_ts[:7] and (to_ts is None or m <= to_ts[:7]))
+
+
+def _energy_pages(db, columns: str, from_ts: str, to_ts: str = None, to_exclusive: bool = False):
+    """Energisidor för [from_ts, to_ts] i (timestamp, device_key)-ordning.
+    Pruned månader läses ur arkivet, resten pagineras från energy_readings."""
+    def hot(lo, hi, hi_exclusive):
+        def build_energy(count=None):
+            q = (db.table("energy_readings")
+                 .select(columns, count=count)
+                 .gte("timestamp", lo))
+            if hi:
+                q = q.lt("timestamp", hi) if hi_exclusive else q.lte("timestamp", hi)
+            return q
+        return iter_pages_parallel(build_energy, lo, hi)
+
+    archived = _archived_in(db, from_ts, to_ts)
+    if not archived:
+        return hot(from_ts, to_ts, to_exclusive)
+
+    def segments():
+        store = _archive.get_store()
+        if store is None:
+            raise RuntimeError("arkiverade månader kräver ARCHIVE_DIR eller ARCHIVE_BUCKET")
+        lo = from_ts
+        for mon in archived:
+            start, end = _archive.month_range(mon)
+            if lo[:19] < start:
+                yield from hot(lo, start, True)
+            if to_ts and to_ts[:19] < end:
+                yield from _archive.month_pages(db, store, mon, columns, max(lo[:19], start),
+                                                to_ts, to_exclusive)
+                return
+            yield from _archive.month_pages(db, store, mon, columns, max(lo[:19], start), end)
+            lo = end
+        yield from hot(lo, to_ts, to_exclusive)
+    return segments()
+
+
+def priced_readings(db, columns: str, from_ts: str, to_ts: str = None,
+                    to_exclusive: bool = False):
+    """Energimätningar i [from_ts, to_ts] (fake-UTC) med priser, som join_prices.
+    to_exclusive=True gör övre gränsen öppen."""
+    energy, prices = _open_streams(db, columns, from_ts, to_ts, to_exclusive)
+    try:
+        yield from join_prices(energy, prices)
+    finally:
+        prices.close()
+
+
+def _use_numpy() -> bool:
+    return AGGREGATE_BACKEND != "python" and _vectorized.available()
+
+
+def _rollup_rpc(db, fn: str, params: dict):
+    """Anropa en aggregeringsfunktion i databasen. None om den inte finns
+    eller anropet misslyckas – då aggregeras rådata lokalt i stället."""
+    if not _sql["enabled"] or _archived_in(db, params["from_ts"], params["to_ts"]):
+        return None   # (arkiverade månader finns inte längre i databasen)
+    try:
+        return db.rpc(fn, params).execute().data
+    except Exception as e:
+        if "PGRST202" in str(e):   # funktionen saknas – schemat är inte uppdaterat
+            _sql["enabled"] = False
+        return None
+
+
+def _grouped_pages(db, columns: str, from_ts: str, to_ts: str, to_exclusive: bool,
+                   with_activity: bool):
+    """Grupper från _vectorized.page_groups för varje energisida, i ordning."""
+    energy, prices = _open_streams(db, columns, from_ts, to_ts, to_exclusive)
+    try:
+        window = PriceWindow(row for page in prices for row in page)
+        for page in energy:
+            yield from _vectorized.page_groups(page, window, with_activity)
+    finally:
+        prices.close()
+
+
+def _new_day() -> dict:
+    return {"kwh": 0, "cost": 0, "readings": 0, "active_intervals": 0,
+            "cost_15m": 0.0, "kwh_priced": 0.0, "kwh_price_sum": 0.0}
+
+
+def _new_month() -> dict:
+    return {"kwh": 0.0, "cost": 0.0, "kwh_priced": 0.0, "wp": 0.0}
+
+
+def _name_days(daily: dict, devices: dict) -> dict:
+    """{dagindex: {device_key: summor}} → {dag: {device_id: {device_name, summor}}}."""
+    named = {}
+    for day, by_key in daily.items():
+        out = named[day_string(day)] = {}
+        for key, sums in by_key.items():
+            d = describe(devices, key)
+            out[d["device_id"]] = {"device_name": d["device_name"], **sums}
+    return named
+
+
+def _name_months(monthly: dict, devices: dict) -> dict:
+    """{månad: {device_key: summor}} → {månad: {device_name: summor}}.
+    Enheter med samma namn slås ihop."""
+    named = {}
+    for mon, by_key in monthly.items():
+        out = named[mon] = {}
+        for key, sums in by_key.items():
+            name = describe(devices, key)["device_name"]
+            d = out.get(name)
+            if d is None:
+                out[name] = dict(sums)
+            else:
+                for f, v in sums.items():
+                    d[f] += v
+    return named
+
+
+def daily_totals(db, from_ts: str, to_ts: str = None) -> dict:
+    """{dag: {device_id: {fält i SUMMARY_FIELDS}}} för [from_ts, to_ts] (se aggregate_daily)."""
+    rows = _rollup_rpc(db, "daily_rollup", {"from_ts": from_ts, "to_ts": to_ts})
+    if rows is not None:
+        return daily_from_rollup(rows)
+
+    devices = load_devices(db)   # namnen slås upp en gång per anrop
+    if not _use_numpy():
+        return aggregate_daily(priced_readings(db, DAILY_COLUMNS, from_ts, to_ts), devices)
+
+    return aggregate_daily_groups(
+        _grouped_pages(db, DAILY_COLUMNS, from_ts, to_ts, False, True), devices)
+
+
+def monthly_totals(db, from_ts: str, to_ts: str) -> tuple:
+    """({månad: {device_name: {kwh, cost, kwh_priced, wp}}}, {månad: mätningar})
+    för [from_ts, to_ts) (se aggregate_monthly)."""
+    rows = _rollup_rpc(db, "monthly_rollup", {"from_ts": from_ts, "to_ts": to_ts})
+    if rows is not None:
+        return monthly_from_rollup(rows)
+
+    devices = load_devices(db)
+    if not _use_numpy():
+        return aggregate_monthly(priced_readings(db, MONTHLY_COLUMNS, from_ts, to_ts, True), devices)
+
+    return aggregate_monthly_groups(
+        _grouped_pages(db, MONTHLY_COLUMNS, from_ts, to_ts, True, False), devices)
+
+
+def daily_from_rollup(rows: list) -> dict:
+    """Rader från SQL-funktionen daily_rollup → samma resultat som aggregate_daily."""
+    daily = {}
+    for r in rows:
+        v = {f: r[f] for f in SUMMARY_FIELDS}
+        for f in _FLOAT_FIELDS:
+            v[f] = float(v[f])
+        daily.setdefault(r["day"], {})[r["device_id"]] = v
+    return daily
+
+
+def monthly_from_rollup(rows: list) -> tuple:
+    """Rader från SQL-funktionen monthly_rollup → samma resultat som aggregate_monthly."""
+    monthly = {}
+    readings_by_month = {}
+    for r in rows:
+        monthly.setdefault(r["month"], {})[r["device_name"]] = {
+            f: float(r[f]) for f in ("kwh", "cost", "kwh_priced", "wp")
+        }
+        readings_by_month[r["month"]] = readings_by_month.get(r["month"], 0) + r["readings"]
+    return monthly, readings_by_month
+
+
+def aggregate_daily_groups(groups, devices: dict) -> dict:
+    """Grupper från _vectorized.page_groups → samma resultat som aggregate_daily."""
+    daily = {}
+    for g in groups:
+        by_key = daily.setdefault(g["day"], {})
+        d = by_key.get(g["device_key"])
+        if d is None:
+            d = by_key[g["device_key"]] = _new_day()
+        for f in d:
+            d[f] += g[f]
+    return _name_days(daily, devices)
+
+
+def aggregate_monthly_groups(groups, devices: dict) -> tuple:
+    """Grupper från _vectorized.page_groups → samma resultat som aggregate_monthly."""
+    monthly = {}
+    readings_by_month = {}
+    for g in groups:
+        mon = month_string(g["day"])
+        if mon not in monthly:
+            monthly[mon] = {}
+            readings_by_month[mon] = 0
+        d = monthly[mon].get(g["device_key"])
+        if d is None:
+            d = monthly[mon][g["device_key"]] = _new_month()
+        d["kwh"]        += g["kwh"]
+        d["cost"]       += g["cost_15m"]
+        d["kwh_priced"] += g["kwh_priced"]
+        d["wp"]         += g["kwh_price_sum"]
+        readings_by_month[mon] += g["readings"]
+    return _name_months(monthly, devices), readings_by_month
+
+
+def aggregate_daily(priced, devices: dict) -> dict:
+    """join_prices-rader → {dag: {device_id: {fält i SUMMARY_FIELDS}}}.
+
+    Raderna aggregeras per device_key; id och namn hämtas ur `devices`
+    (load_devices). `cost` använder timmedelpris (0 utan pris), `cost_15m`,
+    `kwh_priced` och `kwh_price_sum` bara mätningar med 15-min pris.
+    """
+    daily = {}
+    for r, q, hour_ore, quarter_ore in priced:
+        # current_value (Watt) × 0.25h / 1000 = kWh, precis som lokala appen
+        watts = r["current_value"] or 0
+        delta_power = r.get("delta_power") or 0
+        kwh = watts * 0.25 / 1000
+
+        by_key = daily.setdefault(q // QUARTERS_PER_DAY, {})
+        d = by_key.get(r["device_key"])
+        if d is None:
+            d = by_key[r["device_key"]] = _new_day()
+        d["kwh"] += kwh
+        d["cost"] += kwh * (hour_ore or 0) / 100   # öre → kronor
+        d["readings"] += 1
+        if watts > 0 or delta_power > 0:
+            d["active_intervals"] += 1
+
+        if quarter_ore is not None:
+            d["cost_15m"]      += kwh * quarter_ore / 100
+            d["kwh_priced"]    += kwh
+            d["kwh_price_sum"] += kwh * quarter_ore
+    return _name_days(daily, devices)
+
+
+def aggregate_monthly(priced, devices: dict) -> tuple:
+    """join_prices-rader → ({månad: {device_name: {kwh, cost, kwh_priced, wp}}},
+    {månad: antal mätningar}) med 15-min pris."""
+    monthly = {}
+    readings_by_month = {}
+    for r, q, _, p_ore in priced:
+        mon = month_string(q // QUARTERS_PER_DAY)
+        kwh = (r["current_value"] or 0) * 0.25 / 1000
+
+        if mon not in monthly:
+            monthly[mon] = {}
+            readings_by_month[mon] = 0
+        d = monthly[mon].get(r["device_key"])
+        if d is None:
+            d = monthly[mon][r["device_key"]] = _new_month()
+        d["kwh"] += kwh
+        if p_ore is not None:
+            d["cost"]       += kwh * p_ore / 100
+            d["kwh_priced"] += kwh
+            d["wp"]         += kwh * p_ore
+        readings_by_month[mon] += 1
+    return _name_months(monthly, devices), readings_by_month
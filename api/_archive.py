@@ -0,0 +1,330 @@
+"""Kall lagring av gamla 15-min mätningar som Parquet.
+
+Avslutade månader av energy_readings exporteras till en komprimerad,
+kolumnvis Parquet-fil per månad (energy_readings/YYYY-MM.parquet) i en
+arkivlagring: en lokal katalog (ARCHIVE_DIR) eller en Supabase Storage-bucket
+(ARCHIVE_BUCKET). Katalogtabellen archived_months håller reda på vilka
+månader som arkiverats och vilka som tagits bort ur energy_readings (pruned).
+
+När dagsrollupen finns för alla dagar i en arkiverad månad kan raderna tas
+bort ur den varma tabellen (ARCHIVE_PRUNE=1). _aggregate läser därefter
+pruned månader ur arkivet, så /api/monthly och omräkningar i sync fungerar
+som förut; rader som sync skriver i en pruned månad läses ihop med arkivet
+tills nästa körning flyttar in dem. Parquet kräver pyarrow (valfritt
+beroende); utan det går varken att arkivera eller läsa arkiverade månader.
+"""
+from datetime import datetime
+import heapq
+import io
+import os
+import threading
+import time
+import sys
+sys.path.insert(0, os.path.dirname(__file__))
+from _pagination import PAGE_SIZE, iter_pages, count_rows
+from _timebuckets import local_now
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:   # valfritt beroende – arkivet är då avstängt
+    pa = pc = pq = None
+
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR")                 # lokal katalog
+ARCHIVE_BUCKET = os.environ.get("ARCHIVE_BUCKET")           # Supabase Storage-bucket
+ARCHIVE_AFTER_MONTHS = int(os.environ.get("ARCHIVE_AFTER_MONTHS", "12"))   # hela månader som stannar varma
+ARCHIVE_PRUNE = os.environ.get("ARCHIVE_PRUNE", "0") == "1"
+ARCHIVE_TTL = 60.0   # sekunder som katalogen cachas i processen
+
+ENERGY_COLUMNS = ("device_key", "timestamp", "delta_power", "accumulated_value", "current_value")
+
+# REAL-värdena lagras som float64 så att de blir identiska med PostgREST-JSON
+_SCHEMA = pa.schema([
+    ("device_key", pa.int32()),
+    ("timestamp", pa.timestamp("s", tz="UTC")),
+    ("delta_power", pa.float64()),
+    ("accumulated_value", pa.float64()),
+    ("current_value", pa.float64()),
+]) if pa is not None else None
+
+_cache = {"pruned": None, "fetched": 0.0}
+_lock = threading.Lock()
+
+
+def available() -> bool:
+    return pa is not None
+
+
+class LocalArchiveStore:
+    """Arkivfiler i en lokal katalog."""
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, *name.split("/"))
+
+    def write(self, name: str, data: bytes):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)   # läsare ser aldrig en halvskriven fil
+
+    def read(self, name: str) -> bytes:
+        with open(self._path(name), "rb") as f:
+            return f.read()
+
+
+class StorageArchiveStore:
+    """Arkivfiler i en privat Supabase Storage-bucket (läses och skrivs med secret key)."""
+    def __init__(self, bucket: str):
+        self.bucket = bucket
+
+    def _files(self):
+        from _db import get_db
+        return get_db().storage.from_(self.bucket)
+
+    def write(self, name: str, data: bytes):
+        self._files().upload(name, data, {"content-type": "application/vnd.apache.parquet",
+                                          "upsert": "true"})
+
+    def read(self, name: str) -> bytes:
+        return self._files().download(name)
+
+
+def get_store():
+    """Arkivlagringen enligt ARCHIVE_DIR / ARCHIVE_BUCKET, eller None."""
+    if ARCHIVE_DIR:
+        return LocalArchiveStore(ARCHIVE_DIR)
+    if ARCHIVE_BUCKET:
+        return StorageArchiveStore(ARCHIVE_BUCKET)
+    return None
+
+
+def month_path(mon: str) -> str:
+    return f"energy_readings/{mon}.parquet"
+
+
+def _next_month(mon: str) -> str:
+    y, m = int(mon[:4]), int(mon[5:7])
+    return f"{y + 1:04d}-01" if m == 12 else f"{y:04d}-{m + 1:02d}"
+
+
+def month_range(mon: str) -> tuple:
+    """[start, slut) för månaden YYYY-MM som fake-UTC-tidsstämplar."""
+    return f"{mon}-01T00:00:00", f"{_next_month(mon)}-01T00:00:00"
+
+
+def pruned_months(db, max_age: float = ARCHIVE_TTL) -> set:
+    """Månader (YYYY-MM) vars mätningar bara finns i arkivet."""
+    with _lock:
+        pruned = _cache["pruned"]
+        if pruned is not None and time.monotonic() - _cache["fetched"] < max_age:
+            return pruned
+    try:
+        res = db.table("archived_months").select("month").eq("pruned", True).execute()
+        pruned = {r["month"] for r in res.data}
+    except Exception:
+        pruned = set()   # katalogtabellen saknas – inget är arkiverat
+    with _lock:
+        _cache["pruned"] = pruned
+        _cache["fetched"] = time.monotonic()
+    return pruned
+
+
+def _to_table(rows: list) -> "pa.Table":
+    """PostgREST-rader → Arrow-tabell med _SCHEMA."""
+    return pa.table({
+        "device_key": [r["device_key"] for r in rows],
+        "timestamp": [datetime.fromisoformat(r["timestamp"].replace("Z", "+00:00")) for r in rows],
+        "delta_power": [r["delta_power"] for r in rows],
+        "accumulated_value": [r["accumulated_value"] for r in rows],
+        "current_value": [r["current_value"] for r in rows],
+    }, schema=_SCHEMA)
+
+
+def _read_table(store, mon: str, columns=None) -> "pa.Table":
+    return pq.read_table(io.BytesIO(store.read(month_path(mon))), columns=columns)
+
+
+def write_month(store, mon: str, rows: list) -> int:
+    """Skriv månadens rader (sorterade på timestamp, device_key) som Parquet.
+    Returnerar filens storlek i byte."""
+    buf = io.BytesIO()
+    pq.write_table(_to_table(rows), buf, compression="zstd")
+    data = buf.getvalue()
+    store.write(month_path(mon), data)
+    return len(data)
+
+
+def read_rows(store, mon: str, columns=ENERGY_COLUMNS, from_ts: str = None,
+              to_ts: str = None, to_exclusive: bool = True) -> "pa.Table":
+    """Arkiverade rader för månaden i [from_ts, to_ts] (fake-UTC), som Arrow-tabell
+    där timestamp är en sträng i PostgREST-format."""
+    table = _read_table(store, mon, [c for c in ENERGY_COLUMNS if c in columns or c == "timestamp"])
+    ts = table["timestamp"]
+    mask = None
+    if from_ts:
+        mask = pc.greater_equal(ts, pa.scalar(_parse(from_ts), pa.timestamp("s", tz="UTC")))
+    if to_ts:
+        bound = pa.scalar(_parse(to_ts), pa.timestamp("s", tz="UTC"))
+        upper = pc.less(ts, bound) if to_exclusive else pc.less_equal(ts, bound)
+        mask = upper if mask is None else pc.and_(mask, upper)
+    if mask is not None:
+        table = table.filter(mask)
+    text = pc.strftime(table["timestamp"], format="%Y-%m-%dT%H:%M:%S+00:00")
+    table = table.set_column(table.schema.get_field_index("timestamp"), "timestamp", text)
+    return table.select([c for c in columns])
+
+
+def _parse(ts: str) -> datetime:
+    """Tidsstämpel (med eller utan tidszon) → naiv face value, tolkad som UTC."""
+    return datetime.fromisoformat(ts[:19])
+
+
+def _hot_query(db, mon: str, columns: str = ", ".join(ENERGY_COLUMNS), from_ts: str = None,
+               to_ts: str = None, to_exclusive: bool = True):
+    """build-funktion för månadens rader i energy_readings, ev. begränsade till [from_ts, to_ts]."""
+    start, end = month_range(mon)
+
+    def build(count=None):
+        q = (db.table("energy_readings")
+             .select(columns, count=count)
+             .gte("timestamp", max(start, from_ts[:19]) if from_ts else start)
+             .lt("timestamp", end))
+        if to_ts:
+            q = q.lt("timestamp", to_ts) if to_exclusive else q.lte("timestamp", to_ts)
+        return q
+    return build
+
+
+def _row_key(r) -> tuple:
+    return r["timestamp"][:19], r["device_key"]
+
+
+def month_pages(db, store, mon: str, columns: str, from_ts: str = None, to_ts: str = None,
+                to_exclusive: bool = True, page_size: int = PAGE_SIZE):
+    """Som iter_pages för energy_readings i en pruned månad: arkivfilen
+    sammanfogad med rader som skrivits i energy_readings efter arkiveringen
+    (de vinner vid samma (timestamp, device_key))."""
+    table = read_rows(store, mon, [c.strip() for c in columns.split(",")],
+                      from_ts, to_ts, to_exclusive)
+    archived = (r for offset in range(0, table.num_rows, page_size)
+                for r in table.slice(offset, page_size).to_pylist())
+    hot = (r for page in iter_pages(_hot_query(db, mon, columns, from_ts, to_ts, to_exclusive))
+           for r in page)
+    # Vid lika nyckel kommer arkivraden först (heapq.merge är stabil) och ersätts
+    page = []
+    for r in heapq.merge(archived, hot, key=_row_key):
+        if page and _row_key(page[-1]) == _row_key(r):
+            page[-1] = r
+            continue
+        if len(page) == page_size:
+            yield page
+            page = []
+        page.append(r)
+    if page:
+        yield page
+
+
+def archive_month(db, store, mon: str, catalog: dict = None) -> dict:
+    """Exportera månadens rader i energy_readings till arkivet.
+
+    Är månaden redan pruned slås de sena raderna ihop med arkivfilen och tas
+    sedan bort ur energy_readings. Returnerar katalograden."""
+    pruned = bool(catalog and catalog.get("pruned"))
+    if pruned:
+        rows = [r for page in month_pages(db, store, mon, ", ".join(ENERGY_COLUMNS)) for r in page]
+    else:
+        rows = [r for page in iter_pages(_hot_query(db, mon)) for r in page]
+    size = write_month(store, mon, rows)
+    entry = {"month": mon, "path": month_path(mon), "rows": len(rows), "bytes": size,
+             "archived_at": datetime.utcnow().isoformat(),
+             "pruned": pruned}
+    db.table("archived_months").upsert(entry, on_conflict="month").execute()
+    if pruned:
+        start, end = month_range(mon)
+        db.table("energy_readings").delete().gte("timestamp", start).lt("timestamp", end).execute()
+    return entry
+
+
+def prune_month(db, store, mon: str, entry: dict) -> str:
+    """Ta bort månadens rader ur energy_readings om arkivet och dagsrollupen
+    täcker dem. Returnerar None vid lyckad borttagning, annars skälet."""
+    table = _read_table(store, mon, ["timestamp"])
+    if table.num_rows != entry["rows"] or count_rows(_hot_query(db, mon)) != entry["rows"]:
+        return "arkivet stämmer inte med energy_readings"
+
+    days = set(pc.strftime(table["timestamp"], format="%Y-%m-%d").to_pylist())
+    start, end = month_range(mon)
+    res = (db.table("daily_summaries")
+           .select("day")
+           .gte("day", start[:10])
+           .lt("day", end[:10])
+           .execute())
+    summarized = {r["day"] for r in res.data}
+    if not days <= summarized:
+        return f"daily_summaries saknar {len(days - summarized)} dagar"
+
+    db.table("energy_readings").delete().gte("timestamp", start).lt("timestamp", end).execute()
+    db.table("archived_months").update({"pruned": True}).eq("month", mon).execute()
+    with _lock:
+        _cache["pruned"] = None
+    return None
+
+
+def _months(first: str, last: str) -> list:
+    """Alla månader first..last (YYYY-MM)."""
+    result = []
+    while first <= last:
+        result.append(first)
+        first = _next_month(first)
+    return result
+
+
+def run_archive(db, store=None, keep_months: int = ARCHIVE_AFTER_MONTHS,
+                prune: bool = ARCHIVE_PRUNE) -> dict:
+    """Arkivera avslutade månader äldre än keep_months hela månader och,
+    med prune, ta bort dem ur energy_readings när rollupen finns.
+
+    Månader arkiveras om när energy_readings har rader som inte finns i
+    arkivet (sena mätningar, även i redan pruned månader). Utan pyarrow
+    eller arkivlagring görs ingenting och orsaken anges i "disabled"."""
+    result = {"archived": [], "pruned": [], "skipped": {}, "errors": []}
+    if not available():
+        return {**result, "disabled": "pyarrow saknas"}
+    store = store or get_store()
+    if store is None:
+        return {**result, "disabled": "ARCHIVE_DIR eller ARCHIVE_BUCKET saknas"}
+
+    oldest = (db.table("energy_readings")
+              .select("timestamp")
+              .order("timestamp")
+              .limit(1)
+              .execute())
+    catalog = {r["month"]: r for r in db.table("archived_months").select("*").execute().data}
+    today = local_now()
+    cutoff = today.year * 12 + today.month - 1 - keep_months   # sista månaden som arkiveras
+    last = f"{cutoff // 12:04d}-{cutoff % 12 + 1:02d}"
+    first = min([r["timestamp"][:7] for r in oldest.data] + list(catalog) or [last])
+
+    for mon in _months(first, last):
+        try:
+            entry = catalog.get(mon)
+            hot = count_rows(_hot_query(db, mon))
+            if entry is None or (entry["pruned"] and hot) or (not entry["pruned"] and hot != entry["rows"]):
+                if hot == 0:
+                    continue
+                entry = archive_month(db, store, mon, entry)
+                result["archived"].append(mon)
+            if prune and not entry["pruned"]:
+                reason = prune_month(db, store, mon, entry)
+                if reason:
+                    result["skipped"][mon] = reason
+                else:
+                    result["pruned"].append(mon)
+        except Exception as e:
+            result["errors"].append(f"{mon}: {e}")
+    return result
@@ -1,15 +1,116 @@
-"""Shared Supabase client for all API routes."""
+"""Shared Supabase client for all API routes.
+
+Klienterna skapas lazy en gång per process och återanvänds mellan anrop i
+samma varma Lambda. PostgREST-klienten bakom dem håller en httpx-pool med
+keep-alive, så varje sida i en paginerad hämtning slipper ny TCP/TLS-handskakning.
+
+Med TEMPIRO_DB satt (sökväg till en SQLite-fil eller :memory:) används i
+stället den inbäddade databasen i _local för båda klienterna, så alla
+handlers kan köras helt lokalt. Supabase-variablerna behövs då inte.
+"""
 import os
+import sys
+import threading
 from supabase import create_client, Client
 
-SUPABASE_URL = os.environ["SUPABASE_URL"]
-SUPABASE_SECRET = os.environ["SUPABASE_SECRET"]  # secret key for server-side writes
-SUPABASE_PUBLISHABLE = os.environ["SUPABASE_PUBLISHABLE"]  # publishable key for reads
+sys.path.insert(0, os.path.dirname(__file__))
+import _local
+
+TEMPIRO_DB = os.environ.get("TEMPIRO_DB")  # lokal SQLite-databas i stället för Supabase
+if TEMPIRO_DB:
+    SUPABASE_URL = os.environ.get("SUPABASE_URL")
+    SUPABASE_SECRET = os.environ.get("SUPABASE_SECRET")
+    SUPABASE_PUBLISHABLE = os.environ.get("SUPABASE_PUBLISHABLE")
+else:
+    SUPABASE_URL = os.environ["SUPABASE_URL"]
+    SUPABASE_SECRET = os.environ["SUPABASE_SECRET"]  # secret key for server-side writes
+    SUPABASE_PUBLISHABLE = os.environ["SUPABASE_PUBLISHABLE"]  # publishable key for reads
+
+_clients = {}
+_lock = threading.Lock()
+
+# Kumulativa räknare för processen (se db_stats)
+_stats = {"clients": 0, "requests": 0, "connections": 0, "pages": 0, "rows": 0}
+
+
+def _on_response(response):
+    """httpx-hook: räkna anrop och nya anslutningar.
+    En anslutning räknas första gången dess network stream dyker upp."""
+    stream = response.extensions.get("network_stream")
+    with _lock:
+        _stats["requests"] += 1
+        if stream is not None and not getattr(stream, "_tempiro_seen", False):
+            _stats["connections"] += 1
+            try:
+                stream._tempiro_seen = True
+            except AttributeError:
+                pass
+
+
+def _instrument(client: Client) -> Client:
+    """Koppla räknar-hooken till PostgREST-sessionen (en gång per session)."""
+    session = client.postgrest.session
+    if not getattr(session, "_tempiro_instrumented", False):
+        with _lock:
+            if not getattr(session, "_tempiro_instrumented", False):
+                session.event_hooks["response"].append(_on_response)
+                session._tempiro_instrumented = True
+    return client
+
+
+def _count_request():
+    with _lock:
+        _stats["requests"] += 1
+
+
+def _get_local() -> "_local.LocalClient":
+    """Den inbäddade databasen (en per process, delas av båda nycklarna)."""
+    client = _clients.get("local")
+    if client is None:
+        with _lock:
+            client = _clients.get("local")
+            if client is None:
+                client = _local.LocalClient(TEMPIRO_DB, on_request=_count_request)
+                _clients["local"] = client
+                _stats["clients"] += 1
+                _stats["connections"] += 1
+    return client
+
+
+def _get_client(key: str) -> Client:
+    if TEMPIRO_DB:
+        return _get_local()
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = create_client(SUPABASE_URL, key)
+                _clients[key] = client
+                _stats["clients"] += 1
+    return _instrument(client)
+
 
 def get_db() -> Client:
     """Get Supabase client with secret key (server-side, full access)."""
-    return create_client(SUPABASE_URL, SUPABASE_SECRET)
+    return _get_client(SUPABASE_SECRET)
+
 
 def get_public_db() -> Client:
     """Get Supabase client with publishable key (read-only)."""
-    return create_client(SUPABASE_URL, SUPABASE_PUBLISHABLE)
+    return _get_client(SUPABASE_PUBLISHABLE)
+
+
+def record_page(rows: int):
+    """Räkna en hämtad sida med `rows` rader (anropas av _pagination)."""
+    with _lock:
+        _stats["pages"] += 1
+        _stats["rows"] += rows
+
+
+def db_stats() -> dict:
+    """Ögonblicksbild av räknarna: skapade klienter, HTTP-anrop, öppnade
+    anslutningar samt hämtade sidor och rader."""
+    with _lock:
+        return dict(_stats)
+
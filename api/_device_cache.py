@@ -0,0 +1,125 @@
+"""Kortlivad cache för enhetslistan från Tempiro med single-flight.
+
+Samtidiga anrop i samma instans delar på en uppströmshämtning. En
+ögonblicksbild yngre än DEVICES_TTL sekunder returneras direkt; inom
+ytterligare DEVICES_STALE sekunder returneras den gamla bilden medan en ny
+hämtas i bakgrunden (stale-while-revalidate). Samma värden används i
+Cache-Control så att CDN:en beter sig likadant.
+
+Hämtningar och switchar får stigande löpnummer. En hämtning som startade
+före senaste switchen delas inte av nya anropare och skriver aldrig över en
+nyare bild, så läget från apply_switch kan inte ersättas av ett äldre svar.
+"""
+import os
+import sys
+import threading
+import time
+sys.path.insert(0, os.path.dirname(__file__))
+from _tempiro import get_devices
+
+DEVICES_TTL = float(os.environ.get("DEVICES_TTL", "15"))      # sekunder färsk
+DEVICES_STALE = float(os.environ.get("DEVICES_STALE", "60"))  # sekunder stale-while-revalidate
+
+_snapshot = {"devices": None, "fetched": 0.0, "seq": 0}   # seq: hämtningen/switchen bakom bilden
+_seq = {"last": 0, "switched": 0}   # senast utdelade löpnummer och senaste switchens
+_lock = threading.Lock()
+_inflight = None
+
+
+class _Flight:
+    """En pågående uppströmshämtning som flera anropare kan vänta på."""
+    def __init__(self, seq: int):
+        self.seq = seq
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _next_seq() -> int:
+    """Nästa löpnummer (anropas med _lock)."""
+    _seq["last"] += 1
+    return _seq["last"]
+
+
+def _fetch_shared() -> list:
+    """Hämta enhetslistan; samtidiga anropare väntar på samma hämtning."""
+    global _inflight
+    with _lock:
+        flight = _inflight
+        # En hämtning från före senaste switchen kan ge det gamla läget – starta en ny
+        leader = flight is None or flight.seq < _seq["switched"]
+        if leader:
+            flight = _inflight = _Flight(_next_seq())
+
+    if leader:
+        try:
+            devices = get_devices()
+            with _lock:
+                if flight.seq > _snapshot["seq"]:   # aldrig över en nyare bild
+                    _snapshot["devices"] = devices
+                    _snapshot["fetched"] = time.monotonic()
+                    _snapshot["seq"] = flight.seq
+            flight.result = devices
+        except Exception as e:
+            flight.error = e
+        finally:
+            with _lock:
+                if _inflight is flight:
+                    _inflight = None
+            flight.done.set()
+    else:
+        flight.done.wait()
+
+    if flight.error is not None:
+        raise flight.error
+    return flight.result
+
+
+def get_devices_cached(fresh: bool = False) -> tuple:
+    """Returnerar (enheter, status) där status är "HIT", "STALE" eller "MISS".
+    fresh=True hoppar över cachen (men delar en pågående hämtning som
+    startade efter senaste switchen)."""
+    with _lock:
+        devices = _snapshot["devices"]
+        age = time.monotonic() - _snapshot["fetched"]
+        refreshing = _inflight is not None
+
+    if not fresh and devices is not None:
+        if age < DEVICES_TTL:
+            return devices, "HIT"
+        if age < DEVICES_TTL + DEVICES_STALE:
+            if not refreshing:
+                threading.Thread(target=_refresh_quietly, daemon=True).start()
+            return devices, "STALE"
+
+    return _fetch_shared(), "MISS"
+
+
+def _refresh_quietly():
+    try:
+        _fetch_shared()
+    except Exception:
+        pass   # nästa anrop efter stale-fönstret hämtar synkront och ser felet
+
+
+def apply_switch(device_id: str, value: int):
+    """Uppdatera den cachade bilden efter en lyckad switch (om den finns i
+    denna instans), så att nästa läsning inte visar det gamla läget."""
+    with _lock:
+        _seq["switched"] = _snapshot["seq"] = _next_seq()
+        devices = _snapshot["devices"]
+        if devices is None:
+            return
+        updated = []
+        for d in devices:
+            if (d.get("Id") or d.get("id")) == device_id:
+                d = dict(d)
+                d["Value" if "Value" in d else "value"] = value
+            updated.append(d)
+        _snapshot["devices"] = updated
+
+
+def cache_control() -> str:
+    """Cache-Control för CDN:en med samma TTL/stale-fönster som instanscachen."""
+    return (f"public, max-age=0, s-maxage={int(DEVICES_TTL)}, "
+            f"stale-while-revalidate={int(DEVICES_STALE)}")
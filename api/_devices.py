@@ -0,0 +1,74 @@
+"""Dimensionstabellen devices: kompakt heltalsnyckel per Tempiro-enhet.
+
+energy_readings refererar enheter med device_key (INT) i stället för att
+bära device_id och device_name som text på varje rad. Läs-endpoints hämtar
+namnen en gång per svar via load_devices() och slår upp nycklarna därefter,
+så ett namnbyte i Tempiro byter namn på hela historiken i stället för att
+dela den. sync.py håller tabellen uppdaterad med sync_devices().
+"""
+import threading
+import time
+
+DEVICES_TABLE_TTL = 60.0   # sekunder som tabellen cachas i processen
+
+_cache = {"devices": None, "fetched": 0.0}
+_lock = threading.Lock()
+
+
+def load_devices(db, max_age: float = DEVICES_TABLE_TTL) -> dict:
+    """{device_key: {"device_id", "device_name"}} för alla enheter."""
+    with _lock:
+        devices = _cache["devices"]
+        if devices is not None and time.monotonic() - _cache["fetched"] < max_age:
+            return devices
+
+    res = db.table("devices").select("device_key, device_id, device_name").execute()
+    devices = {
+        r["device_key"]: {"device_id": r["device_id"], "device_name": r["device_name"]}
+        for r in res.data
+    }
+    with _lock:
+        _cache["devices"] = devices
+        _cache["fetched"] = time.monotonic()
+    return devices
+
+
+def device_key(db, device_id: str):
+    """device_key för ett device_id, eller None om enheten inte finns."""
+    for key, d in load_devices(db).items():
+        if d["device_id"] == device_id:
+            return key
+    return None
+
+
+def describe(devices: dict, key) -> dict:
+    """{"device_id", "device_name"} för en nyckel; okända nycklar får nyckeln som id och namn."""
+    d = devices.get(key)
+    if d is None:   # läggs inte in – devices är den delade cachen från load_devices
+        return {"device_id": str(key), "device_name": str(key)}
+    return d
+
+
+def sync_devices(db, tempiro_devices: list) -> tuple:
+    """Upserta enheterna från Tempiro (Id/Name).
+
+    Returnerar ({device_id: device_key}, [device_id för enheter som bytt namn]).
+    """
+    rows = []
+    for device in tempiro_devices:
+        device_id = device.get("Id") or device.get("id")
+        device_name = device.get("Name") or device.get("name") or device_id
+        rows.append({"device_id": device_id, "device_name": device_name})
+    if not rows:
+        return {}, []
+
+    known = {d["device_id"]: d["device_name"] for d in load_devices(db, max_age=0).values()}
+    renamed = [r["device_id"] for r in rows
+               if r["device_id"] in known and known[r["device_id"]] != r["device_name"]]
+
+    res = (db.table("devices")
+           .upsert(rows, on_conflict="device_id")
+           .execute())
+    with _lock:
+        _cache["devices"] = None   # namn kan ha ändrats
+    return {r["device_id"]: r["device_key"] for r in res.data}, renamed
@@ -0,0 +1,120 @@
+"""Nedsampling av energiserier per enhet (tidsbuckets och LTTB).
+
+Används av /api/energy så att svaret håller en fast storlek oavsett hur
+många dagar som efterfrågas.
+"""
+from datetime import datetime, timedelta
+import re
+import sys
+import os
+sys.path.insert(0, os.path.dirname(__file__))
+from _timebuckets import EPOCH, face_seconds
+
+_RESOLUTION_RE = re.compile(r"^(\d+)([mhd])$")
+_UNIT_SECONDS = {"m": 60, "h": 3600, "d": 86400}
+MIN_RESOLUTION = 15 * 60   # mätningarna är redan 15-min
+_EPOCH = datetime(EPOCH.year, EPOCH.month, EPOCH.day)
+
+
+def parse_resolution(value: str) -> int:
+    """'15m', '1h', '1d' ... → sekunder. ValueError om formatet är ogiltigt."""
+    m = _RESOLUTION_RE.match(value.strip().lower())
+    if not m:
+        raise ValueError(f"ogiltig resolution: {value!r} (t.ex. 15m, 1h, 1d)")
+    seconds = int(m.group(1)) * _UNIT_SECONDS[m.group(2)]
+    if seconds < MIN_RESOLUTION or seconds % MIN_RESOLUTION:
+        raise ValueError(f"resolution måste vara en multipel av 15m: {value!r}")
+    return seconds
+
+
+def _by_device(rows):
+    series = {}
+    for r in rows:
+        series.setdefault(r["device_id"], []).append(r)
+    return series
+
+
+def _merge(series):
+    out = [r for rows in series.values() for r in rows]
+    out.sort(key=lambda r: (r["timestamp"], r["device_id"]))
+    return out
+
+
+def bucket(rows: list, seconds: int) -> list:
+    """Aggregera rader i tidsbuckets per enhet.
+
+    current_value blir medeleffekt (W), max_watt toppeffekt, delta_power
+    summeras och kwh är summerad energi för bucketen. Tidsstämpeln är
+    bucketens start med samma tidszonssuffix som rådatan.
+    """
+    series = {}
+    for device_id, dev_rows in _by_device(rows).items():
+        buckets = {}
+        for r in dev_rows:
+            ts = r["timestamp"]
+            idx = face_seconds(ts) // seconds
+            watts = r.get("current_value") or 0
+            b = buckets.get(idx)
+            if b is None:
+                b = buckets[idx] = {
+                    "device_id": device_id,
+                    "device_name": r.get("device_name"),
+                    "timestamp": (_EPOCH + timedelta(seconds=idx * seconds)).isoformat() + ts[19:],
+                    "sum_watt": 0.0, "max_watt": 0.0, "delta_power": 0.0, "readings": 0,
+                }
+            b["sum_watt"] += watts
+            b["max_watt"] = max(b["max_watt"], watts)
+            b["delta_power"] += r.get("delta_power") or 0
+            b["readings"] += 1
+        out = []
+        for b in buckets.values():
+            sum_watt = b.pop("sum_watt")
+            b["current_value"] = round(sum_watt / b["readings"], 1)
+            b["kwh"] = round(sum_watt * 0.25 / 1000, 4)   # W × 0.25h / 1000 per mätning
+            b["max_watt"] = round(b["max_watt"], 1)
+            out.append(b)
+        series[device_id] = out
+    return _merge(series)
+
+
+def lttb(points: list, threshold: int) -> list:
+    """Largest-Triangle-Three-Buckets. `points` är [(x, y), ...] sorterade på x.
+    Returnerar index för de punkter som behålls (alltid första och sista)."""
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    keep = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Medelpunkt i nästa bucket
+        nxt_start = int((i + 1) * every) + 1
+        nxt_end = min(int((i + 2) * every) + 1, n)
+        cnt = nxt_end - nxt_start
+        avg_x = sum(points[j][0] for j in range(nxt_start, nxt_end)) / cnt
+        avg_y = sum(points[j][1] for j in range(nxt_start, nxt_end)) / cnt
+
+        # Punkten i aktuell bucket som ger störst triangel med a och medelpunkten
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        ax, ay = points[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (points[j][1] - ay) - (ax - points[j][0]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        keep.append(best)
+        a = best
+    keep.append(n - 1)
+    return keep
+
+
+def downsample(rows: list, max_points: int) -> list:
+    """Formbevarande nedsampling (LTTB på current_value) till högst
+    `max_points` punkter per enhet. Raderna returneras oförändrade."""
+    series = {}
+    for device_id, dev_rows in _by_device(rows).items():
+        points = [(face_seconds(r["timestamp"]), r.get("current_value") or 0) for r in dev_rows]
+        series[device_id] = [dev_rows[i] for i in lttb(points, max_points)]
+    return _merge(series)
@@ -0,0 +1,77 @@
+"""Svarskodning för tidsserie-endpoints: kolumnformat och gzip/brotli.
+
+format=columnar grupperar raderna per serie (t.ex. enhet) och skickar en
+array per fält i stället för ett objekt per rad. Tidsstämplar blir heltal:
+sekunder från `epoch` (Unix-tid för tidsstämpelns face value).
+"""
+from datetime import datetime
+import gzip
+import json
+
+try:
+    import brotli
+except ImportError:   # valfritt beroende – faller tillbaka på gzip
+    brotli = None
+
+MIN_COMPRESS_BYTES = 1024   # mindre svar skickas okomprimerade
+
+
+def _epoch_seconds(ts: str) -> int:
+    dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    return int(dt.timestamp())
+
+
+def to_columnar(rows: list, group_keys: tuple) -> dict:
+    """Rader → {"format": "columnar", "epoch": E, "series": [...]}.
+
+    Varje serie har group_keys som skalärer, "t" med sekunder från E och en
+    array per övrigt fält i samma ordning som "t".
+    """
+    if not rows:
+        return {"format": "columnar", "epoch": 0, "series": []}
+
+    fields = [k for k in rows[0] if k != "timestamp" and k not in group_keys]
+    epoch = _epoch_seconds(rows[0]["timestamp"])
+    series = {}
+    for r in rows:
+        key = tuple(r.get(k) for k in group_keys)
+        s = series.get(key)
+        if s is None:
+            s = series[key] = {**dict(zip(group_keys, key)), "t": []}
+            for f in fields:
+                s[f] = []
+        s["t"].append(_epoch_seconds(r["timestamp"]) - epoch)
+        for f in fields:
+            s[f].append(r.get(f))
+    return {"format": "columnar", "epoch": epoch, "series": list(series.values())}
+
+
+def _accepted(accept_encoding: str) -> set:
+    """Kodningar i Accept-Encoding som inte är avstängda med q=0."""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if name:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def encode_json(payload, accept_encoding: str = "") -> tuple:
+    """Serialisera till kompakt JSON och komprimera enligt Accept-Encoding.
+    Returnerar (body, content_encoding eller None)."""
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    if len(body) < MIN_COMPRESS_BYTES:
+        return body, None
+    accepted = _accepted(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return brotli.compress(body, quality=5), "br"
+    if "gzip" in accepted or "*" in accepted:
+        return gzip.compress(body, compresslevel=6), "gzip"
+    return body, None
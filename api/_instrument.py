@@ -0,0 +1,120 @@
+"""Tidmätning per fas och anrop för handlers.
+
+Varje handler skapar en Timing när anropet börjar och lägger sina faser i
+`with timing.phase("fetch"):`-block (samma namn flera gånger summeras).
+Antal DB-anrop, sidor och rader (från _db.db_stats) samt Tempiro-anrop och
+deras tid (från _tempiro.tempiro_stats, om modulen används) räknas som
+skillnaden mot när anropet började.
+
+Resultatet går ut på två sätt:
+  - Server-Timing-huvudet (headers()), t.ex.
+      fetch;dur=84.1, encode;dur=3.2, db;desc="requests=3 pages=2 rows=1500", total;dur=88.0
+    som syns under Timing i webbläsarens nätverksflik. tempiro;dur är
+    summerad anropstid – parallella anrop (sync) kan överstiga total.
+  - En JSON-rad per anrop i loggen (finish()). REQUEST_LOG=0 stänger av
+    raderna. Med SLOW_REQUEST_MS satt markeras långsammare anrop med
+    "slow": true och skrivs till stderr, så de syns som varningar i Vercel.
+"""
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(__file__))
+from _db import db_stats
+
+REQUEST_LOG = os.environ.get("REQUEST_LOG", "1") != "0"
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "0"))   # 0 = av
+
+
+def _tempiro_stats() -> dict:
+    """tempiro_stats() om _tempiro redan är importerad (kräver annars Tempiro-miljön)."""
+    module = sys.modules.get("_tempiro")
+    return module.tempiro_stats() if module else {}
+
+
+class Timing:
+    def __init__(self, route: str):
+        self.route = route
+        self.started = time.perf_counter()
+        self.phases = {}   # namn → ms, i den ordning faserna först kördes
+        self.fields = {}
+        self._db = db_stats()
+        self._tempiro = _tempiro_stats()
+        self._finished = False
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            self.phases[name] = self.phases.get(name, 0.0) + ms
+
+    def note(self, **fields):
+        """Extra fält till loggraden (t.ex. cache-status eller antal månader)."""
+        self.fields.update(fields)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def db(self) -> dict:
+        now = db_stats()
+        return {k: now[k] - self._db[k] for k in ("requests", "connections", "pages", "rows")}
+
+    def tempiro(self) -> dict:
+        """{anropstyp: {calls, errors, retries, ms}} för anrop under requesten."""
+        out = {}
+        for name, st in _tempiro_stats().items():
+            before = self._tempiro.get(name, {})
+            calls = st["calls"] - before.get("calls", 0)
+            if calls:
+                out[name] = {
+                    "calls": calls,
+                    "errors": st["errors"] - before.get("errors", 0),
+                    "retries": st["retries"] - before.get("retries", 0),
+                    "ms": round(st["total_ms"] - before.get("total_ms", 0.0), 1),
+                }
+        return out
+
+    def server_timing(self) -> str:
+        parts = [f"{name};dur={ms:.1f}" for name, ms in self.phases.items()]
+        db = self.db()
+        if db["requests"]:
+            parts.append(f'db;desc="requests={db["requests"]} pages={db["pages"]} rows={db["rows"]}"')
+        tempiro = self.tempiro()
+        if tempiro:
+            calls = sum(t["calls"] for t in tempiro.values())
+            ms = sum(t["ms"] for t in tempiro.values())
+            parts.append(f'tempiro;dur={ms:.1f};desc="calls={calls}"')
+        parts.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ", ".join(parts)
+
+    def headers(self) -> dict:
+        """Svarshuvuden: Server-Timing (Timing-Allow-Origin så att dashboarden kan läsa det)."""
+        return {"Server-Timing": self.server_timing(), "Timing-Allow-Origin": "*"}
+
+    def finish(self, status: int, **fields):
+        """Skriv loggraden för anropet (en gång)."""
+        if self._finished:
+            return
+        self._finished = True
+        if not REQUEST_LOG:
+            return
+        ms = self.elapsed_ms()
+        slow = bool(SLOW_REQUEST_MS) and ms >= SLOW_REQUEST_MS
+        tempiro = self.tempiro()
+        line = {
+            "route": self.route,
+            "status": status,
+            "ms": round(ms, 1),
+            "phases": {name: round(v, 1) for name, v in self.phases.items()},
+            "db": self.db(),
+            **({"tempiro": tempiro} if tempiro else {}),
+            **({"slow": True} if slow else {}),
+            **self.fields,
+            **fields,
+        }
+        print(json.dumps(line, ensure_ascii=False), file=sys.stderr if slow else sys.stdout, flush=True)
@@ -0,0 +1,440 @@
+"""Inbäddad SQLite-databas med samma gränssnitt som Supabase-klienten.
+
+Med TEMPIRO_DB=<sökväg> (eller :memory:) returnerar get_db()/get_public_db()
+en LocalClient i stället för Supabase, så samma handlers kan köras helt
+lokalt – för profilering, lasttester och utveckling utan nätverk. Klienten
+täcker den del av PostgREST-byggaren som koden faktiskt använder:
+
+    db.table(t).select(cols, count=None) .eq/.neq/.gt/.gte/.lt/.lte/.in_/.or_
+        .order(col, desc=False) .limit(n) .execute()
+    db.table(t).upsert(rows, on_conflict=...) / .insert(rows) / .update(values) / .delete()
+    db.rpc(fn, params).execute()
+
+Schemat speglar supabase_schema.sql (utan partitioner, RLS och ID-kolumner
+som koden inte läser) och skapas när filen öppnas. Värden konverteras efter
+kolumnens deklarerade typ så att svaren ser ut som PostgREST:s:
+TIMESTAMPTZ lagras och returneras som ISO-text i UTC ("...+00:00"), BOOLEAN
+som bool och JSONB som dict/list.
+
+Av SQL-funktionerna finns bara ensure_energy_partitions (en no-op – tabellen
+är inte partitionerad). Övriga rpc-anrop ger PGRST202 precis som mot en
+databas där funktionen saknas, så daily_rollup/monthly_rollup räknas i
+processen (Python eller NumPy) i stället.
+"""
+import json
+import re
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS devices (
+    device_key INTEGER PRIMARY KEY,
+    device_id TEXT NOT NULL UNIQUE,
+    device_name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS energy_readings (
+    device_key INTEGER NOT NULL REFERENCES devices (device_key),
+    timestamp TIMESTAMPTZ NOT NULL,
+    delta_power REAL NOT NULL,
+    accumulated_value REAL NOT NULL,
+    current_value REAL,
+    PRIMARY KEY (device_key, timestamp)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_energy_time_device ON energy_readings (timestamp, device_key);
+CREATE TABLE IF NOT EXISTS spot_prices (
+    id INTEGER PRIMARY KEY,
+    timestamp TIMESTAMPTZ NOT NULL,
+    price_area TEXT NOT NULL,
+    price_sek REAL NOT NULL,
+    price_eur REAL,
+    UNIQUE (timestamp, price_area)
+);
+CREATE TABLE IF NOT EXISTS sync_status (
+    id INTEGER PRIMARY KEY,
+    sync_type TEXT NOT NULL,
+    device_id TEXT,
+    last_sync TIMESTAMPTZ NOT NULL,
+    oldest_data TIMESTAMPTZ,
+    UNIQUE (sync_type, device_id)
+);
+CREATE TABLE IF NOT EXISTS daily_summaries (
+    day DATE NOT NULL,
+    device_id TEXT NOT NULL,
+    device_name TEXT NOT NULL,
+    kwh DOUBLE PRECISION NOT NULL,
+    cost DOUBLE PRECISION NOT NULL,
+    readings INTEGER NOT NULL,
+    active_intervals INTEGER NOT NULL,
+    cost_15m DOUBLE PRECISION NOT NULL,
+    kwh_priced DOUBLE PRECISION NOT NULL,
+    kwh_price_sum DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%S+00:00', 'now')),
+    PRIMARY KEY (day, device_id)
+);
+CREATE TABLE IF NOT EXISTS monthly_summaries (
+    month TEXT PRIMARY KEY,
+    total_kwh DOUBLE PRECISION,
+    total_cost DOUBLE PRECISION,
+    avg_price_ore DOUBLE PRECISION,
+    readings INTEGER NOT NULL DEFAULT 0,
+    partial BOOLEAN NOT NULL DEFAULT 0,
+    devices JSONB NOT NULL DEFAULT '{}',
+    stale BOOLEAN NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS archived_months (
+    month TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    bytes BIGINT NOT NULL,
+    archived_at TIMESTAMPTZ NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%S+00:00', 'now')),
+    pruned BOOLEAN NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS tempiro_tokens (
+    username TEXT PRIMARY KEY,
+    token TEXT NOT NULL,
+    expires TIMESTAMPTZ NOT NULL
+);
+"""
+
+_IDENT = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_OPS = {"eq": "=", "neq": "<>", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+
+
+class LocalError(Exception):
+    """Fel i samma form som postgrest.APIError (message med kod)."""
+    def __init__(self, code: str, message: str):
+        super().__init__(f"{{'code': '{code}', 'message': '{message}'}}")
+        self.code = code
+        self.message = message
+
+
+class Response:
+    def __init__(self, data: list, count: int = None):
+        self.data = data
+        self.count = count
+
+
+def _ident(name: str) -> str:
+    if not _IDENT.match(name):
+        raise LocalError("42703", f"ogiltigt kolumnnamn: {name}")
+    return f'"{name}"'
+
+
+def _timestamp(value) -> str:
+    """ISO-tid (med eller utan zon, Z eller offset) → UTC-text som PostgREST returnerar.
+    Tider utan zon tolkas som UTC, som i Supabase-sessionen."""
+    dt = value if isinstance(value, datetime) else datetime.fromisoformat(str(value).replace(" ", "T"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).isoformat()
+
+
+def _split(text: str) -> list:
+    """Dela en PostgREST-filterlista på komman på översta nivån (utanför parenteser och citat)."""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, ch in enumerate(text):
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and ch == ",":
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _unquote(value: str) -> str:
+    return value[1:-1] if len(value) >= 2 and value[0] == value[-1] == '"' else value
+
+
+class Query:
+    """En fråga mot en tabell; filtren byggs upp som i postgrest-py."""
+    def __init__(self, client, table: str, action: str, payload=None, columns: str = "*",
+                 count: str = None, on_conflict: str = None, ignore_duplicates: bool = False):
+        self.client = client
+        self.table = table
+        self.action = action
+        self.payload = payload
+        self.columns = columns
+        self.count = count
+        self.on_conflict = on_conflict
+        self.ignore_duplicates = ignore_duplicates
+        self.where = []    # (sql, params)
+        self.orders = []
+        self.limit_n = None
+
+    # --- filter ---
+
+    def _compare(self, column: str, op: str, value) -> tuple:
+        if op == "in":
+            values = [self.client.to_db(self.table, column, v) for v in value]
+            if not values:
+                return "0", []
+            return f"{_ident(column)} IN ({', '.join('?' * len(values))})", values
+        if op == "is":
+            literal = {"null": "NULL", "true": "1", "false": "0"}[str(value).lower()]
+            return f"{_ident(column)} IS {literal}", []
+        return f"{_ident(column)} {_OPS[op]} ?", [self.client.to_db(self.table, column, value)]
+
+    def _filter(self, column: str, op: str, value):
+        self.where.append(self._compare(column, op, value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, "eq", value)
+
+    def neq(self, column, value):
+        return self._filter(column, "neq", value)
+
+    def gt(self, column, value):
+        return self._filter(column, "gt", value)
+
+    def gte(self, column, value):
+        return self._filter(column, "gte", value)
+
+    def lt(self, column, value):
+        return self._filter(column, "lt", value)
+
+    def lte(self, column, value):
+        return self._filter(column, "lte", value)
+
+    def in_(self, column, values):
+        return self._filter(column, "in", list(values))
+
+    def is_(self, column, value):
+        return self._filter(column, "is", "null" if value is None else value)
+
+    def _logic(self, text: str, joiner: str) -> tuple:
+        """PostgREST:s logiska syntax, t.ex. 'a.gt."x",and(a.eq."x",b.gt."y")'."""
+        sqls, params = [], []
+        for part in _split(text):
+            m = re.match(r"^(and|or)\((.*)\)$", part)
+            if m:
+                s, p = self._logic(m.group(2), m.group(1).upper())
+            else:
+                column, op, value = part.split(".", 2)
+                if op == "in":
+                    value = [_unquote(v) for v in _split(value.strip("()"))]
+                else:
+                    value = _unquote(value)
+                s, p = self._compare(column, op, value)
+            sqls.append(f"({s})")
+            params.extend(p)
+        return f" {joiner} ".join(sqls), params
+
+    def or_(self, filters: str):
+        self.where.append(self._logic(filters, "OR"))
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        self.orders.append(f"{_ident(column)} {'DESC' if desc else 'ASC'}")
+        return self
+
+    def limit(self, size: int):
+        self.limit_n = int(size)
+        return self
+
+    # --- körning ---
+
+    def _where_sql(self) -> tuple:
+        if not self.where:
+            return "", []
+        params = [p for _, ps in self.where for p in ps]
+        return " WHERE " + " AND ".join(f"({s})" for s, _ in self.where), params
+
+    def _select(self, conn) -> Response:
+        where, params = self._where_sql()
+        table = _ident(self.table)
+        cols = "*" if self.columns.strip() == "*" else ", ".join(
+            _ident(c.strip()) for c in self.columns.split(","))
+        sql = f"SELECT {cols} FROM {table}{where}"
+        if self.orders:
+            sql += " ORDER BY " + ", ".join(self.orders)
+        if self.limit_n is not None:
+            sql += f" LIMIT {self.limit_n}"
+        data = self.client.rows(self.table, conn.execute(sql, params))
+        count = None
+        if self.count:
+            count = conn.execute(f"SELECT COUNT(*) FROM {table}{where}", params).fetchone()[0]
+        return Response(data, count)
+
+    def _write(self, conn) -> Response:
+        table = _ident(self.table)
+        if self.action == "delete":
+            where, params = self._where_sql()
+            return Response(self.client.rows(
+                self.table, conn.execute(f"DELETE FROM {table}{where} RETURNING *", params)))
+        if self.action == "update":
+            where, params = self._where_sql()
+            sets = ", ".join(f"{_ident(c)} = ?" for c in self.payload)
+            values = [self.client.to_db(self.table, c, v) for c, v in self.payload.items()]
+            return Response(self.client.rows(self.table, conn.execute(
+                f"UPDATE {table} SET {sets}{where} RETURNING *", values + params)))
+
+        rows = [self.payload] if isinstance(self.payload, dict) else list(self.payload)
+        if not rows:
+            return Response([])
+        columns = list(dict.fromkeys(c for r in rows for c in r))   # saknade nycklar → NULL
+        sql = (f"INSERT INTO {table} ({', '.join(map(_ident, columns))}) "
+               f"VALUES ({', '.join('?' * len(columns))})")
+        if self.action == "upsert":
+            keys = [c.strip() for c in self.on_conflict.split(",")] if self.on_conflict else []
+            target = f"({', '.join(map(_ident, keys))})" if keys else ""
+            updates = [c for c in columns if c not in keys]
+            if self.ignore_duplicates or not updates:
+                sql += f" ON CONFLICT {target} DO NOTHING"
+            else:
+                sql += f" ON CONFLICT {target} DO UPDATE SET " + ", ".join(
+                    f"{_ident(c)} = excluded.{_ident(c)}" for c in updates)
+        sql += " RETURNING *"
+        data = []
+        for r in rows:
+            values = [self.client.to_db(self.table, c, r.get(c)) for c in columns]
+            data.extend(self.client.rows(self.table, conn.execute(sql, values)))
+        return Response(data)
+
+    def execute(self) -> Response:
+        with self.client.transaction() as conn:
+            if self.action == "select":
+                return self._select(conn)
+            return self._write(conn)
+
+
+class Table:
+    def __init__(self, client, name: str):
+        self.client = client
+        self.name = name
+
+    def select(self, columns: str = "*", count: str = None) -> Query:
+        return Query(self.client, self.name, "select", columns=columns, count=count)
+
+    def insert(self, rows) -> Query:
+        return Query(self.client, self.name, "insert", rows)
+
+    def upsert(self, rows, on_conflict: str = "", ignore_duplicates: bool = False, **_) -> Query:
+        return Query(self.client, self.name, "upsert", rows,
+                     on_conflict=on_conflict, ignore_duplicates=ignore_duplicates)
+
+    def update(self, values: dict) -> Query:
+        return Query(self.client, self.name, "update", values)
+
+    def delete(self) -> Query:
+        return Query(self.client, self.name, "delete")
+
+
+class Rpc:
+    def __init__(self, client, fn: str, params: dict):
+        self.client = client
+        self.fn = fn
+        self.params = params or {}
+
+    def execute(self) -> Response:
+        fn = RPC.get(self.fn)
+        if fn is None:
+            raise LocalError("PGRST202", f"Could not find the function public.{self.fn}")
+        with self.client.transaction() as conn:
+            return Response(fn(conn, **self.params))
+
+
+# SQL-funktioner som finns lokalt: namn → fn(conn, **params)
+RPC = {
+    "ensure_energy_partitions": lambda conn, **_: 0,   # ingen partitionering lokalt
+}
+
+
+class LocalClient:
+    """Supabase-liknande klient över en SQLite-fil. En anslutning delas av
+    alla trådar och varje fråga körs under ett lås (SQLite har en skrivare
+    åt gången ändå)."""
+    def __init__(self, path: str, on_request=None):
+        self.path = path
+        self.on_request = on_request
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._types = {}
+        for (table,) in self._conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"):
+            self._types[table] = {
+                r["name"]: (r["type"] or "").upper()
+                for r in self._conn.execute(f"PRAGMA table_info({_ident(table)})")
+            }
+
+    def table(self, name: str) -> Table:
+        if name not in self._types:
+            raise LocalError("42P01", f'relation "{name}" does not exist')
+        return Table(self, name)
+
+    def from_(self, name: str) -> Table:
+        return self.table(name)
+
+    def rpc(self, fn: str, params: dict = None) -> Rpc:
+        return Rpc(self, fn, params)
+
+    def transaction(self):
+        return _Transaction(self)
+
+    def to_db(self, table: str, column: str, value):
+        """Python/JSON-värde → SQLite-värde enligt kolumnens typ."""
+        if value is None:
+            return None
+        kind = self._types.get(table, {}).get(column)
+        if kind is None:
+            raise LocalError("42703", f'column {table}.{column} does not exist')
+        if kind == "TIMESTAMPTZ":
+            return _timestamp(value)
+        if kind == "BOOLEAN":
+            return int(value in (True, 1, "true", "t", "1"))
+        if kind == "JSONB":
+            return json.dumps(value)
+        if kind == "DATE":
+            return str(value)[:10]
+        return value
+
+    def rows(self, table: str, cursor) -> list:
+        """SQLite-rader → dicts som PostgREST skulle returnera dem."""
+        types = self._types[table]
+        out = []
+        for r in cursor:
+            row = dict(r)
+            for column, value in row.items():
+                if value is None:
+                    continue
+                kind = types.get(column)
+                if kind == "BOOLEAN":
+                    row[column] = bool(value)
+                elif kind == "JSONB" and isinstance(value, str):
+                    row[column] = json.loads(value)
+            out.append(row)
+        return out
+
+    def close(self):
+        self._conn.close()
+
+
+class _Transaction:
+    """Lås anslutningen och kör en fråga i en egen transaktion."""
+    def __init__(self, client: LocalClient):
+        self.client = client
+
+    def __enter__(self):
+        self.client._lock.acquire()
+        if self.client.on_request:
+            self.client.on_request()
+        self.client._conn.execute("BEGIN")
+        return self.client._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.client._conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.client._lock.release()
+        if isinstance(exc, sqlite3.Error):
+            raise LocalError("XX000", str(exc)) from exc
@@ -0,0 +1,161 @@
+"""Keyset-paginering (timestamp-cursor) för PostgREST-frågor.
+
+OFFSET-paginering tvingar Postgres att läsa och slänga alla tidigare rader för
+varje sida. Här fortsätter varje sida i stället efter sista (timestamp, nyckel)
+från förra sidan, så varje sida blir en indexsökning på timestamp-indexet.
+
+Prefetcher läser sidor i en bakgrundstråd, högst några sidor i förväg, så
+att t.ex. energi och priser hämtas samtidigt medan anroparen strömmar dem.
+iter_pages_parallel() delar dessutom stora tidsintervall i delintervall som
+pagineras samtidigt men ges ut i ordning.
+"""
+from datetime import datetime, timedelta
+import queue
+import threading
+import sys
+import os
+sys.path.insert(0, os.path.dirname(__file__))
+from _db import record_page
+
+PAGE_SIZE = 1000
+FETCH_WORKERS = int(os.environ.get("FETCH_WORKERS", "4"))   # parallella delintervall per fråga
+PREFETCH_PAGES = 2   # sidor som läses i förväg per ström (begränsar minnet)
+
+
+def iter_pages(build, tiebreak: str = "device_key", page_size: int = PAGE_SIZE,
+               column: str = "timestamp"):
+    """Ger sidor (listor av rader) ordnade på (column, tiebreak).
+
+    `build` ska returnera en ny query builder med select och filter satta.
+    Select måste innehålla både column och tiebreak-kolumnen, och
+    (column, tiebreak) måste vara unikt i tabellen.
+    """
+    cursor = None
+    while True:
+        q = build()
+        if cursor:
+            ts, key = cursor
+            # gte avgränsar indexsökningen, or_ hoppar över redan lästa rader med samma värde
+            q = (q.gte(column, ts)
+                 .or_(f'{column}.gt."{ts}",and({column}.eq."{ts}",{tiebreak}.gt."{key}")'))
+        res = q.order(column).order(tiebreak).limit(page_size).execute()
+        record_page(len(res.data))
+        if res.data:
+            yield res.data
+        if len(res.data) < page_size:
+            return
+        last = res.data[-1]
+        cursor = (last[column], last[tiebreak])
+
+
+def fetch_all(build, tiebreak: str = "device_key", page_size: int = PAGE_SIZE,
+              column: str = "timestamp") -> list:
+    """Hämta alla rader för frågan från `build` (se iter_pages)."""
+    rows = []
+    for page in iter_pages(build, tiebreak, page_size, column):
+        rows.extend(page)
+    return rows
+
+
+_DONE = object()
+
+
+class Prefetcher:
+    """Läs sidor från iteratorn `pages` i en bakgrundstråd som startar direkt.
+
+    Högst `depth` sidor ligger färdiga i förväg. Fel i tråden kastas vidare
+    hos läsaren; close() avbryter läsningen.
+    """
+    def __init__(self, pages, depth: int = PREFETCH_PAGES):
+        self._buf = queue.Queue(maxsize=depth)
+        self._stop = threading.Event()
+        threading.Thread(target=self._produce, args=(pages,), daemon=True).start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._buf.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, pages):
+        try:
+            for page in pages:
+                if not self._put(page):
+                    return
+        except Exception as e:
+            self._put(e)
+        else:
+            self._put(_DONE)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._stop.is_set():
+            raise StopIteration
+        item = self._buf.get()
+        if item is _DONE:
+            self._stop.set()
+            raise StopIteration
+        if isinstance(item, Exception):
+            self._stop.set()
+            raise item
+        return item
+
+    def close(self):
+        self._stop.set()
+
+
+def count_rows(build) -> int:
+    """Exakt antal rader för frågan. build måste ta count-argumentet till select."""
+    return build(count="exact").limit(1).execute().count or 0
+
+
+def _boundaries(start: str, end: str, slices: int) -> list:
+    """Dela [start, end) i `slices` lika långa tidsintervall (face value, samma suffix)."""
+    suffix = start[19:]
+    t0 = datetime.fromisoformat(start[:19])
+    t1 = datetime.fromisoformat(end[:19]) if end else datetime.utcnow() + timedelta(hours=3)
+    step = (t1 - t0) / slices
+    return [(t0 + step * i).strftime("%Y-%m-%dT%H:%M:%S") + suffix for i in range(1, slices)]
+
+
+def iter_pages_parallel(build, start: str, end: str = None, tiebreak: str = "device_key",
+                        column: str = "timestamp", workers: int = None):
+    """Som iter_pages, men när frågan spänner över flera sidor delas
+    [start, end] i tidsintervall som pagineras parallellt (via Prefetcher).
+    Sidorna ges ut i samma ordning som iter_pages.
+
+    build måste ta count-argumentet till select (se count_rows) och själv
+    innehålla filtren för start/end; delintervallen läggs ovanpå.
+    """
+    workers = workers or FETCH_WORKERS
+    pages = -(-count_rows(build) // PAGE_SIZE)
+    slices = min(workers, pages)
+    if slices <= 1:
+        yield from iter_pages(build, tiebreak, column=column)
+        return
+
+    bounds = _boundaries(start, end, slices)
+
+    def build_slice(lo, hi):
+        def build_one():
+            q = build()
+            if lo:
+                q = q.gte(column, lo)
+            if hi:
+                q = q.lt(column, hi)
+            return q
+        return build_one
+
+    streams = [Prefetcher(iter_pages(build_slice(lo, hi), tiebreak, column=column))
+               for lo, hi in zip([None] + bounds, bounds + [None])]
+    try:
+        for stream in streams:
+            yield from stream
+    finally:
+        for stream in streams:
+            stream.close()
@@ -0,0 +1,222 @@
+"""Dagliga aggregat per enhet och rollup-tabellen daily_summaries.
+
+compute_daily() räknar kWh, kostnad och aktiva intervall direkt från
+rådata (strömmande join i _aggregate). Kostnaden räknas på två sätt: `cost` med timmedelpris (som
+/api/daily alltid gjort) och `cost_15m`/`kwh_priced`/`kwh_price_sum` med
+15-min pris (som /api/monthly), så att båda endpoints kan bygga på samma
+dagsdelar. sync.py skriver resultatet inkrementellt till daily_summaries för
+de dagar som fått nya mätningar; läsarna hämtar sedan en rad per dag och
+enhet i stället för att aggregera om all rådata vid varje anrop.
+"""
+from datetime import datetime, timedelta, date
+import calendar
+import sys
+import os
+sys.path.insert(0, os.path.dirname(__file__))
+from _pagination import fetch_all
+from _aggregate import SUMMARY_FIELDS, daily_totals
+from _devices import load_devices
+from _timebuckets import local_now
+
+
+def local_today() -> str:
+    """Dagens datum i svensk tid (YYYY-MM-DD)."""
+    return local_now().strftime("%Y-%m-%d")
+
+
+def days_between(first_day: str, last_day: str) -> list:
+    """Alla dagar first_day..last_day (inklusive) som YYYY-MM-DD."""
+    d, end = date.fromisoformat(first_day), date.fromisoformat(last_day)
+    result = []
+    while d <= end:
+        result.append(d.isoformat())
+        d += timedelta(days=1)
+    return result
+
+
+def day_spans(days) -> list:
+    """Sorterade YYYY-MM-DD → lista av sammanhängande (första, sista)-par."""
+    spans = []
+    for d in sorted(set(days)):
+        if spans and date.fromisoformat(d) - date.fromisoformat(spans[-1][1]) == timedelta(days=1):
+            spans[-1][1] = d
+        else:
+            spans.append([d, d])
+    return [tuple(s) for s in spans]
+
+
+def compute_daily(db, from_ts: str, to_ts: str = None) -> dict:
+    """Aggregera rådata i [from_ts, to_ts] (fake-UTC, to_ts inklusive).
+
+    Returnerar {dag: {device_id: {fält i SUMMARY_FIELDS}}}.
+    """
+    return daily_totals(db, from_ts, to_ts)
+
+
+def compute_days(db, first_day: str, last_day: str) -> dict:
+    """compute_daily för hela kalenderdagar first_day..last_day."""
+    return compute_daily(db, first_day + "T00:00:00", last_day + "T23:59:59")
+
+
+def write_daily_summaries(db, daily: dict) -> int:
+    """Upserta dagar i compute_daily-form till daily_summaries. Returnerar antal rader."""
+    now = datetime.utcnow().isoformat()
+    rows = [
+        {"day": day, "device_id": device_id, "updated_at": now, **v}
+        for day, devices in daily.items()
+        for device_id, v in devices.items()
+    ]
+    if rows:
+        db.table("daily_summaries").upsert(rows, on_conflict="day,device_id").execute()
+    return len(rows)
+
+
+def refresh_daily_summaries(db, days) -> dict:
+    """Räkna om och spara daily_summaries för de angivna dagarna."""
+    saved = 0
+    errors = []
+    for first, last in day_spans(days):
+        try:
+            saved += write_daily_summaries(db, compute_days(db, first, last))
+        except Exception as e:
+            errors.append(f"{first}..{last}: {e}")
+    return {"saved": saved, "errors": errors}
+
+
+def read_daily_summaries(db, first_day: str, last_day: str) -> dict:
+    """Läs daily_summaries för first_day..last_day i samma form som compute_daily.
+    Enhetsnamnen tas från devices, så ett namnbyte gäller även sparade dagar."""
+    rows = fetch_all(lambda: (
+        db.table("daily_summaries")
+        .select("day, device_id, " + ", ".join(SUMMARY_FIELDS))
+        .gte("day", first_day)
+        .lte("day", last_day)
+    ), tiebreak="device_id", column="day")
+    names = {d["device_id"]: d["device_name"] for d in load_devices(db).values()}
+    daily = {}
+    for r in rows:
+        v = daily.setdefault(r["day"], {})[r["device_id"]] = {f: r[f] for f in SUMMARY_FIELDS}
+        v["device_name"] = names.get(r["device_id"], v["device_name"])
+    return daily
+
+
+def load_days(db, first_day: str, last_day: str, write_db=None, partial_from: str = None) -> dict:
+    """Dagar first_day..last_day i compute_daily-form.
+
+    Avslutade dagar läses från daily_summaries; idag och dagar som saknas
+    räknas live från rådata. Saknade avslutade dagar sparas tillbaka med
+    write_db om den anges. partial_from (fake-UTC) betyder att första dagen
+    bara ingår från den tidpunkten – den dagen räknas då alltid live.
+    """
+    today = local_today()
+
+    # 1. Avslutade dagar från rollupen
+    yesterday = (date.fromisoformat(today) - timedelta(days=1)).isoformat()
+    cache_last = min(last_day, yesterday)
+    daily = read_daily_summaries(db, first_day, cache_last) if first_day <= cache_last else {}
+    if partial_from:
+        daily.pop(first_day, None)
+
+    # 2. Live: idag, ev. delvis första dag och dagar som saknas i rollupen
+    missing = [d for d in days_between(first_day, last_day) if d not in daily]
+    backfill = {}
+    for first, last in day_spans(missing):
+        if partial_from and first == first_day:
+            computed = compute_daily(db, partial_from, last + "T23:59:59")
+        else:
+            computed = compute_days(db, first, last)
+        daily.update(computed)
+        backfill.update({
+            d: v for d, v in computed.items()
+            if d < today and not (partial_from and d == first_day)
+        })
+
+    # Spara saknade avslutade dagar så nästa anrop kan läsa dem från rollupen
+    if backfill and write_db is not None:
+        try:
+            write_daily_summaries(write_db, backfill)
+        except Exception:
+            pass   # cache-skrivning får inte fälla anropet
+
+    return daily
+
+
+def format_month(mon: str, devs: dict, readings: int) -> dict:
+    """Månadsraden (som i monthly_summaries) för månaden YYYY-MM ur summor per
+    enhetsnamn {device_name: {kwh, cost, kwh_priced, wp}} och antal mätningar."""
+    tkwh  = sum(d["kwh"]  for d in devs.values())
+    tcost = sum(d["cost"] for d in devs.values())
+    tkp   = sum(d["kwh_priced"] for d in devs.values())
+    twp   = sum(d["wp"]   for d in devs.values())
+    avg_p = twp / tkp if tkp > 0 else None
+
+    yr, mo = int(mon[:4]), int(mon[5:7])
+    days = calendar.monthrange(yr, mo)[1]
+    expected = 4 * 24 * days * len(devs)
+    return {
+        "total_kwh":     round(tkwh, 1),
+        "total_cost":    round(tcost, 0),
+        "avg_price_ore": round(avg_p, 1) if avg_p is not None else None,
+        "readings":      readings,
+        "partial":       readings / max(expected, 1) < 0.5,
+        "devices": {
+            name: {"kwh": round(d["kwh"], 1), "cost": round(d["cost"], 0)}
+            for name, d in devs.items()
+        }
+    }
+
+
+def month_from_days(daily: dict, mon: str):
+    """Summera compute_daily-dagar till månadsraden (format_month) för en
+    månad (YYYY-MM), eller None om månaden saknar mätningar."""
+    devs = {}
+    readings = 0
+    for day, devices in daily.items():
+        if not day.startswith(mon):
+            continue
+        for v in devices.values():
+            d = devs.setdefault(v["device_name"], {"kwh": 0.0, "cost": 0.0,
+                                                   "kwh_priced": 0.0, "wp": 0.0})
+            d["kwh"]        += v["kwh"]
+            d["cost"]       += v["cost_15m"]
+            d["kwh_priced"] += v["kwh_priced"]
+            d["wp"]         += v["kwh_price_sum"]
+            readings        += v["readings"]
+    if not devs:
+        return None
+    return format_month(mon, devs, readings)
+
+
+def month_days(mon: str) -> tuple:
+    """(första, sista) dag i månaden YYYY-MM."""
+    y, m = int(mon[:4]), int(mon[5:7])
+    return f"{mon}-01", f"{mon}-{calendar.monthrange(y, m)[1]:02d}"
+
+
+def refresh_stale_months(db, dirty_months) -> dict:
+    """Markera cachade månader i monthly_summaries som stale och räkna om
+    alla stale månader från dagsdelarna (även de som blev kvar från tidigare
+    körningar). Misslyckas en omräkning ligger månaden kvar som stale och
+    /api/monthly räknar om den vid nästa läsning."""
+    errors = []
+    if dirty_months:
+        db.table("monthly_summaries").update({"stale": True}).in_(
+            "month", sorted(dirty_months)
+        ).execute()
+
+    stale = db.table("monthly_summaries").select("month").eq("stale", True).execute()
+    refreshed = []
+    for mon in sorted(r["month"] for r in stale.data):
+        try:
+            first, last = month_days(mon)
+            row = month_from_days(load_days(db, first, last, write_db=db), mon)
+            if row is None:
+                db.table("monthly_summaries").delete().eq("month", mon).execute()
+            else:
+                db.table("monthly_summaries").upsert(
+                    {"month": mon, **row, "stale": False}, on_conflict="month"
+                ).execute()
+            refreshed.append(mon)
+        except Exception as e:
+            errors.append(f"{mon}: {e}")
+    return {"refreshed": refreshed, "errors": errors}
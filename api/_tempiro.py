@@ -1,68 +1,273 @@
-"""Tempiro API client - hämtar data från Tempiro molnet."""
+"""Tempiro API client - hämtar data från Tempiro molnet.
+
+Auth-token sparas i en delad token-store (TEMPIRO_TOKEN_STORE) så att nya
+instanser kan återanvända den i stället för att göra en POST /Token vid
+varje kallstart:
+  supabase – tabellen tempiro_tokens (standard när Supabase är konfigurerat)
+  file     – JSON-fil (TEMPIRO_TOKEN_FILE), delas av processer på samma maskin
+  memory   – bara i processen (tidigare beteende)
+Ett 401-svar gör att en ny token hämtas och anropet görs om en gång.
+
+Alla anrop går via en delad requests-session med anslutningspool och
+keep-alive mot Tempiro-servern. Idempotenta anrop (GET/PUT) görs om vid
+anslutningsfel och 429/5xx med exponentiell backoff och jitter. Tid och
+antal per anropstyp räknas i tempiro_stats().
+"""
 import os
+import json
+import threading
 import time
 import requests
-from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from datetime import datetime, timedelta, timezone
 
 TEMPIRO_USERNAME = os.environ["TEMPIRO_USERNAME"]
 TEMPIRO_PASSWORD = os.environ["TEMPIRO_PASSWORD"]
 BASE_URL = os.environ.get("TEMPIRO_BASE_URL", "http://xmpp.tempiro.com:5000")
+TOKEN_STORE = os.environ.get("TEMPIRO_TOKEN_STORE", "supabase" if os.environ.get("SUPABASE_URL") else "file")
+TOKEN_FILE = os.environ.get("TEMPIRO_TOKEN_FILE", "/tmp/tempiro_token.json")
+TOKEN_LIFETIME = timedelta(days=6)
+HTTP_RETRIES = int(os.environ.get("TEMPIRO_RETRIES", "3"))
+VALUES_RETRIES = int(os.environ.get("TEMPIRO_VALUES_RETRIES", "1"))
+# Values-anrop görs av sync, som ger upp enheter efter SYNC_DEADLINE (45 s): ett anrop
+# tar högst (1 + VALUES_RETRIES) × (connect + read) + backoff ≈ 2 × 20 + 0.6 s
+VALUES_TIMEOUT = (5, 15)
+POOL_SIZE = int(os.environ.get("TEMPIRO_POOL_SIZE", "16"))   # >= SYNC_WORKERS
 
 _token_cache = {"token": None, "expires": None}
+_token_lock = threading.Lock()
 
 
-def get_token() -> str:
-    """Hämta auth-token, använd cache om giltig."""
-    now = datetime.now()
-    if _token_cache["token"] and _token_cache["expires"] and now < _token_cache["expires"]:
-        return _token_cache["token"]
+# ── HTTP-session och mätning ────────────────────────────────────────────────
 
-    resp = requests.post(
-        f"{BASE_URL}/Token",
-        json={"Username": TEMPIRO_USERNAME, "Password": TEMPIRO_PASSWORD},
-        timeout=15,
+def _retry(total: int) -> Retry:
+    return Retry(
+        total=total,
+        backoff_factor=0.3,          # 0.3s, 0.6s, 1.2s ...
+        backoff_jitter=0.3,          # + slumpmässigt 0–0.3s så parallella anrop inte krockar
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "PUT"}),   # POST /Token är inte idempotent
+        raise_on_status=False,       # sista svaret går vidare till raise_for_status
     )
-    resp.raise_for_status()
-    data = resp.json()
-    token = data["access_token"]
-    _token_cache["token"] = token
-    _token_cache["expires"] = now + timedelta(days=6)
-    return token
 
 
-def get_headers() -> dict:
+def _make_session() -> requests.Session:
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE, max_retries=_retry(HTTP_RETRIES))
+    # Färre omförsök för Values så att ett anrop inte överlever synkens deadline
+    values = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=_retry(VALUES_RETRIES))
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.mount(f"{BASE_URL}/api/Values/", values)   # längsta prefixet vinner
+    return session
+
+
+_session = _make_session()
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _record(name: str, started: float, resp=None, error: bool = False):
+    """Registrera ett anrop: antal, fel, omförsök och tid i ms."""
+    ms = (time.perf_counter() - started) * 1000
+    retries = 0
+    if resp is not None and resp.raw is not None and getattr(resp.raw, "retries", None):
+        retries = len(resp.raw.retries.history)
+    with _stats_lock:
+        st = _stats.setdefault(name, {"calls": 0, "errors": 0, "retries": 0,
+                                      "total_ms": 0.0, "max_ms": 0.0})
+        st["calls"] += 1
+        st["errors"] += int(error)
+        st["retries"] += retries
+        st["total_ms"] += ms
+        st["max_ms"] = max(st["max_ms"], ms)
+
+
+def tempiro_stats() -> dict:
+    """Kumulativa räknare per anropstyp för processen."""
+    with _stats_lock:
+        return {name: dict(st) for name, st in _stats.items()}
+
+
+def _send(name: str, method: str, url: str, **kwargs) -> requests.Response:
+    started = time.perf_counter()
+    try:
+        resp = _session.request(method, url, **kwargs)
+    except requests.RequestException:
+        _record(name, started, error=True)
+        raise
+    _record(name, started, resp, error=resp.status_code >= 400)
+    return resp
+
+
+# ── Token-stores ────────────────────────────────────────────────────────────
+
+class MemoryTokenStore:
+    """Ingen delning – token lever bara i _token_cache."""
+    def load(self):
+        return None
+
+    def save(self, token: str, expires: datetime):
+        pass
+
+
+class FileTokenStore:
+    """Token i en JSON-fil."""
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("username") != TEMPIRO_USERNAME:
+            return None
+        return data["token"], datetime.fromisoformat(data["expires"])
+
+    def save(self, token: str, expires: datetime):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"username": TEMPIRO_USERNAME, "token": token,
+                       "expires": expires.isoformat()}, f)
+        os.replace(tmp, self.path)   # atomiskt – läsare ser aldrig en halv fil
+
+
+class SupabaseTokenStore:
+    """Token i tabellen tempiro_tokens (en rad per användarnamn)."""
+    def _db(self):
+        from _db import get_db   # lazy – _tempiro ska gå att importera utan Supabase
+        return get_db()
+
+    def load(self):
+        res = (self._db().table("tempiro_tokens")
+               .select("token, expires")
+               .eq("username", TEMPIRO_USERNAME)
+               .execute())
+        if not res.data:
+            return None
+        row = res.data[0]
+        return row["token"], datetime.fromisoformat(row["expires"].replace("Z", "+00:00"))
+
+    def save(self, token: str, expires: datetime):
+        self._db().table("tempiro_tokens").upsert({
+            "username": TEMPIRO_USERNAME,
+            "token": token,
+            "expires": expires.isoformat(),
+        }, on_conflict="username").execute()
+
+
+def _make_store():
+    if TOKEN_STORE == "supabase":
+        return SupabaseTokenStore()
+    if TOKEN_STORE == "file":
+        return FileTokenStore(TOKEN_FILE)
+    return MemoryTokenStore()
+
+
+_store = _make_store()
+
+
+def _store_call(method, *args):
+    """Anropa token-storen; fel där får aldrig stoppa ett API-anrop."""
+    try:
+        return getattr(_store, method)(*args)
+    except Exception:
+        return None
+
+
+# ── Auth ────────────────────────────────────────────────────────────────────
+
+def get_token(stale: str = None) -> str:
+    """Hämta auth-token: processcache → delad store → POST /Token.
+    stale är en token som just fått 401 och inte får återanvändas."""
+    now = datetime.now(timezone.utc)
+
+    def cached():
+        token, expires = _token_cache["token"], _token_cache["expires"]
+        if token and token != stale and expires and now < expires:
+            return token
+        return None
+
+    token = cached()
+    if token:
+        return token
+
+    # En tråd i taget hämtar ny token; övriga (t.ex. parallell synk) väntar och återanvänder den
+    with _token_lock:
+        token = cached()
+        if token:
+            return token
+
+        stored = _store_call("load")
+        if stored and stored[0] != stale and now < stored[1]:
+            _token_cache["token"], _token_cache["expires"] = stored
+            return stored[0]
+
+        resp = _send(
+            "token", "POST", f"{BASE_URL}/Token",
+            json={"Username": TEMPIRO_USERNAME, "Password": TEMPIRO_PASSWORD},
+            timeout=15,
+        )
+        resp.raise_for_status()
+        data = resp.json()
+        token = data["access_token"]
+        expires = now + TOKEN_LIFETIME
+        _token_cache["token"] = token
+        _token_cache["expires"] = expires
+        _store_call("save", token, expires)
+        return token
+
+
+def _headers(token: str) -> dict:
     return {
         "Accept": "application/json",
-        "Authorization": f"Bearer {get_token()}"
+        "Authorization": f"Bearer {token}"
     }
 
 
+def get_headers() -> dict:
+    return _headers(get_token())
+
+
+def _request(name: str, method: str, path: str, **kwargs) -> requests.Response:
+    """Autentiserat anrop. Vid 401 hämtas ny token och anropet görs om en gång."""
+    token = get_token()
+    resp = _send(name, method, f"{BASE_URL}{path}", headers=_headers(token), **kwargs)
+    if resp.status_code == 401:
+        token = get_token(stale=token)
+        resp = _send(name, method, f"{BASE_URL}{path}", headers=_headers(token), **kwargs)
+    resp.raise_for_status()
+    return resp
+
+
+# ── API ─────────────────────────────────────────────────────────────────────
+
 def get_devices() -> list:
     """Hämta alla enheter."""
-    resp = requests.get(f"{BASE_URL}/api/devices", headers=get_headers(), timeout=15)
-    resp.raise_for_status()
-    return resp.json()
+    return _request("devices", "GET", "/api/devices", timeout=15).json()
 
 
 def get_device_values(device_id: str, from_dt: str, to_dt: str) -> list:
     """Hämta mätvärden för en enhet inom ett tidsintervall."""
-    resp = requests.get(
-        f"{BASE_URL}/api/Values/{device_id}/interval",
-        headers=get_headers(),
+    resp = _request(
+        "values", "GET",
+        f"/api/Values/{device_id}/interval",
         params={"from": from_dt, "to": to_dt, "intervalMinutes": 15},
-        timeout=30,
+        timeout=VALUES_TIMEOUT,
     )
-    resp.raise_for_status()
     return resp.json()
 
 
 def switch_device(device_id: str, value: int) -> dict:
     """Slå på/av en enhet (value: 1=på, 0=av)."""
-    resp = requests.put(
-        f"{BASE_URL}/api/devices/{device_id}/switch",
-        headers=get_headers(),
+    resp = _request(
+        "switch", "PUT",
+        f"/api/devices/{device_id}/switch",
         json={"value": value},
         timeout=15,
     )
-    resp.raise_for_status()
     return resp.json() if resp.content else {}
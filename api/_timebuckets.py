@@ -0,0 +1,110 @@
+"""Tidsbuckets för aggregeringen: heltalsindex i stället för formaterade strängar.
+
+Energimätningar lagras som lokal svensk tid (fake-UTC) och spotpriser som
+riktig UTC. Här mappas båda till heltalsindex för 15-min kvarter, timmar och
+dagar räknat från EPOCH (lokal face value), utan datetime-parsning per rad:
+datumdelen slås upp i en cache (dag → index) och klockslaget läses direkt ur
+strängen. UTC → lokal tid använder en förberäknad tabell med
+sommartidsövergångarna för Europe/Stockholm (sista söndagen i mars och
+oktober kl 01:00 UTC).
+"""
+from datetime import date, datetime, timedelta, timezone
+import calendar
+
+EPOCH = date(2000, 1, 1)
+QUARTERS_PER_DAY = 96
+QUARTERS_PER_HOUR = 4
+
+_day_index = {}    # "YYYY-MM-DD" → dagindex
+_day_string = {}   # dagindex → "YYYY-MM-DD"
+_transitions = {}  # år → (sommartid start, slut) som UTC-kvartsindex
+
+
+def _last_sunday(year, month):
+    last_day = calendar.monthrange(year, month)[1]
+    days_back = (datetime(year, month, last_day).weekday() + 1) % 7
+    return last_day - days_back
+
+
+def day_index(day: str) -> int:
+    """"YYYY-MM-DD" (eller längre tidsstämpel) → dagar sedan EPOCH."""
+    key = day[:10]
+    idx = _day_index.get(key)
+    if idx is None:
+        idx = _day_index[key] = (date.fromisoformat(key) - EPOCH).days
+        _day_string[idx] = key
+    return idx
+
+
+def day_string(idx: int) -> str:
+    """Dagindex → "YYYY-MM-DD"."""
+    s = _day_string.get(idx)
+    if s is None:
+        s = (EPOCH + timedelta(days=idx)).isoformat()
+        _day_index[s] = idx
+        _day_string[idx] = s
+    return s
+
+
+def month_string(idx: int) -> str:
+    """Dagindex → "YYYY-MM"."""
+    return day_string(idx)[:7]
+
+
+def quarter_index(ts: str) -> int:
+    """Tidsstämpelns face value → 15-min index sedan EPOCH (tidszonen ignoreras)."""
+    return day_index(ts) * QUARTERS_PER_DAY + int(ts[11:13]) * 4 + int(ts[14:16]) // 15
+
+
+def hour_index(ts: str) -> int:
+    """Tidsstämpelns face value → timindex sedan EPOCH."""
+    return day_index(ts) * 24 + int(ts[11:13])
+
+
+def face_seconds(ts: str) -> int:
+    """Tidsstämpelns face value → sekunder sedan EPOCH."""
+    return (day_index(ts) * 86400 + int(ts[11:13]) * 3600
+            + int(ts[14:16]) * 60 + int(ts[17:19]))
+
+
+def _dst_span(year: int) -> tuple:
+    """(start, slut) för sommartid år `year` som UTC-kvartsindex."""
+    span = _transitions.get(year)
+    if span is None:
+        start = day_index(f"{year:04d}-03-{_last_sunday(year, 3):02d}") * QUARTERS_PER_DAY + 4
+        end   = day_index(f"{year:04d}-10-{_last_sunday(year, 10):02d}") * QUARTERS_PER_DAY + 4
+        span = _transitions[year] = (start, end)
+    return span
+
+
+# Förberäkna övergångarna för de år datan rimligen täcker
+for _year in range(2020, 2041):
+    _dst_span(_year)
+
+
+def utc_offset_quarters(utc_quarter: int, year: int) -> int:
+    """Svensk UTC-offset i kvarter (8 sommartid, 4 vintertid) för ett UTC-kvartsindex."""
+    start, end = _dst_span(year)
+    return 8 if start <= utc_quarter < end else 4
+
+
+def local_quarter(ts_utc: str) -> int:
+    """Riktig UTC-tidsstämpel → lokalt (svenskt) 15-min index, jämförbart med
+    quarter_index för energimätningarnas fake-UTC."""
+    q = quarter_index(ts_utc)
+    return q + utc_offset_quarters(q, int(ts_utc[:4]))
+
+
+def se_offset(dt_utc: datetime) -> int:
+    """Svensk UTC-offset i timmar (1 eller 2) för en UTC-datetime."""
+    return utc_offset_quarters(quarter_index(dt_utc.strftime("%Y-%m-%dT%H:%M")), dt_utc.year) // 4
+
+
+def to_local(dt_utc: datetime) -> datetime:
+    """UTC-datetime → svensk lokal tid som naiv datetime (samma face value som fake-UTC)."""
+    return (dt_utc + timedelta(hours=se_offset(dt_utc))).replace(tzinfo=None)
+
+
+def local_now() -> datetime:
+    """Nuvarande svensk lokal tid som naiv datetime (samma face value som fake-UTC)."""
+    return to_local(datetime.now(timezone.utc))
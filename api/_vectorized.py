@@ -0,0 +1,101 @@
+"""Vektoriserad sidaggregering med NumPy (valfritt beroende).
+
+En sida energirader läses in i typade arrayer (int64 kvartsindex, float64
+effekt, heltalskoder för enhetsnyckeln) och kWh, kostnad och aktiva
+intervall räknas med grupperade reduktioner (np.bincount) per dag och
+enhet. Priserna slås upp en gång per unik timme/kvart i sidan via
+_aggregate.PriceWindow. Utan NumPy används den rena Python-vägen i
+_aggregate.
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(__file__))
+from _timebuckets import EPOCH, QUARTERS_PER_DAY, QUARTERS_PER_HOUR
+
+try:
+    import numpy as np
+except ImportError:   # valfritt beroende – faller tillbaka på ren Python
+    np = None
+
+_NP_EPOCH = np.datetime64(EPOCH.isoformat(), "m") if np is not None else None
+
+
+def available() -> bool:
+    return np is not None
+
+
+def _codes(values) -> tuple:
+    """Godtyckliga värden (även None) → (heltalskoder i första förekomstens
+    ordning, antal olika värden)."""
+    codes = {}
+    return np.fromiter((codes.setdefault(v, len(codes)) for v in values),
+                       dtype=np.int64, count=len(values)), len(codes)
+
+
+def _lookup(keys, price_of, missing: float) -> "np.ndarray":
+    """Slå upp pris per unik nyckel och sprid tillbaka till alla rader."""
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    prices = [price_of(int(k)) for k in uniq]
+    return np.array([missing if p is None else p for p in prices], dtype=np.float64)[inverse]
+
+
+def page_groups(page: list, window, with_activity: bool = True) -> list:
+    """En sida energirader (sorterad på timestamp) → grupper per
+    (dag, device_key) i ordning efter gruppens första rad.
+
+    Varje grupp är en dict med day (dagindex), device_key och summorna kwh, cost
+    (timmedelpris), readings, active_intervals, cost_15m, kwh_priced och
+    kwh_price_sum – samma fält som _aggregate.aggregate_daily.
+    """
+    minutes = np.array([r["timestamp"][:16] for r in page], dtype="datetime64[m]") - _NP_EPOCH
+    q = minutes.astype(np.int64) // 15
+    h = q // QUARTERS_PER_HOUR
+    day = q // QUARTERS_PER_DAY
+
+    # Priser för alla timmar i sidan; tidigare timmar släpps
+    window.evict_before(int(h[0]))
+    window.load_until(int(h[-1]))
+    hour_ore = _lookup(h, window.hour_price, 0.0)
+    quarter_ore = _lookup(q, window.quarter_price, np.nan)
+    priced = ~np.isnan(quarter_ore)
+
+    # current_value (Watt) × 0.25h / 1000 = kWh
+    watts = np.array([r["current_value"] or 0 for r in page], dtype=np.float64)
+    kwh = watts * 0.25 / 1000
+    cost = kwh * hour_ore / 100
+    cost_15m = np.where(priced, kwh * quarter_ore / 100, 0.0)
+    kwh_priced = np.where(priced, kwh, 0.0)
+    kwh_price_sum = np.where(priced, kwh * quarter_ore, 0.0)
+    active = watts > 0
+    if with_activity:
+        delta = np.array([r.get("delta_power") or 0 for r in page], dtype=np.float64)
+        active |= delta > 0
+
+    # Gruppnyckel (dag, enhet) → 0..k-1
+    key_code, n_keys = _codes([r["device_key"] for r in page])
+    key = (day - day[0]) * n_keys + key_code
+    keys, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+    k = len(keys)
+
+    def total(values):
+        return np.bincount(inverse, weights=values, minlength=k)
+
+    sums = {
+        "kwh": total(kwh),
+        "cost": total(cost),
+        "cost_15m": total(cost_15m),
+        "kwh_priced": total(kwh_priced),
+        "kwh_price_sum": total(kwh_price_sum),
+    }
+    readings = np.bincount(inverse, minlength=k)
+    active_intervals = np.bincount(inverse[active], minlength=k)
+
+    groups = []
+    for i in np.argsort(first):
+        row = page[first[i]]
+        g = {"day": int(day[first[i]]), "device_key": row["device_key"],
+             "readings": int(readings[i]), "active_intervals": int(active_intervals[i])}
+        for field, values in sums.items():
+            g[field] = float(values[i])
+        groups.append(g)
+    return groups
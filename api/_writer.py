@@ -0,0 +1,163 @@
+"""Skrivvägar för bulkdata (energy_readings, spot_prices).
+
+PostgrestWriter upsertar JSON-listor via Supabase/PostgREST som tidigare.
+CopyWriter går direkt mot Postgres (DATABASE_URL): raderna strömmas med COPY
+in i en temporär staging-tabell och slås ihop med INSERT ... ON CONFLICT DO
+UPDATE i samma transaktion – ingen JSON, en rundresa per batch och
+Postgres parsar värdena i bulk. Båda har samma gränssnitt:
+
+    writer.upsert(table, rows, on_conflict)   # rader som dicts, samma nycklar
+
+get_writer() väljer CopyWriter när DATABASE_URL är satt och psycopg finns
+(valfritt beroende), annars PostgrestWriter. WRITE_BACKEND=postgrest|copy
+tvingar fram en väg.
+"""
+import os
+import sys
+import threading
+import zlib
+
+sys.path.insert(0, os.path.dirname(__file__))
+from _local import LocalClient
+
+try:
+    import psycopg
+    from psycopg import sql
+except ImportError:   # valfritt beroende – bara PostgREST-vägen finns då
+    psycopg = sql = None
+
+DATABASE_URL = os.environ.get("DATABASE_URL")                # direkt Postgres-DSN (t.ex. Supabase pooler)
+WRITE_BACKEND = os.environ.get("WRITE_BACKEND", "auto")      # auto | postgrest | copy
+POOL_SIZE = int(os.environ.get("COPY_POOL_SIZE", "8"))        # max Postgres-anslutningar, >= SYNC_WORKERS
+
+_writers = {}
+_lock = threading.Lock()
+
+
+class PostgrestWriter:
+    """Upsert via PostgREST (supabase-klienten) eller den lokala databasen."""
+    def __init__(self, db):
+        self.db = db
+
+    def upsert(self, table: str, rows: list, on_conflict: str) -> int:
+        if rows:
+            self.db.table(table).upsert(rows, on_conflict=on_conflict).execute()
+        return len(rows)
+
+    def close(self):
+        pass
+
+
+class CopyWriter:
+    """COPY till staging-tabell + INSERT ... ON CONFLICT DO UPDATE.
+
+    Anslutningarna lånas ur en pool med högst pool_size anslutningar (sync
+    och migreringen skriver parallellt); lediga anslutningar återanvänds av
+    nästa varma körning i stället för att en ny öppnas per tråd. Varje
+    anslutning har sina temporära staging-tabeller per (tabell, kolumner),
+    som töms vid commit.
+    """
+    def __init__(self, dsn: str, pool_size: int = None):
+        if psycopg is None:
+            raise RuntimeError("psycopg saknas (pip install 'psycopg[binary]')")
+        self.dsn = dsn
+        self._slots = threading.BoundedSemaphore(max(1, pool_size or POOL_SIZE))
+        self._idle = []   # lediga (anslutning, staging-tabeller som finns i den)
+        self._idle_lock = threading.Lock()
+
+    def _checkout(self) -> tuple:
+        with self._idle_lock:
+            if self._idle:
+                return self._idle.pop()
+        return psycopg.connect(self.dsn, autocommit=True), set()
+
+    def _checkin(self, conn, staged: set):
+        if conn.closed:
+            return
+        with self._idle_lock:
+            self._idle.append((conn, staged))
+
+    def _discard_idle(self):
+        with self._idle_lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+
+    def _stage(self, conn, staged: set, table: str, columns: tuple):
+        """Namnet på staging-tabellen för kolumnerna (skapas första gången)."""
+        name = f"_stage_{table}_{zlib.crc32(','.join(columns).encode()):08x}"
+        if name not in staged:
+            conn.execute(sql.SQL(
+                "CREATE TEMP TABLE IF NOT EXISTS {} ON COMMIT DELETE ROWS AS "
+                "SELECT {} FROM {} WITH NO DATA"
+            ).format(sql.Identifier(name),
+                     sql.SQL(", ").join(map(sql.Identifier, columns)),
+                     sql.Identifier(table)))
+            staged.add(name)
+        return name
+
+    def upsert(self, table: str, rows: list, on_conflict: str) -> int:
+        if not rows:
+            return 0
+        with self._slots:
+            try:
+                return self._with_conn(table, rows, on_conflict)
+            except psycopg.OperationalError:
+                # Anslutningarna från en tidigare (varm) körning kan ha stängts
+                # av servern – släpp de lediga och försök en gång med en ny
+                self._discard_idle()
+                return self._with_conn(table, rows, on_conflict)
+
+    def _with_conn(self, table: str, rows: list, on_conflict: str) -> int:
+        conn, staged = self._checkout()
+        try:
+            return self._upsert(conn, staged, table, rows, on_conflict)
+        except psycopg.OperationalError:
+            conn.close()   # trasig – lämnas inte tillbaka
+            raise
+        finally:
+            self._checkin(conn, staged)
+
+    def _upsert(self, conn, staged: set, table: str, rows: list, on_conflict: str) -> int:
+        columns = tuple(rows[0])
+        keys = [c.strip() for c in on_conflict.split(",")]
+        cols = sql.SQL(", ").join(map(sql.Identifier, columns))
+        updates = [c for c in columns if c not in keys]
+        action = (sql.SQL("DO UPDATE SET {}").format(sql.SQL(", ").join(
+                      sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(c)) for c in updates))
+                  if updates else sql.SQL("DO NOTHING"))
+
+        stage = self._stage(conn, staged, table, columns)
+        with conn.transaction():
+            with conn.cursor() as cur:
+                with cur.copy(sql.SQL("COPY {} ({}) FROM STDIN").format(
+                        sql.Identifier(stage), cols)) as copy:
+                    for r in rows:
+                        copy.write_row([r[c] for c in columns])
+                cur.execute(sql.SQL(
+                    "INSERT INTO {} ({}) SELECT {} FROM {} ON CONFLICT ({}) {}"
+                ).format(sql.Identifier(table), cols, cols, sql.Identifier(stage),
+                         sql.SQL(", ").join(map(sql.Identifier, keys)), action))
+        return len(rows)
+
+    def close(self):
+        self._discard_idle()
+
+
+def get_writer(db, dsn: str = None, backend: str = None):
+    """Writer enligt WRITE_BACKEND: COPY om en DSN finns och psycopg är
+    installerat, annars PostgREST via db. CopyWriter återanvänds i processen.
+    Mot den lokala databasen (TEMPIRO_DB) skrivs alltid via db."""
+    if isinstance(db, LocalClient):
+        return PostgrestWriter(db)
+    backend = backend or WRITE_BACKEND
+    dsn = dsn or DATABASE_URL
+    if backend == "copy" or (backend == "auto" and dsn and psycopg is not None):
+        if not dsn:
+            raise RuntimeError("WRITE_BACKEND=copy kräver DATABASE_URL")
+        with _lock:
+            writer = _writers.get(dsn)
+            if writer is None:
+                writer = _writers[dsn] = CopyWriter(dsn)
+        return writer
+    return PostgrestWriter(db)
@@ -0,0 +1,49 @@
+"""GET /api/archive - Flyttar gamla månader av energy_readings till Parquet-arkivet.
+Körs dagligen via Vercel Cron Job (se _archive för lagring och inställningar).
+Arkiverade månader tas bort ur energy_readings bara med ARCHIVE_PRUNE=1.
+Utan pyarrow eller ARCHIVE_DIR/ARCHIVE_BUCKET svarar den 200 med "disabled".
+"""
+from http.server import BaseHTTPRequestHandler
+from datetime import datetime
+import json
+import sys
+import os
+sys.path.insert(0, os.path.dirname(__file__))
+from _db import get_db
+from _archive import run_archive, ARCHIVE_PRUNE
+from _instrument import Timing
+
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        timing = Timing("/api/archive")
+        try:
+            with timing.phase("archive"):
+                result = run_archive(get_db(), prune=ARCHIVE_PRUNE)
+            ok = not result["errors"]
+            if "disabled" in result:
+                timing.note(disabled=result["disabled"])
+
+            self.send_response(200 if ok else 500)
+            self.send_header("Content-Type", "application/json")
+            for header, header_value in timing.headers().items():
+                self.send_header(header, header_value)
+            self.end_headers()
+            self.wfile.write(json.dumps({
+                "ok": ok,
+                "timestamp": datetime.utcnow().isoformat(),
+                **result,
+            }).encode())
+            timing.finish(200 if ok else 500)
+
+        except Exception as e:
+            self.send_response(500)
+            self.send_header("Content-Type", "application/json")
+            for header, header_value in timing.headers().items():
+                self.send_header(header, header_value)
+            self.end_headers()
+            self.wfile.write(json.dumps({"ok": False, "error": str(e)}).encode())
+            timing.finish(500, error=str(e))
+
+    def log_message(self, format, *args):
+        pass
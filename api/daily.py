@@ -1,140 +1,57 @@
-"""GET /api/daily?days=30 - Daglig energi och kostnad per enhet från Supabase."""
+"""GET /api/daily?days=30 - Daglig energi och kostnad per enhet från Supabase.
+
+Avslutade dagar läses från rollup-tabellen daily_summaries (skrivs av sync).
+Idag, en ofullständig första dag i rullande fönster och dagar som saknas i
+rollupen räknas live från rådata; saknade avslutade dagar sparas tillbaka.
+"""
 from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
-from datetime import datetime, timedelta, timezone
-import calendar
+from datetime import timedelta
 import json
 import sys
 import os
 sys.path.insert(0, os.path.dirname(__file__))
-from _db import get_public_db
-
-PAGE_SIZE = 1000
-
-
-def _last_sunday(year, month):
-    last_day = calendar.monthrange(year, month)[1]
-    days_back = (datetime(year, month, last_day).weekday() + 1) % 7
-    return last_day - days_back
-
-
-def _se_offset(dt_utc):
-    y = dt_utc.year
-    start = datetime(y, 3, _last_sunday(y, 3), 1, 0, tzinfo=timezone.utc)
-    end   = datetime(y, 10, _last_sunday(y, 10), 1, 0, tzinfo=timezone.utc)
-    return 2 if start <= dt_utc < end else 1
-
-
-def _price_hour_key(ts_str):
-    """Convert UTC price timestamp to Swedish local time hour key (matches energy fake-UTC)."""
-    dt = datetime.fromisoformat(ts_str[:19]).replace(tzinfo=timezone.utc)
-    loc = dt + timedelta(hours=_se_offset(dt))
-    return loc.strftime("%Y-%m-%dT%H")
+from _db import get_db, get_public_db
+from _instrument import Timing
+from _timebuckets import local_now
+from _rollup import local_today, load_days
 
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
+        timing = Timing("/api/daily")
         try:
             params = parse_qs(urlparse(self.path).query)
+            today = local_today()
 
             # Stöd både ?days=N (rullande) och ?from_date=YYYY-MM-DD&to_date=YYYY-MM-DD (kalender)
             from_date = params.get("from_date", [None])[0]
             to_date   = params.get("to_date",   [None])[0]
 
             if from_date and to_date:
-                # Energidata lagras i fake-UTC (lokal tid som UTC) → filtrera direkt
-                from_ts  = from_date + "T00:00:00"
-                to_ts    = to_date   + "T23:59:59"
-                # Spotpriser i riktig UTC → utöka med 2h åt varje håll för CET/CEST
-                price_from_ts = (datetime.fromisoformat(from_ts) - timedelta(hours=2)).isoformat()
-                price_to_ts   = (datetime.fromisoformat(to_ts)   + timedelta(hours=2)).isoformat()
+                first_day, last_day = from_date, to_date
+                partial_from = None
             else:
                 days = int(params.get("days", ["30"])[0])
                 if days < 1 or days > 365:
                     days = 30
-                now_utc       = datetime.now(timezone.utc)
-                from_ts       = (now_utc + timedelta(hours=_se_offset(now_utc)) - timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%S")
-                to_ts         = None
-                price_from_ts = from_ts
-                price_to_ts   = None
+                # Energidata lagras i fake-UTC (lokal tid som UTC)
+                partial_from = (local_now() - timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%S")
+                first_day, last_day = partial_from[:10], today
 
-            db = get_public_db()
+            with timing.phase("rollup"):
+                daily = load_days(get_public_db(), first_day, last_day,
+                                  write_db=get_db(), partial_from=partial_from)
 
-            # Hämta energidata med paginering
-            # Använd current_value (Watt) × 0.25h / 1000 = kWh, precis som lokala appen
-            energy_rows = []
-            offset = 0
-            while True:
-                q = (db.table("energy_readings")
-                     .select("device_name, timestamp, current_value, delta_power")
-                     .gte("timestamp", from_ts))
-                if to_ts:
-                    q = q.lte("timestamp", to_ts)
-                result = q.order("timestamp", desc=False).range(offset, offset + PAGE_SIZE - 1).execute()
-                energy_rows.extend(result.data)
-                if len(result.data) < PAGE_SIZE:
-                    break
-                offset += PAGE_SIZE
-
-            # Hämta spotpriser med paginering (15-min intervall = 96/dag, överskrider 1000-gränsen vid 30+ dagar)
-            price_rows = []
-            offset = 0
-            while True:
-                q = (db.table("spot_prices")
-                     .select("timestamp, price_sek")
-                     .gte("timestamp", price_from_ts))
-                if price_to_ts:
-                    q = q.lte("timestamp", price_to_ts)
-                result = q.order("timestamp", desc=False).range(offset, offset + PAGE_SIZE - 1).execute()
-                price_rows.extend(result.data)
-                if len(result.data) < PAGE_SIZE:
-                    break
-                offset += PAGE_SIZE
-
-            # Bygg timme->pris lookup (medelvärde per timme, pris är i öre/kWh)
-            price_sum_by_hour = {}
-            price_count_by_hour = {}
-            for p in price_rows:
-                hour_key = _price_hour_key(p["timestamp"])  # UTC → Swedish local time
-                ore = p["price_sek"]  # redan i öre/kWh i databasen
-                price_sum_by_hour[hour_key] = price_sum_by_hour.get(hour_key, 0) + ore
-                price_count_by_hour[hour_key] = price_count_by_hour.get(hour_key, 0) + 1
-            price_by_hour = {
-                h: price_sum_by_hour[h] / price_count_by_hour[h]
-                for h in price_sum_by_hour
-            }
-
-            # Aggregera per dag och enhet
-            # current_value = Watt, × 0.25h / 1000 = kWh per 15-min mätning
-            daily = {}  # {dag: {enhet: {kwh, cost, readings}}}
-            for r in energy_rows:
-                ts = r["timestamp"]
-                day = ts[:10]
-                hour_key = ts[:13]
-                device = r["device_name"]
-                watts = r["current_value"] or 0
-                delta_power = r.get("delta_power") or 0
-                kwh = watts * 0.25 / 1000  # Watt → kWh per 15 min
-
-                # Pris i öre/kWh -> kostnad i kronor
-                price_ore = price_by_hour.get(hour_key, 0)
-                cost = kwh * price_ore / 100
-
-                if day not in daily:
-                    daily[day] = {}
-                if device not in daily[day]:
-                    daily[day][device] = {"kwh": 0, "cost": 0, "readings": 0, "active_intervals": 0}
-
-                daily[day][device]["kwh"] += kwh
-                daily[day][device]["cost"] += cost
-                daily[day][device]["readings"] += 1
-                if watts > 0 or delta_power > 0:
-                    daily[day][device]["active_intervals"] += 1
-
-            # Formatera svar
+            # Formatera svar (enheter nycklas på namn, som tidigare)
             result_list = []
             for day in sorted(daily.keys()):
-                devices = daily[day]
+                devices = {}
+                for v in daily[day].values():
+                    d = devices.setdefault(v["device_name"], {"kwh": 0, "cost": 0, "active_intervals": 0})
+                    d["kwh"] += v["kwh"]
+                    d["cost"] += v["cost"]
+                    d["active_intervals"] += v["active_intervals"]
                 total_kwh = sum(d["kwh"] for d in devices.values())
                 total_cost = sum(d["cost"] for d in devices.values())
                 row = {
@@ -152,17 +69,26 @@ class handler(BaseHTTPRequestHandler):
                 }
                 result_list.append(row)
 
+            with timing.phase("encode"):
+                body = json.dumps(result_list).encode()
+
             self.send_response(200)
             self.send_header("Content-Type", "application/json")
             self.send_header("Access-Control-Allow-Origin", "*")
+            for header, header_value in timing.headers().items():
+                self.send_header(header, header_value)
             self.end_headers()
-            self.wfile.write(json.dumps(result_list).encode())
+            self.wfile.write(body)
+            timing.finish(200, days=len(result_list), bytes=len(body))
 
         except Exception as e:
             self.send_response(500)
             self.send_header("Content-Type", "application/json")
+            for header, header_value in timing.headers().items():
+                self.send_header(header, header_value)
             self.end_headers()
             self.wfile.write(json.dumps({"error": str(e)}).encode())
+            timing.finish(500, error=str(e))
 
     def log_message(self, format, *args):
         pass
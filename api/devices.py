@@ -1,16 +1,26 @@
-"""GET /api/devices - Hämtar aktuell status för alla enheter från Tempiro API."""
+"""GET /api/devices - Hämtar aktuell status för alla enheter från Tempiro API.
+
+Svaret cachas kort i instansen och i CDN:en (se _device_cache).
+?fresh=1 hoppar över båda, t.ex. direkt efter en switch."""
 from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
 import json
 import sys
 import os
 sys.path.insert(0, os.path.dirname(__file__))
-from _tempiro import get_devices
+from _device_cache import get_devices_cached, cache_control
+from _instrument import Timing
 
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
+        timing = Timing("/api/devices")
         try:
-            devices = get_devices()
+            params = parse_qs(urlparse(self.path).query)
+            fresh = params.get("fresh", ["0"])[0] not in ("0", "")
+            with timing.phase("tempiro"):
+                devices, cache_status = get_devices_cached(fresh=fresh)
+            timing.note(cache=cache_status)
 
             # Normalisera till samma format som lokala Flask-appen
             result = []
@@ -31,14 +41,22 @@ class handler(BaseHTTPRequestHandler):
             self.send_response(200)
             self.send_header("Content-Type", "application/json")
             self.send_header("Access-Control-Allow-Origin", "*")
+            self.send_header("Cache-Control", "no-store" if fresh else cache_control())
+            self.send_header("X-Cache", cache_status)
+            for header, header_value in timing.headers().items():
+                self.send_header(header, header_value)
             self.end_headers()
             self.wfile.write(json.dumps(result).encode())
+            timing.finish(200, devices=len(result))
 
         except Exception as e:
             self.send_response(500)
             self.send_header("Content-Type", "application/json")
+            for header, header_value in timing.headers().items():
+                self.send_header(header, header_value)
             self.end_headers()
             self.wfile.write(json.dumps({"error": str(e)}).encode())
+            timing.finish(500, error=str(e))
 
     def log_message(self, format, *args):
         pass
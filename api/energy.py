@@ -1,66 +1,117 @@
-"""GET /api/energy?days=7&device_id=xxx - Hämtar energidata från Supabase med paginering."""
+"""GET /api/energy?days=7&device_id=xxx - Hämtar energidata från Supabase med paginering.
+
+Valfri nedsampling per enhet:
+  &resolution=1h    – tidsbuckets (15m, 1h, 1d ...) med medel-/maxeffekt och summerad kWh
+  &max_points=500   – formbevarande LTTB-urval av råpunkter (efter ev. buckets)
+  &format=columnar  – en array per fält och enhet, heltalstidsstämplar (se _encoding)
+"""
 from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
-from datetime import datetime, timedelta, timezone
-from zoneinfo import ZoneInfo
+from datetime import timedelta
 import json
 import sys
 import os
 sys.path.insert(0, os.path.dirname(__file__))
 from _db import get_public_db
-
-PAGE_SIZE = 1000
-_STOCKHOLM = ZoneInfo("Europe/Stockholm")
+from _instrument import Timing
+from _pagination import fetch_all
+from _devices import load_devices, device_key, describe
+from _encoding import to_columnar, encode_json
+from _downsample import parse_resolution, bucket, downsample
+from _timebuckets import local_now
 
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
+        timing = Timing("/api/energy")
         try:
             params = parse_qs(urlparse(self.path).query)
             days = int(params.get("days", ["7"])[0])
             device_id = params.get("device_id", [None])[0]
+            resolution = params.get("resolution", [None])[0]
+            max_points = params.get("max_points", [None])[0]
+            columnar = params.get("format", [None])[0] == "columnar"
 
             if days < 1 or days > 365:
                 days = 7
 
+            try:
+                bucket_seconds = parse_resolution(resolution) if resolution else None
+                max_points = max(3, int(max_points)) if max_points else None
+            except ValueError as e:
+                self.send_response(400)
+                self.send_header("Content-Type", "application/json")
+                for header, header_value in timing.headers().items():
+                    self.send_header(header, header_value)
+                self.end_headers()
+                self.wfile.write(json.dumps({"error": str(e)}).encode())
+                timing.finish(400)
+                return
+
             # Energidata lagras som "fake-UTC" (lokal Stockholmstid utan tidszon).
             # Använd lokal tid för from_ts så att fönstret stämmer med lagrad data.
-            now_local = datetime.now(_STOCKHOLM).replace(tzinfo=None)
+            now_local = local_now()
             from_ts = (now_local - timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%S")
             db = get_public_db()
 
-            # Hämta alla sidor
-            all_data = []
-            offset = 0
-            while True:
+            with timing.phase("devices"):
+                key = device_key(db, device_id) if device_id else None
+
+            # Hämta alla sidor (keyset-paginering på timestamp, device_key)
+            def build():
                 query = (
                     db.table("energy_readings")
-                    .select("device_id, device_name, timestamp, delta_power, current_value")
+                    .select("device_key, timestamp, delta_power, current_value")
                     .gte("timestamp", from_ts)
-                    .order("timestamp", desc=False)
-                    .range(offset, offset + PAGE_SIZE - 1)
                 )
                 if device_id:
-                    query = query.eq("device_id", device_id)
+                    query = query.eq("device_key", key)
+                return query
 
-                result = query.execute()
-                all_data.extend(result.data)
+            if device_id and key is None:
+                all_data = []   # okänd enhet
+            else:
+                # Id och namn slås upp en gång per svar
+                with timing.phase("devices"):
+                    devices = load_devices(db)
+                with timing.phase("fetch"):
+                    all_data = []
+                    for r in fetch_all(build):
+                        d = describe(devices, r["device_key"])
+                        all_data.append({"device_id": d["device_id"], "device_name": d["device_name"],
+                                         "timestamp": r["timestamp"], "delta_power": r["delta_power"],
+                                         "current_value": r["current_value"]})
+            with timing.phase("downsample"):
+                if bucket_seconds:
+                    all_data = bucket(all_data, bucket_seconds)
+                if max_points:
+                    all_data = downsample(all_data, max_points)
 
-                if len(result.data) < PAGE_SIZE:
-                    break
-                offset += PAGE_SIZE
+            with timing.phase("encode"):
+                payload = to_columnar(all_data, ("device_id", "device_name")) if columnar else all_data
+                body, encoding = encode_json(payload, self.headers.get("Accept-Encoding", ""))
 
             self.send_response(200)
             self.send_header("Content-Type", "application/json")
             self.send_header("Access-Control-Allow-Origin", "*")
+            for header, header_value in timing.headers().items():
+                self.send_header(header, header_value)
+            self.send_header("Vary", "Accept-Encoding")
+            self.send_header("Content-Length", str(len(body)))
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
             self.end_headers()
-            self.wfile.write(json.dumps(all_data).encode())
+            self.wfile.write(body)
+            timing.finish(200, rows=len(all_data), bytes=len(body))
 
         except Exception as e:
             self.send_response(500)
             self.send_header("Content-Type", "application/json")
+            for header, header_value in timing.headers().items():
+                self.send_header(header, header_value)
             self.end_headers()
             self.wfile.write(json.dumps({"error": str(e)}).encode())
+            timing.finish(500, error=str(e))
 
     def log_message(self, format, *args):
         pass
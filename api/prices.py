@@ -1,4 +1,6 @@
-"""GET /api/prices?days=1 - Hämtar spotpriser från Supabase."""
+"""GET /api/prices?days=1 - Hämtar spotpriser från Supabase.
+
+&format=columnar ger en array per fält och prisområde (se _encoding)."""
 from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 from datetime import datetime, timedelta, timezone
@@ -7,13 +9,18 @@ import sys
 import os
 sys.path.insert(0, os.path.dirname(__file__))
 from _db import get_public_db
+from _instrument import Timing
+from _pagination import fetch_all
+from _encoding import to_columnar, encode_json
 
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
+        timing = Timing("/api/prices")
         try:
             params = parse_qs(urlparse(self.path).query)
             days = int(params.get("days", ["1"])[0])
+            columnar = params.get("format", [None])[0] == "columnar"
 
             if days < 1 or days > 90:
                 days = 1
@@ -21,25 +28,39 @@ class handler(BaseHTTPRequestHandler):
             from_ts = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
             db = get_public_db()
 
-            result = (
-                db.table("spot_prices")
-                .select("timestamp, price_sek, price_area")
-                .gte("timestamp", from_ts)
-                .order("timestamp", desc=False)
-                .execute()
-            )
+            # Paginera – 15-min priser överskrider 1000-radersgränsen redan vid ~10 dagar
+            with timing.phase("fetch"):
+                rows = fetch_all(lambda: (
+                    db.table("spot_prices")
+                    .select("timestamp, price_sek, price_area")
+                    .gte("timestamp", from_ts)
+                ), tiebreak="price_area")
+
+            with timing.phase("encode"):
+                payload = to_columnar(rows, ("price_area",)) if columnar else rows
+                body, encoding = encode_json(payload, self.headers.get("Accept-Encoding", ""))
 
             self.send_response(200)
             self.send_header("Content-Type", "application/json")
             self.send_header("Access-Control-Allow-Origin", "*")
+            for header, header_value in timing.headers().items():
+                self.send_header(header, header_value)
+            self.send_header("Vary", "Accept-Encoding")
+            self.send_header("Content-Length", str(len(body)))
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
             self.end_headers()
-            self.wfile.write(json.dumps(result.data).encode())
+            self.wfile.write(body)
+            timing.finish(200, rows=len(rows), bytes=len(body))
 
         except Exception as e:
             self.send_response(500)
             self.send_header("Content-Type", "application/json")
+            for header, header_value in timing.headers().items():
+                self.send_header(header, header_value)
             self.end_headers()
             self.wfile.write(json.dumps({"error": str(e)}).encode())
+            timing.finish(500, error=str(e))
 
     def log_message(self, format, *args):
         pass
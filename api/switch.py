@@ -5,6 +5,8 @@ import sys
 import os
 sys.path.insert(0, os.path.dirname(__file__))
 from _tempiro import switch_device
+from _device_cache import apply_switch
+from _instrument import Timing
 
 
 class handler(BaseHTTPRequestHandler):
@@ -16,6 +18,7 @@ class handler(BaseHTTPRequestHandler):
         self.end_headers()
 
     def do_PUT(self):
+        timing = Timing("/api/switch")
         try:
             length = int(self.headers.get("Content-Length", 0))
             body = self.rfile.read(length)
@@ -27,23 +30,34 @@ class handler(BaseHTTPRequestHandler):
             if not device_id or value not in (0, 1):
                 self.send_response(400)
                 self.send_header("Content-Type", "application/json")
+                for header, header_value in timing.headers().items():
+                    self.send_header(header, header_value)
                 self.end_headers()
                 self.wfile.write(json.dumps({"error": "device_id och value (0 eller 1) krävs"}).encode())
+                timing.finish(400)
                 return
 
-            result = switch_device(device_id, value)
+            with timing.phase("tempiro"):
+                result = switch_device(device_id, value)
+            apply_switch(device_id, value)
 
             self.send_response(200)
             self.send_header("Content-Type", "application/json")
             self.send_header("Access-Control-Allow-Origin", "*")
+            for header, header_value in timing.headers().items():
+                self.send_header(header, header_value)
             self.end_headers()
             self.wfile.write(json.dumps(result).encode())
+            timing.finish(200, device_id=device_id, value=value)
 
         except Exception as e:
             self.send_response(500)
             self.send_header("Content-Type", "application/json")
+            for header, header_value in timing.headers().items():
+                self.send_header(header, header_value)
             self.end_headers()
             self.wfile.write(json.dumps({"error": str(e)}).encode())
+            timing.finish(500, error=str(e))
 
     def log_message(self, format, *args):
         pass
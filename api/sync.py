@@ -1,98 +1,193 @@
 """GET /api/sync - Synkar data från Tempiro API och spotpriser till Supabase.
 Körs automatiskt varje timme via Vercel Cron Job (kräver Pro-plan)."""
 from http.server import BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timedelta, timezone
 import json
 import requests
 import sys
+import time
 import os
-import zoneinfo
 sys.path.insert(0, os.path.dirname(__file__))
 from _db import get_db
 from _tempiro import get_devices, get_device_values
-
-TZ_STOCKHOLM = zoneinfo.ZoneInfo("Europe/Stockholm")
+from _rollup import refresh_daily_summaries, refresh_stale_months
+from _devices import sync_devices
+from _writer import get_writer
+from _instrument import Timing
+from _timebuckets import local_now, to_local
 
 
 PRICE_AREA = "SE3"
-
-
-def sync_energy(db) -> dict:
-    """Synka energidata för alla enheter."""
+SYNC_WORKERS = int(os.environ.get("SYNC_WORKERS", "8"))          # parallella enhetshämtningar
+SYNC_DEADLINE = float(os.environ.get("SYNC_DEADLINE", "45"))     # sekunder innan enheter ges upp
+
+
+def _sync_device(db, device_id: str, device_key: int, last_sync, deadline: float) -> tuple:
+    """Hämta och spara mätvärden för en enhet.
+    Returnerar (antal sparade rader, ny watermark eller None, berörda dagar).
+    Efter deadline (time.monotonic()) har synken redan gett upp enheten och
+    inget skrivs."""
+    # Använd lokal Stockholm-tid för Tempiro-API:t (tolkar timestamps som lokal tid)
+    now_local = local_now()
+    fetched_at = datetime.utcnow().isoformat()
+
+    if last_sync:
+        # Hämta från senaste synk (minus 1h för överlapp), konvertera till lokal tid
+        last_utc = datetime.fromisoformat(last_sync.replace("Z", "+00:00"))
+        from_dt = to_local(last_utc - timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%S")
+    else:
+        # Första synk - hämta 7 dagar bakåt
+        from_dt = (now_local - timedelta(days=7)).strftime("%Y-%m-%dT%H:%M:%S")
+
+    to_dt = now_local.strftime("%Y-%m-%dT%H:%M:%S")
+
+    values = get_device_values(device_id, from_dt, to_dt)
+    if time.monotonic() > deadline:
+        raise TimeoutError(f"svar efter {SYNC_DEADLINE:.0f}s")
+
+    if not values:
+        return 0, None, set()
+
+    # Förbered rader för upsert
+    rows = []
+    for v in values:
+        ts = v.get("DateTime") or v.get("timestamp")
+        if not ts:
+            continue
+        rows.append({
+            "device_key": device_key,
+            "timestamp": ts,
+            "delta_power": v.get("DeltaPower", 0),
+            "accumulated_value": v.get("AccumulatedValue", 0),
+            "current_value": v.get("CurrentValue", 0),
+        })
+
+    if rows:
+        get_writer(db).upsert("energy_readings", rows, on_conflict="device_key,timestamp")
+
+    # Watermark = tidpunkten innan hämtningen, så inget mellan hämtning och skrivning tappas
+    return len(rows), fetched_at, {r["timestamp"][:10] for r in rows}
+
+
+def sync_energy(db, workers: int = None) -> dict:
+    """Synka energidata för alla enheter.
+
+    Enheterna hämtas parallellt i en trådpool med SYNC_WORKERS trådar.
+    sync_status läses i en query före körningen och skrivs tillbaka i en
+    batchad upsert efteråt. Enheter som inte hunnit klart inom
+    SYNC_DEADLINE sekunder rapporteras som fel och behåller sin gamla
+    watermark, så de hämtas om vid nästa körning.
+
+    touched_days i resultatet är de dagar (YYYY-MM-DD) som fått nya rader och
+    renamed de enheter (device_id) som bytt namn i Tempiro."""
     devices = get_devices()
     total_saved = 0
     errors = []
 
+    # Enhetsdimensionen: nya enheter får en nyckel, namnbyten slår igenom på all historik
+    keys, renamed = sync_devices(db, devices)
+
+    # Alla watermarks i en query
+    status = (
+        db.table("sync_status")
+        .select("device_id, last_sync")
+        .eq("sync_type", "energy")
+        .execute()
+    )
+    last_sync = {r["device_id"]: r["last_sync"] for r in status.data}
+
+    deadline = time.monotonic() + SYNC_DEADLINE
+    pool = ThreadPoolExecutor(max_workers=max(1, workers or SYNC_WORKERS))
+    futures = {}
     for device in devices:
         device_id = device.get("Id") or device.get("id")
         device_name = device.get("Name") or device.get("name") or device_id
-
+        fut = pool.submit(_sync_device, db, device_id, keys[device_id], last_sync.get(device_id),
+                          deadline)
+        futures[fut] = (device_id, device_name)
+
+    done, not_done = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+    # Vänta inte på hängande enheter – de får försöka igen nästa körning
+    pool.shutdown(wait=False, cancel_futures=True)
+
+    watermarks = []
+    touched_days = set()
+    for fut in done:
+        device_id, device_name = futures[fut]
         try:
-            # Kolla senaste synk för denna enhet
-            status = (
-                db.table("sync_status")
-                .select("last_sync")
-                .eq("sync_type", "energy")
-                .eq("device_id", device_id)
-                .execute()
-            )
-
-            # Använd lokal Stockholm-tid för Tempiro-API:t (tolkar timestamps som lokal tid)
-            now_local = datetime.now(TZ_STOCKHOLM)
-
-            if status.data:
-                # Hämta från senaste synk (minus 1h för överlapp), konvertera till lokal tid
-                last_utc = datetime.fromisoformat(status.data[0]["last_sync"].replace("Z", "+00:00"))
-                from_dt = (last_utc - timedelta(hours=1)).astimezone(TZ_STOCKHOLM).strftime("%Y-%m-%dT%H:%M:%S")
-            else:
-                # Första synk - hämta 7 dagar bakåt
-                from_dt = (now_local - timedelta(days=7)).strftime("%Y-%m-%dT%H:%M:%S")
-
-            to_dt = now_local.strftime("%Y-%m-%dT%H:%M:%S")
-
-            values = get_device_values(device_id, from_dt, to_dt)
-
-            if not values:
-                continue
-
-            # Förbered rader för upsert
-            rows = []
-            for v in values:
-                ts = v.get("DateTime") or v.get("timestamp")
-                if not ts:
-                    continue
-                rows.append({
-                    "device_id": device_id,
-                    "device_name": device_name,
-                    "timestamp": ts,
-                    "delta_power": v.get("DeltaPower", 0),
-                    "accumulated_value": v.get("AccumulatedValue", 0),
-                    "current_value": v.get("CurrentValue", 0),
-                })
-
-            if rows:
-                db.table("energy_readings").upsert(
-                    rows, on_conflict="device_id,timestamp"
-                ).execute()
-                total_saved += len(rows)
-
-            # Uppdatera sync_status
-            db.table("sync_status").upsert({
+            saved, watermark, days = fut.result()
+        except Exception as e:
+            errors.append(f"{device_name}: {e}")
+            continue
+        total_saved += saved
+        touched_days |= days
+        if watermark:
+            watermarks.append({
                 "sync_type": "energy",
                 "device_id": device_id,
-                "last_sync": datetime.utcnow().isoformat(),
-            }, on_conflict="sync_type,device_id").execute()
+                "last_sync": watermark,
+            })
 
-        except Exception as e:
-            errors.append(f"{device_name}: {e}")
+    for fut in not_done:
+        _, device_name = futures[fut]
+        errors.append(f"{device_name}: timeout efter {SYNC_DEADLINE:.0f}s")
 
-    return {"saved": total_saved, "errors": errors}
+    # Uppdatera sync_status i en batch
+    if watermarks:
+        try:
+            db.table("sync_status").upsert(
+                watermarks, on_conflict="sync_type,device_id"
+            ).execute()
+        except Exception as e:
+            errors.append(f"sync_status: {e}")
+
+    return {"saved": total_saved, "errors": errors, "touched_days": touched_days,
+            "renamed": renamed}
+
+
+def ensure_partitions(db) -> dict:
+    """Skapa månadspartitioner för energy_readings (förra månaden → två
+    månader framåt) innan nya mätningar skrivs. Saknas funktionen
+    (opartitionerad databas) hoppas steget över."""
+    try:
+        created = db.rpc("ensure_energy_partitions", {}).execute().data
+        return {"created": created or 0}
+    except Exception as e:
+        return {"created": 0, "error": str(e)}
+
+
+def _changed_price_days(db, rows) -> set:
+    """Lokala dagar (YYYY-MM-DD) där rows innehåller nya eller ändrade priser
+    jämfört med det som redan finns i spot_prices."""
+    instants = [datetime.fromisoformat(r["timestamp"]) for r in rows]
+    existing = (
+        db.table("spot_prices")
+        .select("timestamp, price_sek")
+        .eq("price_area", PRICE_AREA)
+        .gte("timestamp", min(instants).isoformat())
+        .lte("timestamp", max(instants).isoformat())
+        .execute()
+    )
+    known = {
+        datetime.fromisoformat(p["timestamp"].replace("Z", "+00:00")): p["price_sek"]
+        for p in existing.data
+    }
+    days = set()
+    for r, instant in zip(rows, instants):
+        old = known.get(instant)
+        if old is None or abs(old - r["price_sek"]) > 1e-3:
+            days.add(r["timestamp"][:10])   # time_start är lokal tid med offset
+    return days
 
 
 def sync_prices(db) -> dict:
-    """Synka spotpriser från elprisetjustnu.se."""
+    """Synka spotpriser från elprisetjustnu.se.
+
+    touched_days i resultatet är lokala dagar som fått nya eller ändrade priser."""
     total_saved = 0
     errors = []
+    touched_days = set()
 
     for days_ago in range(-1, 3):
         date = datetime.utcnow() - timedelta(days=days_ago)
@@ -115,42 +210,70 @@ def sync_prices(db) -> dict:
                 })
 
             if rows:
-                db.table("spot_prices").upsert(
-                    rows, on_conflict="timestamp,price_area"
-                ).execute()
+                touched_days |= _changed_price_days(db, rows)
+                get_writer(db).upsert("spot_prices", rows, on_conflict="timestamp,price_area")
                 total_saved += len(rows)
 
         except Exception as e:
             errors.append(f"{date_str}: {e}")
 
-    return {"saved": total_saved, "errors": errors}
+    return {"saved": total_saved, "errors": errors, "touched_days": touched_days}
 
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
+        timing = Timing("/api/sync")
         try:
             db = get_db()
 
-            energy_result = sync_energy(db)
-            price_result = sync_prices(db)
+            with timing.phase("partitions"):
+                partition_result = ensure_partitions(db)
+            with timing.phase("energy"):
+                energy_result = sync_energy(db)
+            with timing.phase("prices"):
+                price_result = sync_prices(db)
+
+            # Dagar med nya mätningar eller sena priser → räkna om dagsrollupen
+            dirty_days = energy_result.pop("touched_days") | price_result.pop("touched_days")
+            with timing.phase("daily_rollup"):
+                rollup_result = refresh_daily_summaries(db, dirty_days)
+
+            # Avslutade månader som berörts → invalidera och räkna om monthly_summaries
+            cur_mon = datetime.utcnow().strftime("%Y-%m")
+            dirty_months = {d[:7] for d in dirty_days if d[:7] < cur_mon}
+            if energy_result["renamed"]:
+                # Cachade månader bär enheternas gamla namn → räkna om alla
+                cached = db.table("monthly_summaries").select("month").execute()
+                dirty_months |= {r["month"] for r in cached.data}
+            with timing.phase("monthly_rollup"):
+                monthly_result = refresh_stale_months(db, dirty_months)
 
             result = {
                 "ok": True,
                 "timestamp": datetime.utcnow().isoformat(),
+                "partitions": partition_result,
                 "energy": energy_result,
                 "prices": price_result,
+                "daily_summaries": rollup_result,
+                "monthly_summaries": monthly_result,
             }
 
             self.send_response(200)
             self.send_header("Content-Type", "application/json")
+            for header, header_value in timing.headers().items():
+                self.send_header(header, header_value)
             self.end_headers()
             self.wfile.write(json.dumps(result).encode())
+            timing.finish(200, saved=energy_result.get("saved"), errors=energy_result.get("errors"))
 
         except Exception as e:
             self.send_response(500)
             self.send_header("Content-Type", "application/json")
+            for header, header_value in timing.headers().items():
+                self.send_header(header, header_value)
             self.end_headers()
             self.wfile.write(json.dumps({"ok": False, "error": str(e)}).encode())
+            timing.finish(500, error=str(e))
 
     def log_message(self, format, *args):
         pass
@@ -0,0 +1,414 @@
+"""
+Benchmark för alla API-handlers över ett syntetiskt flerårsdataset.
+
+    python bench/bench_api.py --devices 10 --years 2 --output bench_api.json
+    python bench/bench_api.py --devices 10 --years 2 --compare bench_api.json --max-regression 20
+
+Datasetet (N enheter × M år energy_readings fram till nu plus 15-minuters
+spot_prices) genereras i en lokal SQLite-databas (TEMPIRO_DB, se
+api/_local.py) och återanvänds mellan körningar så länge det är från idag.
+Mätvärdena kommer från samma syntetiska serier som bench/mock_tempiro.py,
+som också startas i processen och svarar på Tempiro-anropen från
+/api/devices, /api/switch och /api/sync.
+
+Varje fall anropar handler-klassen direkt (utan HTTP-server): först
+--warmup varv, sedan --iterations tidtagna varv och till sist ett varv under
+tracemalloc för minnestoppen. Varje fall börjar från det genererade
+datasetet (återställs med SQLites backup-API), och fall som skriver (sync,
+archive) återställs dessutom före varje varv. "cold"-fall tömmer
+rollup-/cachetabellerna före varje varv. Återställning och tömning ingår
+inte i tiden. Per fall sparas latens (p50/p90/p99/medel/min/max i ms),
+DB-anrop, hämtade sidor och rader, Tempiro-anrop, minnestopp och svarsbytes,
+samt medeltid per fas ur handlerns Server-Timing-huvud (se api/_instrument.py).
+Resultatet skrivs som JSON; --compare jämför mot en tidigare körning.
+"""
+import argparse
+import email.message
+import io
+import json
+import math
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zoneinfo
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(BENCH_DIR, "..", "api")
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, API_DIR)   # api-modulerna importeras först när miljön är satt (se main)
+import mock_tempiro
+
+PRICE_AREA = "SE3"
+TZ_STOCKHOLM = zoneinfo.ZoneInfo("Europe/Stockholm")
+HEADERS = {"Accept-Encoding": "br, gzip"}   # som en webbläsare
+
+
+# ── Dataset ─────────────────────────────────────────────────────────────────
+
+def _price(slot: int) -> float:
+    """Spotpris (öre/kWh) med dygns- och säsongsvariation."""
+    hour = (slot // 4) % 24
+    day = slot // 96
+    base = 60 + 40 * math.sin(2 * math.pi * day / 365)
+    peak = 35 * math.exp(-((hour - 8) ** 2) / 6) + 45 * math.exp(-((hour - 18) ** 2) / 6)
+    return round(max(1.0, base + peak + 25 * (mock_tempiro._unit("price", slot) - 0.5)), 3)
+
+
+def generate(path: str, synthetic, years: float) -> dict:
+    """Skriv devices, energy_readings och spot_prices till en ny SQLite-fil."""
+    from _local import LocalClient
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    LocalClient(path).close()   # skapar schemat
+
+    # Energi lagras i fake-UTC (lokal tid som UTC), priser i riktig UTC
+    now_local = datetime.now(TZ_STOCKHOLM).replace(tzinfo=None)
+    from_local = (now_local - timedelta(days=round(365 * years))).strftime("%Y-%m-%dT00:00:00")
+    to_local = now_local.strftime("%Y-%m-%dT%H:%M:%S")
+
+    conn = sqlite3.connect(path)
+    started = time.perf_counter()
+    with conn:
+        conn.executemany(
+            "INSERT INTO devices (device_key, device_id, device_name) VALUES (?, ?, ?)",
+            [(i + 1, d["Id"], d["Name"]) for i, d in enumerate(synthetic.devices.values())])
+        readings = 0
+        for key, device_id in enumerate(synthetic.devices, start=1):
+            values = synthetic.values(device_id, from_local, to_local)
+            conn.executemany(
+                "INSERT INTO energy_readings VALUES (?, ?, ?, ?, ?)",
+                [(key, v["DateTime"] + "+00:00", v["DeltaPower"], v["AccumulatedValue"],
+                  v["CurrentValue"]) for v in values])
+            readings += len(values)
+
+        start = datetime.fromisoformat(from_local).replace(tzinfo=timezone.utc) - timedelta(hours=2)
+        end = datetime.now(timezone.utc) + timedelta(days=1)   # dagen efter är publicerad
+        first = int((start - datetime(2020, 1, 1, tzinfo=timezone.utc)) / mock_tempiro.SLOT)
+        slots = int((end - start) / mock_tempiro.SLOT)
+        conn.executemany(
+            "INSERT INTO spot_prices (timestamp, price_area, price_sek, price_eur) VALUES (?, ?, ?, ?)",
+            [((start + i * mock_tempiro.SLOT).isoformat(), PRICE_AREA, _price(first + i), None)
+             for i in range(slots)])
+    conn.close()
+    return {"energy_readings": readings, "spot_prices": slots,
+            "generate_s": round(time.perf_counter() - started, 1)}
+
+
+def dataset(path: str, synthetic, years: float, regenerate: bool) -> dict:
+    """Återanvänd datasetet om det är genererat idag, annars skapa det."""
+    if not regenerate and os.path.exists(path):
+        conn = sqlite3.connect(path)
+        try:
+            newest = conn.execute("SELECT MAX(timestamp) FROM energy_readings").fetchone()[0]
+            readings = conn.execute("SELECT COUNT(*) FROM energy_readings").fetchone()[0]
+            prices = conn.execute("SELECT COUNT(*) FROM spot_prices").fetchone()[0]
+        except sqlite3.Error:
+            newest = None
+        finally:
+            conn.close()
+        today = datetime.now(TZ_STOCKHOLM).strftime("%Y-%m-%d")
+        if newest and newest[:10] == today:
+            return {"energy_readings": readings, "spot_prices": prices, "reused": True}
+    print(f"Genererar {path} ...", file=sys.stderr)
+    return generate(path, synthetic, years)
+
+
+# ── Anrop ───────────────────────────────────────────────────────────────────
+
+def invoke(cls, method: str, path: str, body=None, headers: dict = None) -> tuple:
+    """Kör handler-klassen i processen. Returnerar (status, huvuden, kropp)."""
+    data = json.dumps(body).encode() if body is not None else b""
+    msg = email.message.Message()
+    for name, value in (headers or {}).items():
+        msg[name] = value
+    msg["Content-Length"] = str(len(data))
+
+    h = cls.__new__(cls)
+    h.headers = msg
+    h.rfile = io.BytesIO(data)
+    h.wfile = io.BytesIO()
+    h.path = path
+    h.command = method
+    h.request_version = "HTTP/1.1"
+    h.requestline = f"{method} {path} HTTP/1.1"
+    h.client_address = ("127.0.0.1", 0)
+    h.close_connection = True
+    getattr(h, f"do_{method}")()
+
+    head, _, payload = h.wfile.getvalue().partition(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    response_headers = dict(line.split(": ", 1) for line in lines[1:] if ": " in line)
+    return status, response_headers, payload
+
+
+class Case:
+    """Ett benchmarkfall: handler-modul, anrop och ev. återställning före varje varv."""
+    def __init__(self, name: str, module: str, path: str, method: str = "GET",
+                 body=None, reset: tuple = (), writes: bool = False):
+        self.name = name
+        self.module = module
+        self.path = path
+        self.method = method
+        self.body = body
+        self.reset = reset   # tabeller som töms före varje varv ("cold")
+        self.writes = writes   # skriver i datasetet: återställs före varje varv
+
+
+def cases(first_device: str) -> list:
+    return [
+        Case("energy_1d", "energy", "/api/energy?days=1"),
+        Case("energy_7d_device", "energy", f"/api/energy?days=7&device_id={first_device}"),
+        Case("energy_30d_1h", "energy", "/api/energy?days=30&resolution=1h"),
+        Case("energy_30d_columnar", "energy", "/api/energy?days=30&format=columnar"),
+        Case("prices_2d", "prices", "/api/prices?days=2"),
+        Case("daily_30", "daily", "/api/daily?days=30"),
+        Case("daily_365", "daily", "/api/daily?days=365"),
+        Case("daily_365_cold", "daily", "/api/daily?days=365", reset=("daily_summaries",)),
+        Case("monthly", "monthly", "/api/monthly"),
+        Case("monthly_cold", "monthly", "/api/monthly",
+             reset=("monthly_summaries", "daily_summaries")),
+        Case("devices_fresh", "devices", "/api/devices?fresh=1"),
+        Case("switch", "switch", "/api/switch", method="PUT",
+             body={"device_id": first_device, "value": 1}),
+        Case("sync", "sync", "/api/sync", writes=True),
+        Case("archive", "archive", "/api/archive", writes=True),
+    ]
+
+
+def _server_timing(header: str) -> dict:
+    """Server-Timing → {namn: ms} för poster med dur."""
+    out = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "dur":
+                out[name] = float(value)
+    return out
+
+
+def _percentile(values: list, q: float) -> float:
+    """Närmaste rang-percentil."""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1))]
+
+
+def restore(db, source: str, archive_dir: str):
+    """Skriv tillbaka det genererade datasetet i den öppna anslutningen och töm arkivet."""
+    with db._lock, sqlite3.connect(source) as src:
+        src.backup(db._conn)
+    shutil.rmtree(archive_dir, ignore_errors=True)
+
+
+def run_case(case: Case, db, warmup: int, iterations: int, source: str, archive_dir: str) -> dict:
+    import importlib
+    from _db import db_stats
+    from _tempiro import tempiro_stats
+    module = importlib.import_module(case.module)
+
+    def prepare():
+        if case.writes:
+            restore(db, source, archive_dir)
+        for table in case.reset:
+            db.table(table).delete().execute()
+
+    def once():
+        return invoke(module.handler, case.method, case.path, case.body, HEADERS)
+
+    restore(db, source, archive_dir)
+    for _ in range(warmup):
+        prepare()
+        once()
+
+    latencies, statuses, size, phases = [], set(), 0, {}
+    db_before, tempiro_before = db_stats(), _tempiro_calls(tempiro_stats())
+    for _ in range(iterations):
+        prepare()
+        started = time.perf_counter()
+        status, response_headers, payload = once()
+        latencies.append((time.perf_counter() - started) * 1000)
+        statuses.add(status)
+        size = len(payload)
+        for name, ms in _server_timing(response_headers.get("Server-Timing")).items():
+            phases[name] = phases.get(name, 0.0) + ms
+    db_after, tempiro_after = db_stats(), _tempiro_calls(tempiro_stats())
+
+    prepare()
+    tracemalloc.start()
+    try:
+        once()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    n = max(iterations, 1)
+    return {
+        "path": case.path,
+        "method": case.method,
+        "status": sorted(statuses),
+        "iterations": iterations,
+        "p50_ms": round(_percentile(latencies, 0.5), 2),
+        "p90_ms": round(_percentile(latencies, 0.9), 2),
+        "p99_ms": round(_percentile(latencies, 0.99), 2),
+        "mean_ms": round(sum(latencies) / n, 2),
+        "min_ms": round(min(latencies), 2),
+        "max_ms": round(max(latencies), 2),
+        "db_requests": round((db_after["requests"] - db_before["requests"]) / n, 1),
+        "pages": round((db_after["pages"] - db_before["pages"]) / n, 1),
+        "rows": round((db_after["rows"] - db_before["rows"]) / n, 1),
+        "tempiro_calls": round((tempiro_after - tempiro_before) / n, 1),
+        "peak_kb": round(peak / 1024),
+        "bytes": size,
+        "phases_ms": {name: round(ms / n, 2) for name, ms in phases.items()},
+    }
+
+
+def _tempiro_calls(stats: dict) -> int:
+    return sum(st["calls"] for st in stats.values())
+
+
+# ── Jämförelse ──────────────────────────────────────────────────────────────
+
+COMPARED = ("p50_ms", "p90_ms", "rows", "pages", "peak_kb", "bytes")
+
+
+def compare(old: dict, new: dict, max_regression: float = None) -> bool:
+    """Skriv en tabell med ändringar per fall. False om något fall blivit
+    långsammare (p50) än max_regression procent."""
+    ok = True
+    print(f"\n{'fall':22}" + "".join(f"{m:>22}" for m in COMPARED), file=sys.stderr)
+    for name, res in new["cases"].items():
+        before = old.get("cases", {}).get(name)
+        if before is None:
+            print(f"{name:22} (nytt fall)", file=sys.stderr)
+            continue
+        cells = []
+        for m in COMPARED:
+            a, b = before.get(m), res.get(m)
+            if a is None or b is None:
+                cells.append(f"{'-':>22}")
+                continue
+            delta = (b - a) / a * 100 if a else 0.0
+            cells.append(f"{a:>9g} → {b:<9g}{delta:+.0f}%".rjust(22))
+        regressed = (max_regression is not None and before["p50_ms"]
+                     and (res["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100 > max_regression)
+        ok &= not regressed
+        print(f"{name:22}" + "".join(cells) + ("  ← REGRESSION" if regressed else ""), file=sys.stderr)
+    return ok
+
+
+# ── Main ────────────────────────────────────────────────────────────────────
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark för API-handlers över syntetisk data.")
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--years", type=float, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="SQLite-fil för datasetet (standard: i tempkatalogen)")
+    parser.add_argument("--regenerate", action="store_true", help="generera datasetet på nytt")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--cases", nargs="+", help="bara dessa fall (namn)")
+    parser.add_argument("--tempiro-latency-ms", type=float, default=0.0,
+                        help="fördröjning per anrop i Tempiro-mocken")
+    parser.add_argument("--output", help="skriv resultatet som JSON hit")
+    parser.add_argument("--compare", help="tidigare resultat att jämföra med")
+    parser.add_argument("--max-regression", type=float,
+                        help="returnera 1 om p50 för något fall ökat mer än så många procent")
+    args = parser.parse_args(argv)
+    if args.iterations < 1:
+        parser.error("--iterations måste vara minst 1")
+
+    path = args.db or os.path.join(
+        tempfile.gettempdir(), f"tempiro_bench_{args.devices}x{args.years:g}y_s{args.seed}.db")
+
+    # Tempiro-mocken i en bakgrundstråd, med samma enheter som datasetet
+    mock_args = argparse.Namespace(
+        devices=args.devices, seed=args.seed, latency_ms=args.tempiro_latency_ms, jitter_ms=0.0,
+        fail_rate=0.0, token_ttl=0.0, record=None, replay=None, upstream=None, verbose=False)
+    state = mock_tempiro.MockState(mock_args)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), mock_tempiro.make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    info = dataset(path, state.synthetic, args.years, args.regenerate)
+    # Handlers kör mot en kopia som restore() återställer från datasetet före varje fall
+    work = tempfile.mkdtemp(prefix="tempiro_bench_")
+    archive_dir = os.path.join(work, "archive")
+    shutil.copy(path, os.path.join(work, "tempiro.db"))
+
+    # api-modulerna läser miljön när de importeras
+    os.environ.update({
+        "TEMPIRO_DB": os.path.join(work, "tempiro.db"),
+        "TEMPIRO_BASE_URL": f"http://127.0.0.1:{server.server_address[1]}",
+        "TEMPIRO_USERNAME": "bench",
+        "TEMPIRO_PASSWORD": "bench",
+        "TEMPIRO_TOKEN_STORE": "memory",
+        "ARCHIVE_DIR": archive_dir,
+        "REQUEST_LOG": "0",   # loggrader per anrop skulle blandas med resultatet
+    })
+    from _db import get_db
+    db = get_db()
+
+    selected = [c for c in cases(next(iter(state.synthetic.devices)))
+                if not args.cases or c.name in args.cases]
+    results = {}
+    try:
+        for case in selected:
+            results[case.name] = run_case(case, db, args.warmup, args.iterations, path, archive_dir)
+            r = results[case.name]
+            print(f"{case.name:22} p50 {r['p50_ms']:9.1f} ms  p90 {r['p90_ms']:9.1f} ms  "
+                  f"{r['rows']:>9g} rader  {r['pages']:>5g} sidor  {r['peak_kb']:>7} kB  "
+                  f"{r['bytes']:>8} B  {r['status']}", file=sys.stderr)
+    finally:
+        server.shutdown()
+        shutil.rmtree(work, ignore_errors=True)
+
+    out = {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "devices": args.devices,
+            "years": args.years,
+            "seed": args.seed,
+            "aggregate_backend": os.environ.get("AGGREGATE_BACKEND", "auto"),
+            "iterations": args.iterations,
+            **info,
+        },
+        "cases": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(out, f, indent=2)
+    else:
+        print(json.dumps(out, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            if not compare(json.load(f), out, args.max_regression):
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
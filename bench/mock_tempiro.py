@@ -0,0 +1,345 @@
+"""
+Lokal ersättare för Tempiro-API:t, för last- och latenstester av synk,
+/api/devices och /api/switch utan att röra produktion.
+
+    python bench/mock_tempiro.py --devices 500 --latency-ms 80 --jitter-ms 40 --fail-rate 0.02
+    TEMPIRO_BASE_URL=http://127.0.0.1:5050 TEMPIRO_USERNAME=mock TEMPIRO_PASSWORD=mock ...
+
+Implementerar POST /Token, GET /api/devices, GET /api/Values/{id}/interval
+och PUT /api/devices/{id}/switch. Syntetiskt läge (standard) ger --devices
+enheter med deterministiska 15-minutersserier (samma värden för samma enhet
+och tid, oavsett vilket intervall som efterfrågas). Varje anrop fördröjs
+--latency-ms ± --jitter-ms och en andel --fail-rate besvaras med 503;
+--token-ttl får gamla tokens att ge 401, så förnyelsevägen testas.
+
+Record/replay:
+    --record DIR --upstream URL   proxar till ett riktigt API och sparar svaren i DIR
+    --replay DIR                  svarar med de sparade svaren
+
+Vid replay slås alla inspelade mätvärden för en enhet ihop och filtreras på
+det efterfrågade intervallet, så en synk med andra tider än inspelningen
+fungerar ändå. GET /_mock/stats ger antal anrop och fel per endpoint.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import requests
+
+VALUES_PATH = re.compile(r"^/api/Values/([^/]+)/interval$")
+SWITCH_PATH = re.compile(r"^/api/devices/([^/]+)/switch$")
+SLOT = timedelta(minutes=15)
+EPOCH = datetime(2020, 1, 1)
+
+
+def _unit(*parts) -> float:
+    """Deterministiskt tal i [0, 1) för nycklarna."""
+    digest = hashlib.blake2b("|".join(map(str, parts)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64
+
+
+class Synthetic:
+    """Syntetiska enheter och mätserier."""
+    def __init__(self, devices: int, seed: int = 0):
+        self.seed = seed
+        self.devices = {}
+        for i in range(devices):
+            device_id = f"mock-{seed}-{i:04d}"
+            self.devices[device_id] = {
+                "Id": device_id,
+                "Name": f"Säkring {i + 1}",
+                "DeviceId": 100000 + i,
+                "Value": 1,
+                "BatteryOK": True,
+                "FuseVoltageOK": True,
+                "Offline": False,
+                "HoursActive": 0,
+                # effekt (W) när säkringen drar: t.ex. varmvattenberedare 2 kW, element 600 W
+                "_watts": round(300 + 2700 * _unit(seed, device_id, "watts")),
+                "_duty": 0.2 + 0.5 * _unit(seed, device_id, "duty"),
+            }
+        self._lock = threading.Lock()
+
+    def _watts(self, d: dict, slot: int) -> float:
+        if _unit(self.seed, d["Id"], slot // 4) >= d["_duty"]:   # av/på per timme
+            return 0.0
+        return round(d["_watts"] * (0.85 + 0.3 * _unit(self.seed, d["Id"], slot)), 1)
+
+    def device_list(self) -> list:
+        slot = int((datetime.now() - EPOCH) / SLOT)
+        with self._lock:
+            out = []
+            for d in self.devices.values():
+                watts = self._watts(d, slot) if d["Value"] else 0.0
+                out.append({k: v for k, v in d.items() if not k.startswith("_")} | {
+                    "CurrentPower": watts,
+                    "LastUpdate": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+                })
+            return out
+
+    def values(self, device_id: str, from_dt: str, to_dt: str):
+        """Mätvärden var 15:e minut i [from, to] (lokal tid, som Tempiro), None för okänd enhet."""
+        d = self.devices.get(device_id)
+        if d is None:
+            return None
+        start = datetime.fromisoformat(from_dt)
+        first = -(-int((start - EPOCH).total_seconds()) // int(SLOT.total_seconds()))
+        last = int((datetime.fromisoformat(to_dt) - EPOCH) / SLOT)
+        out = []
+        for slot in range(first, last + 1):
+            watts = self._watts(d, slot)
+            out.append({
+                "DateTime": (EPOCH + slot * SLOT).strftime("%Y-%m-%dT%H:%M:%S"),
+                "CurrentValue": watts,
+                "DeltaPower": round(watts * 0.25 / 1000, 4),
+                # ungefärlig mätarställning: medeleffekt × tid, växer monotont
+                "AccumulatedValue": round(slot * d["_watts"] * d["_duty"] * 0.25 / 1000, 3),
+            })
+        return out
+
+    def switch(self, device_id: str, value: int):
+        with self._lock:
+            d = self.devices.get(device_id)
+            if d is None:
+                return None
+            d["Value"] = int(bool(value))
+            return {"Id": device_id, "Value": d["Value"]}
+
+
+class Recordings:
+    """Inspelade svar i en katalog, en JSON-fil per unik förfrågan."""
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self.exact = {}      # (metod, sökväg, query) → svar
+        self.by_path = {}    # (metod, sökväg) → senaste svaret
+        self.readings = {}   # device_id → {DateTime: mätvärde}
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".json"):
+                with open(os.path.join(path, name)) as f:
+                    self._index(json.load(f))
+
+    @staticmethod
+    def key(method: str, path: str, query: dict) -> tuple:
+        return method, path, urlencode(sorted((k, v[-1]) for k, v in query.items()))
+
+    def _index(self, rec: dict):
+        key = (rec["method"], rec["path"], rec["query"])
+        self.exact[key] = rec
+        self.by_path[key[:2]] = rec
+        m = VALUES_PATH.match(rec["path"])
+        if m and rec["status"] == 200 and isinstance(rec["body"], list):
+            series = self.readings.setdefault(m.group(1), {})
+            for v in rec["body"]:
+                series[v.get("DateTime") or v.get("timestamp")] = v
+
+    def save(self, method: str, path: str, query: dict, status: int, body):
+        key = self.key(method, path, query)
+        rec = {"method": method, "path": path, "query": key[2], "status": status, "body": body}
+        name = hashlib.sha1("\n".join(key).encode()).hexdigest()[:16] + ".json"
+        with self._lock:
+            with open(os.path.join(self.path, name), "w") as f:
+                json.dump(rec, f)
+            self._index(rec)
+
+    def lookup(self, method: str, path: str, query: dict):
+        """(status, body) för förfrågan, eller None om inget passande är inspelat."""
+        m = VALUES_PATH.match(path)
+        if method == "GET" and m and m.group(1) in self.readings:
+            lo, hi = query.get("from", [""])[-1], query.get("to", ["9999"])[-1]
+            series = self.readings[m.group(1)]
+            return 200, [series[ts] for ts in sorted(series) if lo <= ts <= hi]
+        rec = self.exact.get(self.key(method, path, query)) or self.by_path.get((method, path))
+        return (rec["status"], rec["body"]) if rec else None
+
+
+class MockState:
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.synthetic = Synthetic(args.devices, args.seed)
+        self.recordings = Recordings(args.record or args.replay) if (args.record or args.replay) else None
+        self.tokens = {}   # token → utfärdad (monotonic)
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def count(self, endpoint: str, status: int, ms: float):
+        with self.lock:
+            st = self.stats.setdefault(endpoint, {"calls": 0, "errors": 0, "total_ms": 0.0})
+            st["calls"] += 1
+            st["errors"] += int(status >= 400)
+            st["total_ms"] = round(st["total_ms"] + ms, 1)
+
+    def delay(self):
+        a = self.args
+        if a.latency_ms or a.jitter_ms:
+            with self.lock:
+                ms = a.latency_ms + self.random.uniform(-a.jitter_ms, a.jitter_ms)
+            time.sleep(max(0.0, ms) / 1000)
+
+    def fail(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.args.fail_rate
+
+    def issue_token(self) -> str:
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens[token] = time.monotonic()
+        return token
+
+    def authorized(self, header: str) -> bool:
+        token = (header or "").removeprefix("Bearer ").strip()
+        with self.lock:
+            issued = self.tokens.get(token)
+        if issued is None:
+            return False
+        return not self.args.token_ttl or time.monotonic() - issued < self.args.token_ttl
+
+
+def make_handler(state: MockState):
+    class handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive, som riktiga servern
+        disable_nagle_algorithm = True  # huvud och kropp skrivs separat – undvik 40 ms delayed ACK
+
+        def log_message(self, fmt, *args):
+            if state.args.verbose:
+                super().log_message(fmt, *args)
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length) if length else b""
+            try:
+                return json.loads(raw) if raw else None
+            except ValueError:
+                return None
+
+        def _send(self, status: int, body=None):
+            data = b"" if body is None else json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _endpoint(self, path: str) -> str:
+            if VALUES_PATH.match(path):
+                return "values"
+            if SWITCH_PATH.match(path):
+                return "switch"
+            return {"/Token": "token", "/api/devices": "devices"}.get(path, "other")
+
+        def _handle(self, method: str):
+            started = time.perf_counter()
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path == "/_mock/stats":
+                with state.lock:
+                    return self._send(200, state.stats)
+            body = self._body()
+            state.delay()
+            status, payload = self._dispatch(method, url.path, query, body)
+            self._send(status, payload)
+            state.count(self._endpoint(url.path), status, (time.perf_counter() - started) * 1000)
+
+        def _dispatch(self, method: str, path: str, query: dict, body) -> tuple:
+            if state.fail():
+                return 503, {"Message": "injected failure"}
+            if state.args.record:
+                return self._proxy(method, path, query, body)
+            if method == "POST" and path == "/Token":
+                return 200, {"access_token": state.issue_token(), "token_type": "bearer",
+                             "expires_in": 6 * 24 * 3600}
+            if not state.authorized(self.headers.get("Authorization")):
+                return 401, {"Message": "Authorization has been denied for this request."}
+            if state.args.replay:
+                found = state.recordings.lookup(method, path, query)
+                return found or (404, {"Message": "not recorded"})
+
+            if method == "GET" and path == "/api/devices":
+                return 200, state.synthetic.device_list()
+            m = VALUES_PATH.match(path)
+            if method == "GET" and m:
+                try:
+                    values = state.synthetic.values(m.group(1), query["from"][-1], query["to"][-1])
+                except (KeyError, ValueError):
+                    return 400, {"Message": "from/to saknas eller är ogiltiga"}
+                return (404, {"Message": "unknown device"}) if values is None else (200, values)
+            m = SWITCH_PATH.match(path)
+            if method == "PUT" and m:
+                result = state.synthetic.switch(m.group(1), (body or {}).get("value", 0))
+                return (404, {"Message": "unknown device"}) if result is None else (200, result)
+            return 404, {"Message": "not found"}
+
+        def _proxy(self, method: str, path: str, query: dict, body) -> tuple:
+            headers = {"Accept": "application/json"}
+            if self.headers.get("Authorization"):
+                headers["Authorization"] = self.headers["Authorization"]
+            resp = requests.request(
+                method, state.args.upstream.rstrip("/") + path,
+                params={k: v[-1] for k, v in query.items()},
+                json=body, headers=headers, timeout=60)
+            try:
+                payload = resp.json() if resp.content else None
+            except ValueError:
+                payload = {"raw": resp.text}
+            if path != "/Token":   # tokens och lösenord sparas aldrig
+                state.recordings.save(method, path, query, resp.status_code, payload)
+            return resp.status_code, payload
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+        def do_PUT(self):
+            self._handle("PUT")
+
+    return handler
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Lokal Tempiro-mock med syntetisk data och record/replay.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5050)
+    parser.add_argument("--devices", type=int, default=10, help="antal syntetiska enheter")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="fördröjning per anrop")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="± slumpmässig extra fördröjning")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="andel anrop som ger 503")
+    parser.add_argument("--token-ttl", type=float, default=0.0, help="sekunder innan en token ger 401 (0 = aldrig)")
+    parser.add_argument("--record", metavar="DIR", help="proxa till --upstream och spara svaren")
+    parser.add_argument("--upstream", default="http://xmpp.tempiro.com:5000")
+    parser.add_argument("--replay", metavar="DIR", help="svara med inspelade svar")
+    parser.add_argument("--verbose", action="store_true", help="logga varje anrop")
+    args = parser.parse_args(argv)
+    if args.record and args.replay:
+        parser.error("--record och --replay kan inte kombineras")
+
+    state = MockState(args)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    server.daemon_threads = True
+    mode = "record" if args.record else "replay" if args.replay else f"{args.devices} enheter"
+    print(f"Tempiro-mock ({mode}) på http://{args.host}:{server.server_address[1]}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
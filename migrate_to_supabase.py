@@ -1,142 +1,251 @@
 """
 Migrerar befintlig SQLite-data till Supabase.
-Kör en gång lokalt: python migrate_to_supabase.py
+
+Läser SQLite med en strömmande cursor, laddar upp flera batchar samtidigt
+med omförsök och sparar efter varje bekräftad batch senaste nyckeln i en
+checkpoint-fil, så en avbruten körning fortsätter där den slutade. Med
+--dsn (eller DATABASE_URL) skrivs raderna direkt till Postgres med COPY i
+stället för via PostgREST (se api/_writer.py).
+
+    export SUPABASE_URL=https://xxx.supabase.co
+    export SUPABASE_SECRET=din_secret_key
+    python migrate_to_supabase.py --sqlite tempiro_data.db
+    python migrate_to_supabase.py --sqlite tempiro_data.db --tables spot_prices --restart
 """
-import sqlite3
+import argparse
+import json
 import os
+import random
+import sqlite3
 import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from supabase import create_client
 
-SUPABASE_URL = "https://vkecqtpxygfhwqesievk.supabase.co"
-SUPABASE_SECRET = os.environ.get("SUPABASE_SECRET")
-SQLITE_PATH = "/Users/henriksvedstrom/Documents/Claude_projects/tempiro-integration/tempiro_data.db"
-BATCH_SIZE = 500  # Antal rader per batch
-
-
-def migrate():
-    if not SUPABASE_SECRET:
-        print("Sätt miljövariabel: export SUPABASE_SECRET=din_secret_key")
-        sys.exit(1)
-
-    db = create_client(SUPABASE_URL, SUPABASE_SECRET)
-    conn = sqlite3.connect(SQLITE_PATH)
-    conn.row_factory = sqlite3.Row
-
-    # --- Migrera energy_readings ---
-    print("\n=== Migrerar energy_readings ===")
-    cursor = conn.execute("SELECT COUNT(*) FROM energy_readings")
-    total = cursor.fetchone()[0]
-    print(f"Totalt {total} rader att migrera...")
-
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "api"))
+from _writer import get_writer
+
+BATCH_SIZE = 500   # Antal rader per batch
+WORKERS = 4        # Batchar som laddas upp samtidigt
+RETRIES = 5        # Omförsök per batch innan migreringen avbryts
+CHECKPOINT = "migrate_checkpoint.json"
+
+
+def iso_timestamp(ts: str) -> str:
+    """SQLite-tidsstämpel → ISO-format med tidszon."""
+    if "T" not in ts:
+        ts = ts.replace(" ", "T")
+    if not ts.endswith("Z") and "+" not in ts:
+        ts += "Z"
+    return ts
+
+
+class TableSpec:
+    """Hur en SQLite-tabell kopieras.
+
+    key är en unik sorteringsnyckel i SQLite (läsordning och checkpoint),
+    on_conflict Supabase-tabellens konfliktnyckel och convert gör om en
+    SQLite-rad till en Supabase-rad.
+    """
+    def __init__(self, name: str, columns: tuple, key: tuple, on_conflict: str, convert):
+        self.name = name
+        self.columns = columns
+        self.key = key
+        self.on_conflict = on_conflict
+        self.convert = convert
+
+    def query(self, after=None) -> tuple:
+        """(sql, parametrar) för raderna efter nyckeln `after`, i nyckelordning."""
+        where = ""
+        if after is not None:
+            where = f"WHERE ({', '.join(self.key)}) > ({', '.join('?' * len(self.key))})"
+        sql = (f"SELECT {', '.join(self.columns)} FROM {self.name} {where} "
+               f"ORDER BY {', '.join(self.key)}")
+        return sql, tuple(after or ())
+
+
+def energy_spec(db, conn) -> TableSpec:
+    """energy_readings: enheterna upsertas först i devices (senaste namnet
+    vinner) och raderna refererar dem med device_key."""
     cursor = conn.execute("""
-        SELECT device_id, device_name, timestamp, delta_power, accumulated_value, current_value
-        FROM energy_readings
-        ORDER BY timestamp ASC
+        SELECT device_id, device_name FROM energy_readings AS e
+        WHERE timestamp = (SELECT MAX(timestamp) FROM energy_readings WHERE device_id = e.device_id)
+        GROUP BY device_id
     """)
-
-    batch = []
-    migrated = 0
-    errors = 0
-
-    for row in cursor:
-        # Konvertera timestamp till ISO-format med tidzon
-        ts = row["timestamp"]
-        if "T" not in ts:
-            ts = ts.replace(" ", "T")
-        if not ts.endswith("Z") and "+" not in ts:
-            ts += "Z"
-
-        batch.append({
-            "device_id": row["device_id"],
-            "device_name": row["device_name"],
-            "timestamp": ts,
+    devices = [{"device_id": r["device_id"], "device_name": r["device_name"]} for r in cursor]
+    keys = {}
+    if devices:
+        res = db.table("devices").upsert(devices, on_conflict="device_id").execute()
+        keys = {r["device_id"]: r["device_key"] for r in res.data}
+    print(f"  {len(keys)} enheter i devices.")
+
+    return TableSpec(
+        "energy_readings",
+        ("device_id", "timestamp", "delta_power", "accumulated_value", "current_value"),
+        ("timestamp", "device_id"),
+        "device_key,timestamp",
+        lambda row: {
+            "device_key": keys[row["device_id"]],
+            "timestamp": iso_timestamp(row["timestamp"]),
             "delta_power": row["delta_power"] or 0,
             "accumulated_value": row["accumulated_value"] or 0,
             "current_value": row["current_value"] or 0,
-        })
+        },
+    )
+
+
+def prices_spec(db, conn) -> TableSpec:
+    return TableSpec(
+        "spot_prices",
+        ("timestamp", "price_area", "price_sek", "price_eur"),
+        ("timestamp", "price_area"),
+        "timestamp,price_area",
+        lambda row: {
+            "timestamp": iso_timestamp(row["timestamp"]),
+            "price_area": row["price_area"],
+            "price_sek": row["price_sek"] or 0,
+            "price_eur": row["price_eur"],
+        },
+    )
 
-        if len(batch) >= BATCH_SIZE:
-            try:
-                db.table("energy_readings").upsert(
-                    batch, on_conflict="device_id,timestamp"
-                ).execute()
-                migrated += len(batch)
-                print(f"  {migrated}/{total} rader migrerade...", end="\r")
-            except Exception as e:
-                errors += 1
-                print(f"\n  FEL i batch: {e}")
-            batch = []
 
-    # Sista batchen
-    if batch:
-        try:
-            db.table("energy_readings").upsert(
-                batch, on_conflict="device_id,timestamp"
-            ).execute()
-            migrated += len(batch)
-        except Exception as e:
-            errors += 1
-            print(f"\n  FEL i sista batch: {e}")
-
-    print(f"\n  Klart! {migrated} rader migrerade, {errors} fel.")
-
-    # --- Migrera spot_prices ---
-    print("\n=== Migrerar spot_prices ===")
-    cursor = conn.execute("SELECT COUNT(*) FROM spot_prices")
-    total = cursor.fetchone()[0]
-    print(f"Totalt {total} rader att migrera...")
+TABLES = {"energy_readings": energy_spec, "spot_prices": prices_spec}
 
-    cursor = conn.execute("""
-        SELECT timestamp, price_area, price_sek, price_eur
-        FROM spot_prices
-        ORDER BY timestamp ASC
-    """)
 
-    batch = []
-    migrated = 0
-    errors = 0
+class Checkpoint:
+    """Senast bekräftade nyckel per tabell i en JSON-fil."""
+    def __init__(self, path: str, restart: bool = False):
+        self.path = path
+        self.keys = {}
+        if not restart and os.path.exists(path):
+            with open(path) as f:
+                self.keys = json.load(f)
 
-    for row in cursor:
-        ts = row["timestamp"]
-        if "T" not in ts:
-            ts = ts.replace(" ", "T")
-        if not ts.endswith("Z") and "+" not in ts:
-            ts += "Z"
+    def get(self, table: str):
+        return self.keys.get(table)
 
-        batch.append({
-            "timestamp": ts,
-            "price_area": row["price_area"],
-            "price_sek": row["price_sek"] or 0,
-            "price_eur": row["price_eur"],
-        })
+    def save(self, table: str, key: list):
+        self.keys[table] = key
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.keys, f)
+        os.replace(tmp, self.path)   # en avbruten skrivning lämnar den gamla filen hel
 
-        if len(batch) >= BATCH_SIZE:
+
+def upload(writer, spec: TableSpec, batch: list, retries: int):
+    """Upserta en batch; nätverks- och serverfel försöks om med exponentiell
+    backoff och jitter."""
+    for attempt in range(retries + 1):
+        try:
+            writer.upsert(spec.name, batch, on_conflict=spec.on_conflict)
+            return
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(min(30.0, 0.5 * 2 ** attempt) * (1 + random.random()))
+
+
+def copy_table(writer, conn, spec: TableSpec, checkpoint: Checkpoint, batch_size: int = BATCH_SIZE,
+               workers: int = WORKERS, retries: int = RETRIES) -> bool:
+    """Kopiera tabellen från checkpointen och framåt. Batchar laddas upp
+    parallellt medan nästa läses; checkpointen flyttas bara fram över
+    batchar som är klara i läsordning. Returnerar False om en batch
+    misslyckades även efter omförsök."""
+    sql, params = spec.query(checkpoint.get(spec.name))
+    total = conn.execute(f"SELECT COUNT(*) FROM ({sql})", params).fetchone()[0]
+    resumed = " (fortsätter från checkpoint)" if checkpoint.get(spec.name) else ""
+    print(f"Totalt {total} rader att migrera{resumed}...")
+
+    cursor = conn.execute(sql, params)
+    pool = ThreadPoolExecutor(max_workers=max(1, workers))
+    pending = deque()   # (future, sista nyckel, antal rader) i läsordning
+    state = {"done": 0, "error": None}
+    started = time.monotonic()
+
+    def settle(wait_first: bool):
+        while pending and state["error"] is None and (wait_first or pending[0][0].done()):
+            wait_first = False
+            fut, key, n = pending.popleft()
             try:
-                db.table("spot_prices").upsert(
-                    batch, on_conflict="timestamp,price_area"
-                ).execute()
-                migrated += len(batch)
-                print(f"  {migrated}/{total} rader migrerade...", end="\r")
+                fut.result()
             except Exception as e:
-                errors += 1
-                print(f"\n  FEL i batch: {e}")
-            batch = []
+                state["error"] = e
+                return
+            state["done"] += n
+            checkpoint.save(spec.name, key)
+            rate = state["done"] / max(time.monotonic() - started, 1e-9)
+            print(f"  {state['done']}/{total} rader migrerade, {rate:.0f} rader/s", end="\r")
+
+    try:
+        while state["error"] is None:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            batch = [spec.convert(r) for r in rows]
+            key = [rows[-1][k] for k in spec.key]
+            pending.append((pool.submit(upload, writer, spec, batch, retries), key, len(rows)))
+            settle(len(pending) >= 2 * workers)   # högst 2 × workers batchar i luften
+        while pending and state["error"] is None:
+            settle(True)
+    finally:
+        pool.shutdown(wait=True)
+
+    elapsed = time.monotonic() - started
+    rate = state["done"] / max(elapsed, 1e-9)
+    if state["error"] is not None:
+        print(f"\n  FEL: {state['error']}")
+        print(f"  {state['done']} rader migrerade innan felet; kör igen för att fortsätta.")
+        return False
+    print(f"\n  Klart! {state['done']} rader på {elapsed:.1f}s ({rate:.0f} rader/s).")
+    return True
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Migrera SQLite-data (Tempiro) till Supabase.")
+    parser.add_argument("--sqlite", default=os.environ.get("SQLITE_PATH"),
+                        help="SQLite-databasen (standard: $SQLITE_PATH)")
+    parser.add_argument("--url", default=os.environ.get("SUPABASE_URL"),
+                        help="Supabase-URL (standard: $SUPABASE_URL)")
+    parser.add_argument("--dsn", default=os.environ.get("DATABASE_URL"),
+                        help="Postgres-DSN för COPY-skrivning (standard: $DATABASE_URL, annars PostgREST)")
+    parser.add_argument("--tables", nargs="+", choices=list(TABLES), default=list(TABLES),
+                        help="tabeller att migrera (standard: alla)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="parallella uppladdningar")
+    parser.add_argument("--retries", type=int, default=RETRIES, help="omförsök per batch")
+    parser.add_argument("--checkpoint", default=CHECKPOINT, help="fil med senaste migrerade nyckel")
+    parser.add_argument("--restart", action="store_true", help="ignorera checkpointen och börja om")
+    args = parser.parse_args(argv)
+
+    secret = os.environ.get("SUPABASE_SECRET")
+    if not secret:
+        print("Sätt miljövariabel: export SUPABASE_SECRET=din_secret_key")
+        return 1
+    if not args.sqlite or not args.url:
+        parser.error("--sqlite och --url (eller SQLITE_PATH och SUPABASE_URL) krävs")
 
-    if batch:
-        try:
-            db.table("spot_prices").upsert(
-                batch, on_conflict="timestamp,price_area"
-            ).execute()
-            migrated += len(batch)
-        except Exception as e:
-            errors += 1
-            print(f"\n  FEL i sista batch: {e}")
+    db = create_client(args.url, secret)
+    writer = get_writer(db, dsn=args.dsn, backend="copy" if args.dsn else "postgrest")
+    conn = sqlite3.connect(args.sqlite, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    checkpoint = Checkpoint(args.checkpoint, restart=args.restart)
 
-    print(f"\n  Klart! {migrated} rader migrerade, {errors} fel.")
+    ok = True
+    try:
+        for name in args.tables:
+            print(f"\n=== Migrerar {name} ===")
+            spec = TABLES[name](db, conn)
+            if not copy_table(writer, conn, spec, checkpoint, args.batch_size, args.workers, args.retries):
+                ok = False
+                break
+    finally:
+        conn.close()
+        writer.close()
 
-    conn.close()
-    print("\n✅ Migrering klar!")
+    print("\n✅ Migrering klar!" if ok else "\n❌ Migreringen avbröts.")
+    return 0 if ok else 1
 
 
 if __name__ == "__main__":
-    migrate()
+    sys.exit(main())
@@ -0,0 +1,63 @@
+-- Tempiro Energy Monitor - migrering till enhetsdimensionen devices
+-- För installationer där energy_readings bär device_id och device_name på
+-- varje rad. Kör detta i Supabase SQL Editor före supabase_schema.sql (som
+-- sedan skapar aggregeringsfunktionerna mot device_key). Fungerar både för
+-- partitionerad och opartitionerad energy_readings; allt sker i en transaktion.
+
+BEGIN;
+
+-- Lås ute skrivningar (sync) under omskrivningen
+LOCK TABLE energy_readings IN EXCLUSIVE MODE;
+
+CREATE TABLE IF NOT EXISTS devices (
+    device_key INT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    device_id TEXT NOT NULL UNIQUE,
+    device_name TEXT NOT NULL
+);
+
+-- En rad per enhet; senaste namnet vinner
+INSERT INTO devices (device_id, device_name)
+SELECT DISTINCT ON (device_id) device_id, device_name
+FROM energy_readings
+ORDER BY device_id, timestamp DESC
+ON CONFLICT (device_id) DO UPDATE SET device_name = EXCLUDED.device_name;
+
+ALTER TABLE energy_readings ADD COLUMN IF NOT EXISTS device_key INT;
+UPDATE energy_readings e SET device_key = d.device_key
+FROM devices d
+WHERE d.device_id = e.device_id;
+ALTER TABLE energy_readings ALTER COLUMN device_key SET NOT NULL;
+
+-- Unik nyckel (device_key, timestamp) för upsert. Partitionerad tabell: som
+-- primärnyckel (partitionsnyckeln måste ingå); opartitionerad: id är redan
+-- primärnyckel, så som UNIQUE.
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'energy_readings'::regclass) = 'p' THEN
+        ALTER TABLE energy_readings DROP CONSTRAINT IF EXISTS energy_readings_pkey;
+        ALTER TABLE energy_readings ADD PRIMARY KEY (device_key, timestamp);
+    ELSE
+        ALTER TABLE energy_readings DROP CONSTRAINT IF EXISTS energy_readings_device_id_timestamp_key;
+        ALTER TABLE energy_readings ADD CONSTRAINT energy_readings_device_key_timestamp_key
+            UNIQUE (device_key, timestamp);
+    END IF;
+END $$;
+
+ALTER TABLE energy_readings ADD FOREIGN KEY (device_key) REFERENCES devices (device_key);
+
+-- Textkolumnerna och deras index behövs inte längre
+DROP INDEX IF EXISTS idx_energy_time_device;
+DROP INDEX IF EXISTS idx_energy_device_time;
+ALTER TABLE energy_readings DROP COLUMN device_id, DROP COLUMN device_name;
+CREATE INDEX idx_energy_time_device ON energy_readings(timestamp, device_key);
+
+ALTER TABLE devices ENABLE ROW LEVEL SECURITY;
+DROP POLICY IF EXISTS "Allow read" ON devices;
+CREATE POLICY "Allow read" ON devices FOR SELECT USING (true);
+
+COMMIT;
+
+ANALYZE energy_readings;
+
+-- UPDATE:en lämnar en död kopia av varje rad; autovacuum städar den, eller kör
+-- separat (utanför transaktion): VACUUM energy_readings;
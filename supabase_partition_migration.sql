@@ -0,0 +1,58 @@
+-- Tempiro Energy Monitor - migrering till månadspartitionerad energy_readings
+-- För installationer där energy_readings skapades som en vanlig tabell.
+-- Kör supabase_devices_migration.sql och supabase_schema.sql först (den
+-- senare skapar ensure_energy_partitions), sedan
+-- detta i Supabase SQL Editor. Allt sker i en transaktion; den gamla
+-- tabellen finns kvar som energy_readings_unpartitioned tills du tar bort den.
+
+BEGIN;
+
+-- Lås ute skrivningar (sync) under flytten
+LOCK TABLE energy_readings IN EXCLUSIVE MODE;
+
+-- Gamla tabellen och dess index byter namn så att namnen blir lediga
+ALTER TABLE energy_readings RENAME TO energy_readings_unpartitioned;
+ALTER INDEX IF EXISTS energy_readings_pkey RENAME TO energy_readings_unpartitioned_pkey;
+ALTER INDEX IF EXISTS energy_readings_device_key_timestamp_key RENAME TO energy_readings_unpartitioned_device_key_timestamp_key;
+ALTER INDEX IF EXISTS idx_energy_device_time RENAME TO idx_energy_unpartitioned_device_time;
+ALTER INDEX IF EXISTS idx_energy_timestamp RENAME TO idx_energy_unpartitioned_timestamp;
+ALTER INDEX IF EXISTS idx_energy_time_device RENAME TO idx_energy_unpartitioned_time_device;
+ALTER INDEX IF EXISTS brin_energy_timestamp RENAME TO brin_energy_unpartitioned_timestamp;
+
+-- Ny partitionerad tabell (samma kolumner, id fortsätter på samma sekvens)
+CREATE TABLE energy_readings (
+    id BIGINT NOT NULL DEFAULT nextval('energy_readings_id_seq'),
+    device_key INT NOT NULL REFERENCES devices (device_key),
+    timestamp TIMESTAMPTZ NOT NULL,
+    delta_power REAL NOT NULL,
+    accumulated_value REAL NOT NULL,
+    current_value REAL,
+    PRIMARY KEY (device_key, timestamp)
+) PARTITION BY RANGE (timestamp);
+ALTER SEQUENCE energy_readings_id_seq OWNED BY energy_readings.id;
+
+CREATE TABLE energy_readings_default PARTITION OF energy_readings DEFAULT;
+CREATE INDEX idx_energy_time_device ON energy_readings(timestamp, device_key);
+CREATE INDEX brin_energy_timestamp ON energy_readings USING brin (timestamp);
+
+-- En partition per månad från äldsta mätningen till två månader framåt
+SELECT ensure_energy_partitions((SELECT min(timestamp) FROM energy_readings_unpartitioned)::date);
+
+-- Kopiera i tidsordning (ger BRIN-indexet tätt packade intervall)
+INSERT INTO energy_readings (id, device_key, timestamp, delta_power, accumulated_value, current_value)
+SELECT id, device_key, timestamp, delta_power, accumulated_value, current_value
+FROM energy_readings_unpartitioned
+ORDER BY timestamp, device_key;
+
+-- Samma åtkomst som tidigare
+ALTER TABLE energy_readings ENABLE ROW LEVEL SECURITY;
+ALTER TABLE energy_readings_default ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Allow read" ON energy_readings FOR SELECT USING (true);
+CREATE POLICY "Allow insert" ON energy_readings FOR INSERT WITH CHECK (true);
+
+COMMIT;
+
+ANALYZE energy_readings;
+
+-- När allt är verifierat:
+-- DROP TABLE energy_readings_unpartitioned;
@@ -1,20 +1,89 @@
 -- Tempiro Energy Monitor - Supabase Schema
 -- Kör detta i Supabase SQL Editor
 
+-- Tabell: devices (enhetsdimension, uppdateras av /api/sync från Tempiros enhetslista)
+-- energy_readings refererar enheten med en kompakt heltalsnyckel; id och namn
+-- lagras bara här, så ett namnbyte gäller hela historiken.
+CREATE TABLE IF NOT EXISTS devices (
+    device_key INT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    device_id TEXT NOT NULL UNIQUE,
+    device_name TEXT NOT NULL
+);
+
 -- Tabell: energy_readings
+-- Partitionerad per månad på timestamp (energy_readings_YYYY_MM) så att
+-- tidsintervall bara läser berörda partitioner och index per partition hålls
+-- små. Partitioner skapas i förväg av ensure_energy_partitions() (anropas av
+-- /api/sync); rader utanför befintliga partitioner hamnar i
+-- energy_readings_default tills deras månad skapas.
+-- Befintlig opartitionerad tabell: se supabase_partition_migration.sql.
+-- Tabell med device_id/device_name per rad: se supabase_devices_migration.sql.
 CREATE TABLE IF NOT EXISTS energy_readings (
-    id BIGSERIAL PRIMARY KEY,
-    device_id TEXT NOT NULL,
-    device_name TEXT NOT NULL,
+    id BIGSERIAL,
+    device_key INT NOT NULL REFERENCES devices (device_key),
     timestamp TIMESTAMPTZ NOT NULL,
     delta_power REAL NOT NULL,
     accumulated_value REAL NOT NULL,
     current_value REAL,
-    UNIQUE(device_id, timestamp)
-);
+    PRIMARY KEY (device_key, timestamp)      -- partitionsnyckeln måste ingå; används av upsert
+) PARTITION BY RANGE (timestamp);
+
+-- Skapa saknade månadspartitioner från first_month (standard: förra månaden)
+-- t.o.m. months_ahead månader framåt (minst first_month). Rader för månaden som redan ligger i
+-- default-partitionen flyttas in. Returnerar antal skapade partitioner.
+CREATE OR REPLACE FUNCTION ensure_energy_partitions(first_month DATE DEFAULT NULL,
+                                                    months_ahead INT DEFAULT 2)
+RETURNS INT LANGUAGE plpgsql SECURITY DEFINER
+SET search_path = public SET timezone = 'UTC' AS $$
+DECLARE
+    m DATE := date_trunc('month', COALESCE(first_month, (now() - interval '1 month')::date))::date;
+    last_m DATE := GREATEST((date_trunc('month', now()) + make_interval(months => months_ahead))::date, m);
+    part TEXT;
+    created INT := 0;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'energy_readings'::regclass) <> 'p' THEN
+        RETURN 0;   -- opartitionerad tabell (före migreringen)
+    END IF;
+    WHILE m <= last_m LOOP
+        part := format('energy_readings_%s', to_char(m, 'YYYY_MM'));
+        IF to_regclass(part) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE energy_readings INCLUDING DEFAULTS)', part);
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM energy_readings_default WHERE timestamp >= %L AND timestamp < %L RETURNING *) '
+                'INSERT INTO %I SELECT * FROM moved', m, m + interval '1 month', part);
+            EXECUTE format('ALTER TABLE energy_readings ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           part, m, m + interval '1 month');
+            EXECUTE format('ALTER TABLE %I ENABLE ROW LEVEL SECURITY', part);
+            created := created + 1;
+        END IF;
+        m := (m + interval '1 month')::date;
+    END LOOP;
+    RETURN created;
+END $$;
 
-CREATE INDEX IF NOT EXISTS idx_energy_device_time ON energy_readings(device_id, timestamp DESC);
-CREATE INDEX IF NOT EXISTS idx_energy_timestamp ON energy_readings(timestamp DESC);
+-- Partitionerna skapas med ägarens rättigheter – bara secret key (service_role) får anropa
+REVOKE ALL ON FUNCTION ensure_energy_partitions(DATE, INT) FROM PUBLIC;
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_roles WHERE rolname = 'service_role') THEN
+        REVOKE ALL ON FUNCTION ensure_energy_partitions(DATE, INT) FROM anon, authenticated;
+        GRANT EXECUTE ON FUNCTION ensure_energy_partitions(DATE, INT) TO service_role;
+    END IF;
+END $$;
+
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'energy_readings'::regclass) = 'p' THEN
+        CREATE TABLE IF NOT EXISTS energy_readings_default PARTITION OF energy_readings DEFAULT;
+        ALTER TABLE energy_readings_default ENABLE ROW LEVEL SECURITY;
+        PERFORM ensure_energy_partitions();
+    END IF;
+END $$;
+
+-- (timestamp, device_key) för keyset-pagineringen, BRIN för breda intervall-scanningar
+-- (datan skrivs i tidsordning så BRIN blir litet och selektivt)
+CREATE INDEX IF NOT EXISTS idx_energy_time_device ON energy_readings(timestamp, device_key);
+CREATE INDEX IF NOT EXISTS brin_energy_timestamp ON energy_readings USING brin (timestamp);
 
 -- Tabell: spot_prices
 CREATE TABLE IF NOT EXISTS spot_prices (
@@ -39,17 +108,193 @@ CREATE TABLE IF NOT EXISTS sync_status (
     UNIQUE(sync_type, device_id)
 );
 
+-- Tabell: daily_summaries (rollup per dag och enhet, skrivs av /api/sync)
+-- day är lokal svensk dag (samma som energidatans fake-UTC-datum)
+CREATE TABLE IF NOT EXISTS daily_summaries (
+    day DATE NOT NULL,
+    device_id TEXT NOT NULL,
+    device_name TEXT NOT NULL,
+    kwh DOUBLE PRECISION NOT NULL,
+    cost DOUBLE PRECISION NOT NULL,          -- kr, timmedelpris (/api/daily)
+    readings INTEGER NOT NULL,
+    active_intervals INTEGER NOT NULL,
+    cost_15m DOUBLE PRECISION NOT NULL,      -- kr, 15-min pris (/api/monthly)
+    kwh_priced DOUBLE PRECISION NOT NULL,    -- kWh med känt 15-min pris
+    kwh_price_sum DOUBLE PRECISION NOT NULL, -- Σ kWh × öre/kWh, för snittpris
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (day, device_id)
+);
+
+-- Tabell: monthly_summaries (cache för avslutade månader, skrivs av /api/monthly och /api/sync)
+CREATE TABLE IF NOT EXISTS monthly_summaries (
+    month TEXT PRIMARY KEY,                  -- YYYY-MM
+    total_kwh DOUBLE PRECISION,
+    total_cost DOUBLE PRECISION,
+    avg_price_ore DOUBLE PRECISION,
+    readings INTEGER NOT NULL DEFAULT 0,
+    partial BOOLEAN NOT NULL DEFAULT false,
+    devices JSONB NOT NULL DEFAULT '{}'::jsonb,
+    stale BOOLEAN NOT NULL DEFAULT false     -- sync har skrivit sena data i månaden → räkna om
+);
+
+-- Befintliga installationer
+ALTER TABLE monthly_summaries ADD COLUMN IF NOT EXISTS stale BOOLEAN NOT NULL DEFAULT false;
+
+-- Tabell: archived_months (katalog över månader i Parquet-arkivet, skrivs av /api/archive)
+-- pruned = raderna är borttagna ur energy_readings och läses ur arkivfilen
+CREATE TABLE IF NOT EXISTS archived_months (
+    month TEXT PRIMARY KEY,                  -- YYYY-MM (lokal tid, som energidatan)
+    path TEXT NOT NULL,                      -- fil i arkivlagringen
+    rows INTEGER NOT NULL,
+    bytes BIGINT NOT NULL,
+    archived_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    pruned BOOLEAN NOT NULL DEFAULT false
+);
+
+-- Tabell: tempiro_tokens (delad Tempiro-auth-token mellan serverless-instanser)
+CREATE TABLE IF NOT EXISTS tempiro_tokens (
+    username TEXT PRIMARY KEY,
+    token TEXT NOT NULL,
+    expires TIMESTAMPTZ NOT NULL
+);
+
 -- Row Level Security (RLS) - läs-åtkomst med publishable key
+ALTER TABLE devices ENABLE ROW LEVEL SECURITY;
 ALTER TABLE energy_readings ENABLE ROW LEVEL SECURITY;
 ALTER TABLE spot_prices ENABLE ROW LEVEL SECURITY;
 ALTER TABLE sync_status ENABLE ROW LEVEL SECURITY;
+ALTER TABLE daily_summaries ENABLE ROW LEVEL SECURITY;
+ALTER TABLE monthly_summaries ENABLE ROW LEVEL SECURITY;
+ALTER TABLE archived_months ENABLE ROW LEVEL SECURITY;
+ALTER TABLE tempiro_tokens ENABLE ROW LEVEL SECURITY;   -- inga policies: bara secret key når tabellen
 
 -- Policy: alla kan läsa (publishable key)
+DROP POLICY IF EXISTS "Allow read" ON devices;
+CREATE POLICY "Allow read" ON devices FOR SELECT USING (true);
+DROP POLICY IF EXISTS "Allow read" ON energy_readings;
 CREATE POLICY "Allow read" ON energy_readings FOR SELECT USING (true);
+DROP POLICY IF EXISTS "Allow read" ON spot_prices;
 CREATE POLICY "Allow read" ON spot_prices FOR SELECT USING (true);
+DROP POLICY IF EXISTS "Allow read" ON sync_status;
 CREATE POLICY "Allow read" ON sync_status FOR SELECT USING (true);
+DROP POLICY IF EXISTS "Allow read" ON daily_summaries;
+CREATE POLICY "Allow read" ON daily_summaries FOR SELECT USING (true);
+DROP POLICY IF EXISTS "Allow read" ON monthly_summaries;
+CREATE POLICY "Allow read" ON monthly_summaries FOR SELECT USING (true);
+DROP POLICY IF EXISTS "Allow read" ON archived_months;
+CREATE POLICY "Allow read" ON archived_months FOR SELECT USING (true);
 
 -- Policy: bara server (secret key) kan skriva
+DROP POLICY IF EXISTS "Allow insert" ON energy_readings;
 CREATE POLICY "Allow insert" ON energy_readings FOR INSERT WITH CHECK (true);
+DROP POLICY IF EXISTS "Allow insert" ON spot_prices;
 CREATE POLICY "Allow insert" ON spot_prices FOR INSERT WITH CHECK (true);
+DROP POLICY IF EXISTS "Allow upsert" ON sync_status;
 CREATE POLICY "Allow upsert" ON sync_status FOR ALL USING (true);
+-- daily_summaries, monthly_summaries och archived_months skrivs bara med secret key (som går förbi RLS) – ingen skrivpolicy
+
+-- ── Aggregering i databasen (anropas via db.rpc från /api/daily och /api/monthly) ──
+-- Energidatan är lokal svensk tid lagrad som UTC (fake-UTC): face value fås med
+-- AT TIME ZONE 'UTC'. Spotpriser är riktig UTC och görs om med Europe/Stockholm.
+-- Prissättningen följer api/_aggregate.py: timmedelpris per lokal timme, och
+-- 15-min pris där senaste priset vinner och ett timpris (:00) fyller kvarter
+-- som saknar eget pris. Funktionerna returnerar en jsonb-array (ett svar,
+-- ingen max-rows-gräns) och körs med anroparens rättigheter (RLS gäller).
+
+CREATE OR REPLACE FUNCTION quarter_start(t TIMESTAMP)
+RETURNS TIMESTAMP LANGUAGE sql IMMUTABLE AS $$
+    SELECT date_trunc('hour', t) + floor(extract(minute FROM t) / 15) * interval '15 minutes'
+$$;
+
+-- En rad per energimätning i [from_ts, to_ts] med timmedelpris och 15-min pris (öre/kWh).
+-- REAL-kolumner går via text så att värdena blir desamma som i PostgREST-JSON.
+-- (DROP: returtypen ändrades när device_id/device_name ersattes av device_key)
+DROP FUNCTION IF EXISTS priced_readings(TIMESTAMPTZ, TIMESTAMPTZ, BOOLEAN);
+CREATE FUNCTION priced_readings(from_ts TIMESTAMPTZ, to_ts TIMESTAMPTZ DEFAULT NULL,
+                                to_exclusive BOOLEAN DEFAULT false)
+RETURNS TABLE (ts TIMESTAMPTZ, local_ts TIMESTAMP, device_key INT,
+               kwh DOUBLE PRECISION, active BOOLEAN,
+               hour_ore DOUBLE PRECISION, quarter_ore DOUBLE PRECISION)
+LANGUAGE sql STABLE AS $$
+    WITH energy AS (
+        SELECT e.timestamp AS ts, e.timestamp AT TIME ZONE 'UTC' AS local_ts,
+               e.device_key,
+               COALESCE(e.current_value::text::float8, 0) * 0.25 / 1000 AS kwh,
+               COALESCE(e.current_value, 0) > 0 OR COALESCE(e.delta_power, 0) > 0 AS active
+        FROM energy_readings e
+        WHERE e.timestamp >= from_ts
+          AND (to_ts IS NULL OR e.timestamp < to_ts OR (NOT to_exclusive AND e.timestamp = to_ts))
+    ),
+    prices AS (
+        SELECT p.timestamp AS ts, p.price_area, p.price_sek::text::float8 AS ore,
+               p.timestamp AT TIME ZONE 'Europe/Stockholm' AS local_ts
+        FROM spot_prices p
+        WHERE p.timestamp >= from_ts - interval '2 hours'
+          AND (to_ts IS NULL OR p.timestamp <= to_ts)
+    ),
+    hour_price AS (
+        SELECT date_trunc('hour', pr.local_ts) AS hour, avg(pr.ore) AS ore
+        FROM prices pr GROUP BY 1
+    ),
+    quarter_price AS (   -- senaste priset per kvart vinner
+        SELECT DISTINCT ON (quarter_start(pr.local_ts)) quarter_start(pr.local_ts) AS quarter, pr.ore
+        FROM prices pr
+        ORDER BY quarter_start(pr.local_ts), pr.ts DESC, pr.price_area DESC
+    ),
+    quarter_fill AS (    -- första timpriset (:00) fyller timmens kvarter utan eget pris
+        SELECT DISTINCT ON (date_trunc('hour', pr.local_ts)) date_trunc('hour', pr.local_ts) AS hour, pr.ore
+        FROM prices pr
+        WHERE extract(minute FROM pr.local_ts) < 15
+        ORDER BY date_trunc('hour', pr.local_ts), pr.ts, pr.price_area
+    )
+    SELECT e.ts, e.local_ts, e.device_key, e.kwh, e.active,
+           hp.ore, COALESCE(qp.ore, qf.ore)
+    FROM energy e
+    LEFT JOIN hour_price hp ON hp.hour = date_trunc('hour', e.local_ts)
+    LEFT JOIN quarter_price qp ON qp.quarter = quarter_start(e.local_ts)
+    LEFT JOIN quarter_fill qf ON qf.hour = date_trunc('hour', e.local_ts)
+$$;
+
+-- Dagsdelar per enhet (samma fält som daily_summaries), dagar i stigande ordning.
+-- Aggregeras per device_key; id och namn hämtas ur devices efteråt.
+CREATE OR REPLACE FUNCTION daily_rollup(from_ts TIMESTAMPTZ, to_ts TIMESTAMPTZ DEFAULT NULL)
+RETURNS JSONB LANGUAGE sql STABLE AS $$
+    SELECT COALESCE(jsonb_agg(to_jsonb(d) - 'first_ts' - 'device_key'
+                              ORDER BY d.day, d.first_ts, d.device_key), '[]'::jsonb)
+    FROM (
+        SELECT a.*, dv.device_id, dv.device_name
+        FROM (
+            SELECT r.local_ts::date AS day, r.device_key,
+                   sum(r.kwh) AS kwh,
+                   sum(r.kwh * COALESCE(r.hour_ore, 0) / 100) AS cost,
+                   count(*) AS readings,
+                   count(*) FILTER (WHERE r.active) AS active_intervals,
+                   COALESCE(sum(r.kwh * r.quarter_ore / 100), 0) AS cost_15m,
+                   COALESCE(sum(r.kwh) FILTER (WHERE r.quarter_ore IS NOT NULL), 0) AS kwh_priced,
+                   COALESCE(sum(r.kwh * r.quarter_ore), 0) AS kwh_price_sum,
+                   min(r.ts) AS first_ts
+            FROM priced_readings(from_ts, to_ts) r
+            GROUP BY 1, 2
+        ) a
+        JOIN devices dv ON dv.device_key = a.device_key
+    ) d
+$$;
+
+-- Månadssummor per enhetsnamn (aktuellt namn i devices) i [from_ts, to_ts) med 15-min pris.
+CREATE OR REPLACE FUNCTION monthly_rollup(from_ts TIMESTAMPTZ, to_ts TIMESTAMPTZ)
+RETURNS JSONB LANGUAGE sql STABLE AS $$
+    SELECT COALESCE(jsonb_agg(to_jsonb(m) - 'first_ts' - 'first_key' ORDER BY m.month, m.first_ts, m.first_key), '[]'::jsonb)
+    FROM (
+        SELECT to_char(r.local_ts, 'YYYY-MM') AS month, dv.device_name,
+               sum(r.kwh) AS kwh,
+               COALESCE(sum(r.kwh * r.quarter_ore / 100), 0) AS cost,
+               COALESCE(sum(r.kwh) FILTER (WHERE r.quarter_ore IS NOT NULL), 0) AS kwh_priced,
+               COALESCE(sum(r.kwh * r.quarter_ore), 0) AS wp,
+               count(*) AS readings,
+               min(r.ts) AS first_ts,
+               min(r.device_key) AS first_key
+        FROM priced_readings(from_ts, to_ts, true) r
+        JOIN devices dv ON dv.device_key = r.device_key
+        GROUP BY 1, 2
+    ) m
+$$;
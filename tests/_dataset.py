@@ -0,0 +1,85 @@
+"""Syntetiskt dataset för aggregeringstesterna.
+
+Energi för fyra enheter 2025-10-24 – 2025-11-02 (fake-UTC) och spotpriser i
+riktig UTC för två prisområden. Datat täcker vintertidsövergången i oktober
+(lokal timme 02 förekommer två gånger i prisströmmen), timpriser före och
+15-min priser efter 2025-10-27, en timme utan pris, mätningar utan värden, en
+enhet som döpts om till ett namn som redan finns och en nyckel som saknas i
+DEVICES.
+"""
+from datetime import datetime, timedelta
+
+PAGE_SIZE = 37   # udda storlek så att sidorna bryts mitt i dagar och timmar
+
+DEVICES = {
+    1: {"device_id": "dev-a", "device_name": "Varmvatten"},
+    2: {"device_id": "dev-b", "device_name": "Golvvärme"},
+    # bytt namn till samma som enhet 1 – slås ihop per månad
+    3: {"device_id": "dev-c", "device_name": "Varmvatten"},
+    # nyckel 4 saknas i tabellen och får nyckeln som id och namn
+}
+KEYS = (1, 2, 3, 4)
+
+# 2025-10-26 är sista söndagen i oktober: klockan ställs tillbaka 03:00 → 02:00
+ENERGY_FROM = datetime(2025, 10, 24)
+ENERGY_TO = datetime(2025, 11, 2, 6)
+QUARTER_PRICES_FROM = datetime(2025, 10, 27)   # 15-min priser därefter, timpriser före
+MISSING_PRICE_HOUR = datetime(2025, 10, 25, 10)   # UTC
+
+
+def readings() -> list:
+    """Energirader sorterade på (timestamp, device_key), som från PostgREST."""
+    rows = []
+    ts = ENERGY_FROM
+    i = 0
+    while ts < ENERGY_TO:
+        for key in KEYS:
+            i += 1
+            if key == 4 and ts.day != 31:
+                continue
+            watts = (i * 37 % 11) * 150.0
+            delta = round(watts * 0.25 / 1000, 4)
+            if i % 17 == 0:
+                watts = None
+            if i % 13 == 0:
+                delta = None
+            rows.append({"device_key": key, "timestamp": ts.isoformat() + "+00:00",
+                         "current_value": watts, "delta_power": delta})
+        ts += timedelta(minutes=15)
+    return rows
+
+
+def prices() -> list:
+    """Spotpriser i riktig UTC, sorterade på (timestamp, price_area)."""
+    rows = []
+    ts = ENERGY_FROM - timedelta(hours=2)
+    n = 0
+    while ts < ENERGY_TO:
+        step = timedelta(minutes=15) if ts >= QUARTER_PRICES_FROM else timedelta(hours=1)
+        if not (MISSING_PRICE_HOUR <= ts < MISSING_PRICE_HOUR + timedelta(hours=1)):
+            for area, extra in (("SE3", 0.0), ("SE4", 12.5)):
+                n += 1
+                rows.append({"timestamp": ts.isoformat() + "+00:00", "price_area": area,
+                             "price_sek": 40 + (n * 7 % 23) * 3.1 + extra})
+        ts += step
+    return rows
+
+
+def pages(rows: list) -> list:
+    return [rows[i:i + PAGE_SIZE] for i in range(0, len(rows), PAGE_SIZE)]
+
+
+def assert_same_totals(test, expected, actual, path=""):
+    """Lika nästlade resultat; flyttal jämförs med 9 decimaler (summeringsordningen skiljer)."""
+    if isinstance(expected, dict):
+        test.assertEqual(sorted(expected), sorted(actual), path)
+        for k in expected:
+            assert_same_totals(test, expected[k], actual[k], f"{path}/{k}")
+    elif isinstance(expected, tuple):
+        test.assertEqual(len(expected), len(actual), path)
+        for i, (e, a) in enumerate(zip(expected, actual)):
+            assert_same_totals(test, e, a, f"{path}[{i}]")
+    elif isinstance(expected, float) or isinstance(actual, float):
+        test.assertAlmostEqual(expected, actual, places=9, msg=path)
+    else:
+        test.assertEqual(expected, actual, path)
@@ -0,0 +1,58 @@
+"""NumPy-vägen (_vectorized.page_groups) mot rad-för-rad-vägen i _aggregate.
+
+Samma energisidor och priser (tests/_dataset.py) matas genom båda och
+resultatet ska vara lika för dag- och månadssummor.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("TEMPIRO_DB", ":memory:")   # _db kräver annars Supabase-miljön
+
+import _dataset
+import _vectorized
+from _aggregate import (PriceWindow, aggregate_daily, aggregate_daily_groups,
+                        aggregate_monthly, aggregate_monthly_groups, join_prices)
+
+DEVICES = _dataset.DEVICES
+
+
+def _groups(pages: list, prices: list, with_activity: bool):
+    window = PriceWindow(iter(prices))
+    for page in pages:
+        yield from _vectorized.page_groups(page, window, with_activity)
+
+
+@unittest.skipUnless(_vectorized.available(), "NumPy är inte installerat")
+class VectorizedEquivalenceTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pages = _dataset.pages(_dataset.readings())
+        cls.prices = _dataset.prices()
+
+    def test_daily(self):
+        expected = aggregate_daily(join_prices(self.pages, [self.prices]), DEVICES)
+        actual = aggregate_daily_groups(_groups(self.pages, self.prices, True), DEVICES)
+        _dataset.assert_same_totals(self, expected, actual)
+
+        self.assertIn("2025-10-26", expected)
+        self.assertEqual(expected["2025-10-31"]["4"]["device_name"], "4")
+        self.assertTrue(any(d["kwh_priced"] < d["kwh"] for d in expected["2025-10-25"].values()))
+
+    def test_monthly(self):
+        expected = aggregate_monthly(join_prices(self.pages, [self.prices]), DEVICES)
+        actual = aggregate_monthly_groups(_groups(self.pages, self.prices, False), DEVICES)
+        _dataset.assert_same_totals(self, expected, actual)
+
+        monthly, readings = expected
+        self.assertEqual(sorted(monthly), ["2025-10", "2025-11"])
+        self.assertEqual(sorted(monthly["2025-10"]), ["4", "Golvvärme", "Varmvatten"])
+        self.assertEqual(sum(readings.values()), sum(len(p) for p in self.pages))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+"""SQL-funktionerna daily_rollup/monthly_rollup mot rad-för-rad-vägen i _aggregate.
+
+Kräver en lokal Postgres och psycopg:
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost:5432/postgres python -m unittest tests.test_rollup_sql
+
+Testet skapar en tillfällig databas via TEST_DATABASE_URL (rollen behöver
+CREATEDB), kör supabase_schema.sql i den, lägger in datasetet från
+tests/_dataset.py och jämför funktionernas svar (via daily_from_rollup/
+monthly_from_rollup, som i daily_totals/monthly_totals) med samma rader och
+priser aggregerade i Python (AGGREGATE_BACKEND=python). Databasen tas bort
+efteråt. Utan TEST_DATABASE_URL hoppas testet över.
+"""
+import os
+import sys
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_DIR, "..", "api"))
+sys.path.insert(0, TESTS_DIR)
+os.environ.setdefault("TEMPIRO_DB", ":memory:")   # _db kräver annars Supabase-miljön
+
+import _dataset
+from _aggregate import (aggregate_daily, aggregate_monthly, daily_from_rollup,
+                        join_prices, monthly_from_rollup)
+from _devices import describe
+
+try:
+    import psycopg
+    from psycopg import sql
+    from psycopg.conninfo import make_conninfo
+except ImportError:   # valfritt beroende (pip install 'psycopg[binary]')
+    psycopg = None
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+SCHEMA = os.path.join(TESTS_DIR, "..", "supabase_schema.sql")
+
+# Tidsstämplar som PostgREST skickar dem; REAL via text som i priced_readings
+ENERGY_SQL = """
+    SELECT device_key,
+           to_char(timestamp AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"+00:00"') AS timestamp,
+           current_value::text::float8 AS current_value,
+           delta_power::text::float8 AS delta_power
+    FROM energy_readings
+    WHERE timestamp >= %(from_ts)s AND {upper}
+    ORDER BY timestamp, device_key
+"""
+PRICES_SQL = """
+    SELECT to_char(timestamp AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS"+00:00"') AS timestamp,
+           price_area, price_sek::text::float8 AS price_sek
+    FROM spot_prices
+    WHERE timestamp >= %(from_ts)s::timestamptz - interval '2 hours' AND {upper}
+    ORDER BY timestamp, price_area
+"""
+
+
+@unittest.skipUnless(TEST_DATABASE_URL and psycopg, "kräver TEST_DATABASE_URL och psycopg")
+class SqlRollupTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dbname = f"tempiro_rollup_test_{os.getpid()}"
+        cls.admin = psycopg.connect(TEST_DATABASE_URL, autocommit=True)
+        cls.admin.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(cls.dbname)))
+        cls.conn = psycopg.connect(make_conninfo(TEST_DATABASE_URL, dbname=cls.dbname),
+                                   autocommit=True)
+        cls.conn.execute("SET timezone = 'UTC'")
+        with open(SCHEMA) as f:
+            cls.conn.execute(f.read())
+
+        readings = _dataset.readings()
+        with cls.conn.transaction(), cls.conn.cursor() as cur:
+            cur.executemany(
+                "INSERT INTO devices (device_key, device_id, device_name) VALUES (%s, %s, %s)",
+                [(key, describe(_dataset.DEVICES, key)["device_id"],
+                  describe(_dataset.DEVICES, key)["device_name"]) for key in _dataset.KEYS])
+            cur.executemany(
+                "INSERT INTO energy_readings (device_key, timestamp, delta_power, accumulated_value,"
+                " current_value) VALUES (%s, %s, %s, 0, %s)",
+                [(r["device_key"], r["timestamp"], r["delta_power"] or 0, r["current_value"])
+                 for r in readings])
+            cur.executemany(
+                "INSERT INTO spot_prices (timestamp, price_area, price_sek) VALUES (%s, %s, %s)",
+                [(p["timestamp"], p["price_area"], p["price_sek"]) for p in _dataset.prices()])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+        cls.admin.execute(sql.SQL("DROP DATABASE {}").format(sql.Identifier(cls.dbname)))
+        cls.admin.close()
+
+    def _rows(self, query: str, params: dict) -> list:
+        cur = self.conn.execute(query, params)
+        columns = [c.name for c in cur.description]
+        return [dict(zip(columns, row)) for row in cur]
+
+    def _python(self, aggregate, from_ts: str, to_ts: str, to_exclusive: bool):
+        """Samma rader och priser som _open_streams hämtar, aggregerade rad för rad."""
+        upper = "timestamp < %(to_ts)s" if to_exclusive else "timestamp <= %(to_ts)s"
+        params = {"from_ts": from_ts, "to_ts": to_ts}
+        energy = self._rows(ENERGY_SQL.format(upper=upper), params)
+        prices = self._rows(PRICES_SQL.format(upper=upper), params)
+        devices = {r["device_key"]: {"device_id": r["device_id"], "device_name": r["device_name"]}
+                   for r in self._rows("SELECT * FROM devices", {})}
+        return aggregate(join_prices(_dataset.pages(energy), [prices]), devices)
+
+    def _rpc(self, fn: str, from_ts: str, to_ts: str) -> list:
+        query = sql.SQL("SELECT {}(%s, %s)").format(sql.Identifier(fn))
+        return self.conn.execute(query, (from_ts, to_ts)).fetchone()[0]
+
+    def test_daily_rollup(self):
+        from_ts, to_ts = "2025-10-24T06:00:00+00:00", "2025-11-01T23:45:00+00:00"
+        expected = self._python(aggregate_daily, from_ts, to_ts, False)
+        actual = daily_from_rollup(self._rpc("daily_rollup", from_ts, to_ts))
+        _dataset.assert_same_totals(self, expected, actual)
+        self.assertIn("2025-10-26", actual)
+        self.assertNotIn("2025-11-02", actual)
+
+    def test_monthly_rollup(self):
+        from_ts, to_ts = "2025-10-24T00:00:00+00:00", "2025-11-02T00:00:00+00:00"
+        expected = self._python(aggregate_monthly, from_ts, to_ts, True)
+        actual = monthly_from_rollup(self._rpc("monthly_rollup", from_ts, to_ts))
+        _dataset.assert_same_totals(self, expected, actual)
+        self.assertEqual(sorted(actual[0]["2025-10"]), ["4", "Golvvärme", "Varmvatten"])
+
+
+if __name__ == "__main__":
+    unittest.main()
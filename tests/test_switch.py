@@ -0,0 +1,70 @@
+"""PUT /api/switch: loggraden ska ha brytarläget (0/1) från anropet.
+
+Handlern körs i processen med switch_device/apply_switch utbytta, så inget
+anrop går till Tempiro.
+
+    python -m unittest tests.test_switch
+"""
+import contextlib
+import email.message
+import io
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+os.environ.setdefault("TEMPIRO_DB", ":memory:")   # _db kräver annars Supabase-miljön
+os.environ.setdefault("TEMPIRO_USERNAME", "test")
+os.environ.setdefault("TEMPIRO_PASSWORD", "test")
+os.environ.setdefault("TEMPIRO_TOKEN_STORE", "memory")
+
+import _instrument
+import switch
+
+
+def _put(body: dict) -> tuple:
+    """Kör switch.handler.do_PUT. Returnerar (status, loggrad)."""
+    data = json.dumps(body).encode()
+    msg = email.message.Message()
+    msg["Content-Length"] = str(len(data))
+
+    h = switch.handler.__new__(switch.handler)
+    h.headers = msg
+    h.rfile = io.BytesIO(data)
+    h.wfile = io.BytesIO()
+    h.request_version = "HTTP/1.1"
+    h.requestline = "PUT /api/switch HTTP/1.1"
+    h.command = "PUT"
+    h.client_address = ("127.0.0.1", 0)
+
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        h.do_PUT()
+    status = int(h.wfile.getvalue().split(b" ", 2)[1])
+    return status, json.loads(out.getvalue().splitlines()[-1])
+
+
+@mock.patch.object(_instrument, "REQUEST_LOG", True)
+@mock.patch.object(_instrument, "SLOW_REQUEST_MS", 0)
+@mock.patch.object(switch, "apply_switch")
+@mock.patch.object(switch, "switch_device", return_value={"ok": True})
+class SwitchLogTest(unittest.TestCase):
+    def test_logged_value(self, switch_device, apply_switch):
+        for value in (0, 1):
+            status, line = _put({"device_id": "dev-1", "value": value})
+            self.assertEqual(status, 200)
+            self.assertEqual(line["device_id"], "dev-1")
+            self.assertEqual(line["value"], value)
+            apply_switch.assert_called_with("dev-1", value)
+
+    def test_invalid_value(self, switch_device, apply_switch):
+        status, line = _put({"device_id": "dev-1", "value": 2})
+        self.assertEqual(status, 400)
+        self.assertEqual(line["status"], 400)
+        switch_device.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()